@@ -0,0 +1,269 @@
+"""
+Lap and sector analytics computed from a session's laps table.
+
+Built once per race with grouped pandas / NumPy operations over session.laps and
+cached next to the processed replays (see build_analytics_job), so clients get a
+few kilobytes of results instead of filtering megabytes of laps themselves:
+
+- laps: per driver best lap, best sectors, theoretical best (sum of the best
+  sectors) and the deltas of each to the session's best
+- stints: compound, lap range, mean / median clean lap and the degradation slope
+  (least-squares lap time vs. tyre life over the stint's clean laps)
+- pit_stops: pit lane time (PitOutTime of the out-lap - PitInTime of the in-lap)
+  and the estimated pit loss: time from the end of the lap before the in-lap to
+  the end of the out-lap, minus two of the driver's nearby clean laps
+- gaps: gap to the leader at the end of every lap (lap end session times, so
+  in/out laps and missing lap times don't accumulate errors)
+
+Times are in seconds, rounded to milliseconds; missing values are null.
+"""
+import os
+
+import numpy as np
+
+# Bump whenever the analytics payload changes (invalidates cached analytics)
+ANALYTICS_VERSION = 1
+
+PARTS = ('laps', 'stints', 'pit_stops', 'gaps')
+
+# Laps slower than this factor of the driver's stint median are traffic / incidents, not pace
+CLEAN_LAP_FACTOR = 1.07
+# Clean laps on each side of a stop used as the reference pace for its pit loss
+PIT_REFERENCE_LAPS = 5
+# Fewest clean laps a stint needs for a degradation slope
+MIN_SLOPE_LAPS = 3
+
+_SECTORS = ('Sector1Time', 'Sector2Time', 'Sector3Time')
+
+
+def _seconds(series):
+    import pandas as pd
+
+    if pd.api.types.is_timedelta64_dtype(series):
+        return series.dt.total_seconds()
+    return pd.to_numeric(series, errors='coerce')
+
+
+def _value(v, decimals=3):
+    import pandas as pd
+
+    return None if v is None or pd.isna(v) else round(float(v), decimals)
+
+
+def _values(array, decimals=3):
+    return [_value(v, decimals) for v in array]
+
+
+def prepare_laps(laps):
+    """
+    Numeric working frame: Driver (number as str), LapNumber, Stint, Compound, TyreLife, times in seconds,
+    lap end time (End), and the flags Valid (counts for best laps) and Clean (representative race pace).
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame({
+        'Driver': laps['DriverNumber'].astype(str).to_numpy(),
+        'LapNumber': pd.to_numeric(laps['LapNumber'], errors='coerce').to_numpy(),
+    })
+    for column in ('Stint', 'TyreLife'):
+        frame[column] = pd.to_numeric(laps[column], errors='coerce').to_numpy() if column in laps.columns else np.nan
+    frame['Compound'] = laps['Compound'].to_numpy() if 'Compound' in laps.columns else None
+    for column in ('LapTime', 'LapStartTime', 'PitInTime', 'PitOutTime', *_SECTORS):
+        frame[column] = _seconds(laps[column]).to_numpy() if column in laps.columns else np.nan
+    end = _seconds(laps['Time']).to_numpy() if 'Time' in laps.columns else np.full(len(frame), np.nan)
+    frame['End'] = np.where(np.isnan(end), frame['LapStartTime'] + frame['LapTime'], end)
+
+    deleted = laps['Deleted'].fillna(False).astype(bool).to_numpy() if 'Deleted' in laps.columns else False
+    frame['Valid'] = ~deleted
+    # Green-flag laps only ('1'); SC/VSC/yellow laps are not pace
+    green = laps['TrackStatus'].astype(str).str.fullmatch('1').to_numpy() if 'TrackStatus' in laps.columns else True
+    frame['Clean'] = (
+        frame['Valid'] & green & frame['LapTime'].notna() & frame['PitInTime'].isna() & frame['PitOutTime'].isna()
+        & (frame['LapNumber'] > 1)
+    )
+    stint_median = frame[frame['Clean']].groupby(['Driver', 'Stint'])['LapTime'].transform('median')
+    frame.loc[stint_median.index, 'Clean'] = frame.loc[stint_median.index, 'LapTime'] <= stint_median * CLEAN_LAP_FACTOR
+    return frame.dropna(subset=['LapNumber']).sort_values(['Driver', 'LapNumber'], kind='stable').reset_index(drop=True)
+
+
+def lap_summary(frame):
+    """Best lap, best sectors, theoretical best per driver, and their deltas to the session's best."""
+    valid = frame[frame['Valid']]
+    timed = valid.dropna(subset=['LapTime'])
+    best = timed.loc[timed.groupby('Driver', sort=False)['LapTime'].idxmin()].set_index('Driver')
+    sectors = valid.groupby('Driver', sort=False)[list(_SECTORS)].min()
+    # Theoretical best needs all three sectors
+    theoretical = sectors.sum(axis=1, min_count=3)
+    session_sectors = sectors.min()
+    session_best = valid['LapTime'].min()
+    session_theoretical = session_sectors.sum(min_count=3)
+
+    drivers = {}
+    for driver in sectors.index:
+        lap = best.loc[driver] if driver in best.index else None
+        best_time = lap['LapTime'] if lap is not None else np.nan
+        drivers[driver] = {
+            "best_lap": {"lap": int(lap['LapNumber']), "time": _value(best_time)} if lap is not None else None,
+            "best_lap_delta": _value(best_time - session_best),
+            "best_sectors": _values(sectors.loc[driver]),
+            "sector_deltas": _values(sectors.loc[driver] - session_sectors),
+            "theoretical_best": _value(theoretical.loc[driver]),
+            "theoretical_gain": _value(best_time - theoretical.loc[driver]),
+        }
+    return {
+        "session_best": {
+            "time": _value(session_best),
+            "driver": timed.loc[timed['LapTime'].idxmin(), 'Driver'] if not timed.empty else None,
+            "sectors": _values(session_sectors),
+            "theoretical_best": _value(session_theoretical),
+        },
+        "drivers": drivers,
+    }
+
+
+def stint_summary(frame):
+    """Per driver list of stints with their clean-lap pace and degradation slope (seconds per lap of tyre life)."""
+    import pandas as pd
+
+    stints = frame.dropna(subset=['Stint'])
+    grouped = stints.groupby(['Driver', 'Stint'], sort=True)
+    summary = grouped.agg(
+        compound=('Compound', 'first'),
+        start_lap=('LapNumber', 'min'),
+        end_lap=('LapNumber', 'max'),
+        laps=('LapNumber', 'size'),
+        tyre_life_start=('TyreLife', 'min'),
+        tyre_life_end=('TyreLife', 'max'),
+    )
+
+    # Least squares over the clean laps of every stint at once, from grouped sums
+    clean = stints[stints['Clean']]
+    x = clean['TyreLife'].where(clean['TyreLife'].notna(), clean['LapNumber'])
+    y = clean['LapTime']
+    sums = pd.DataFrame({'n': 1.0, 'x': x, 'y': y, 'xx': x * x, 'xy': x * y}, index=clean.index)
+    sums[['Driver', 'Stint']] = clean[['Driver', 'Stint']]
+    sums = sums.groupby(['Driver', 'Stint']).sum()
+    denominator = sums['n'] * sums['xx'] - sums['x'] ** 2
+    slope = (sums['n'] * sums['xy'] - sums['x'] * sums['y']) / denominator.where(denominator > 0)
+    slope = slope.where(sums['n'] >= MIN_SLOPE_LAPS)
+    pace = clean.groupby(['Driver', 'Stint'])['LapTime'].agg(['mean', 'median', 'size'])
+    summary = summary.join(pace).join(slope.rename('slope'))
+
+    out = {}
+    for (driver, stint), row in summary.iterrows():
+        compound = row['compound']
+        out.setdefault(driver, []).append({
+            "stint": int(stint),
+            "compound": compound if isinstance(compound, str) else None,
+            "start_lap": int(row['start_lap']),
+            "end_lap": int(row['end_lap']),
+            "laps": int(row['laps']),
+            "tyre_life_start": _value(row['tyre_life_start'], 0),
+            "tyre_life_end": _value(row['tyre_life_end'], 0),
+            "clean_laps": int(row['size']) if pd.notna(row['size']) else 0,
+            "mean_lap": _value(row['mean']),
+            "median_lap": _value(row['median']),
+            "degradation": _value(row['slope'], 4),
+        })
+    return out
+
+
+def pit_stops(frame):
+    """Pit stops (in-lap with a PitInTime followed by the out-lap) with pit lane time and estimated pit loss."""
+    stops = []
+    for driver, laps in frame.groupby('Driver', sort=False):
+        lap_number = laps['LapNumber'].to_numpy()
+        end = laps['End'].to_numpy()
+        clean = laps['Clean'].to_numpy()
+        lap_time = laps['LapTime'].to_numpy()
+        pit_in = laps['PitInTime'].to_numpy()
+        pit_out = laps['PitOutTime'].to_numpy()
+        for i in np.flatnonzero(~np.isnan(pit_in)):
+            out = i + 1 if i + 1 < len(laps) and lap_number[i + 1] == lap_number[i] + 1 else None
+            # Reference pace: the median of the clean laps around the stop
+            window = slice(max(0, i - PIT_REFERENCE_LAPS), i + PIT_REFERENCE_LAPS + 2)
+            nearby = lap_time[window][clean[window]]
+            reference = float(np.median(nearby)) if len(nearby) else np.nan
+            pit_lane = pit_out[out] - pit_in[i] if out is not None else np.nan
+            # Time from the end of the lap before the in-lap to the end of the out-lap, i.e. the in-lap plus the out-lap
+            before = end[i - 1] if i > 0 and lap_number[i - 1] == lap_number[i] - 1 else laps['LapStartTime'].iloc[i]
+            loss = end[out] - before - 2 * reference if out is not None else np.nan
+            stops.append({
+                "driver": driver,
+                "lap": int(lap_number[i]),
+                "compound_in": laps['Compound'].iloc[i] if isinstance(laps['Compound'].iloc[i], str) else None,
+                "compound_out": laps['Compound'].iloc[out] if out is not None and isinstance(laps['Compound'].iloc[out], str) else None,
+                "pit_in": _value(pit_in[i]),
+                "pit_lane": _value(pit_lane),
+                "reference_lap": _value(reference),
+                "pit_loss": _value(loss),
+            })
+    return sorted(stops, key=lambda s: (s["lap"], s["pit_in"] if s["pit_in"] is not None else 0.0))
+
+
+def gap_series(frame):
+    """Gap to the leader (first car to finish the lap) at the end of every lap, per driver."""
+    ends = frame.dropna(subset=['End']).pivot_table(index='LapNumber', columns='Driver', values='End', aggfunc='min')
+    if ends.empty:
+        return {"laps": [], "leader": [], "drivers": {}}
+    leader_end = ends.min(axis=1)
+    gaps = ends.sub(leader_end, axis=0)
+    return {
+        "laps": [int(n) for n in ends.index],
+        "leader": list(ends.idxmin(axis=1)),
+        "drivers": {driver: _values(gaps[driver].to_numpy()) for driver in gaps.columns},
+    }
+
+
+def build_analytics(laps):
+    """Analytics payload for a FastF1 laps table, or None without laps."""
+    if laps is None or laps.empty or 'DriverNumber' not in laps.columns or 'LapNumber' not in laps.columns:
+        return None
+    frame = prepare_laps(laps)
+    return {
+        "version": ANALYTICS_VERSION,
+        "drivers": sorted(frame['Driver'].unique(), key=lambda d: (len(d), d)),
+        "laps": lap_summary(frame),
+        "stints": stint_summary(frame),
+        "pit_stops": pit_stops(frame),
+        "gaps": gap_series(frame),
+    }
+
+
+def analytics_cache_key(year, race_name, session_type='R'):
+    from replay_cache import make_cache_key
+
+    return make_cache_key(year, race_name, session_type, 'analytics', ANALYTICS_VERSION)
+
+
+def publish_analytics(cache_root, year, race_name, session_type, session):
+    """Build the analytics from an already loaded session and store them unless cached. Returns 'cached', 'built' or None."""
+    from replay_cache import ReplayCache
+
+    cache = ReplayCache(cache_root, max_memory_items=0)
+    key, params = analytics_cache_key(year, race_name, session_type)
+    if cache.on_disk(key):
+        return 'cached'
+    payload = build_analytics(getattr(session, 'laps', None))
+    if payload is None:
+        return None
+    cache.put(key, payload, params=params)
+    return 'built'
+
+
+def build_analytics_job(cache_root, fastf1_cache_dir, year, race_name, session_type='R'):
+    """Process-pool entry point: load the session's laps (no telemetry) and publish its analytics."""
+    import fastf1
+
+    from sessions import load_session
+
+    if fastf1_cache_dir:
+        fastf1.Cache.enable_cache(fastf1_cache_dir)
+    key, params = analytics_cache_key(year, race_name, session_type)
+    if os.path.isfile(os.path.join(cache_root, key, 'key.json')):
+        return 'cached'
+    session = load_session(year, race_name, session_type, telemetry=False, weather=False, messages=False)
+    result = publish_analytics(cache_root, year, race_name, session_type, session)
+    if result is None:
+        raise LookupError(f"No laps for {year} {race_name}")
+    return result
@@ -0,0 +1,68 @@
+"""
+Scaling of build_replay_grid with the number of driver workers.
+
+    cd backend && python -m benchmarks.parallel_scaling --workers 1 2 4 8
+
+Builds the same synthetic race with each worker count, checks that every
+result is identical to the serial build (data, spans, t0, driver order,
+compound dictionary) and prints the best-of-N wall time and speedup.
+The pool is warmed up before timing, as it is in a long-running server.
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_session
+from replay_builder import build_replay_grid
+
+
+def _build(session, resample_rate, workers):
+    # build_replay_grid prints a line per driver
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_replay_grid(session, resample_rate, workers)
+
+
+def _same(a, b):
+    return (
+        a.t0 == b.t0
+        and a.drivers == b.drivers
+        and a.compounds == b.compounds
+        and np.array_equal(a.time, b.time)
+        and np.array_equal(a.spans, b.spans)
+        and np.array_equal(a.present, b.present)
+        and np.array_equal(a.data, b.data, equal_nan=True)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--drivers', type=int, default=20)
+    parser.add_argument('--laps', type=int, default=58)
+    parser.add_argument('--resample-rate', default='250ms')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    session = make_session(args.drivers, args.laps)
+    print(f"{args.drivers} drivers x {args.laps} laps at {args.resample_rate}, {os.cpu_count()} CPUs")
+    reference = _build(session, args.resample_rate, 1)
+
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        grid = _build(session, args.resample_rate, workers)  # warm-up (starts the pool)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            grid = _build(session, args.resample_rate, workers)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        baseline = best if baseline is None else baseline
+        print(f"workers={workers:<3} best {best:7.3f}s  speedup x{baseline / best:5.2f}  identical={_same(reference, grid)}")
+
+
+if __name__ == '__main__':
+    main()
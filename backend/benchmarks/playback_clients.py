@@ -0,0 +1,121 @@
+"""
+Simulated viewers for shared-clock playback (playback.py).
+
+    cd backend
+    python -m benchmarks.playback_clients --viewers 500 --speed 16 --seconds 10
+    python -m benchmarks.playback_clients --viewers 50 --url ws://localhost:8000/api/2025/Abu%20Dhabi/playback/party
+
+Without --url, a PlaybackHub runs in-process over the synthetic race (see
+benchmarks/synthetic.py) and every viewer is a coroutine that counts what it is
+sent (--slow of them sleep --slow-delay per message, to exercise frame dropping).
+It reports how many frames were encoded against how many were delivered, which
+is the point of the design: one encode per tick, however many viewers.
+
+With --url, that many WebSocket clients (the websockets package) join a running
+server's room; the first one starts playback at --speed and each counts its frames.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+
+from playback import PlaybackHub
+
+
+def _replay():
+    from benchmarks.synthetic import make_session_from_csv
+    from replay_builder import build_processed_replay
+
+    # build_processed_replay prints a line per driver
+    with contextlib.redirect_stdout(io.StringIO()):
+        return build_processed_replay(make_session_from_csv(), '1s')
+
+
+async def _in_process(args):
+    replay = _replay()
+    hub = PlaybackHub(interval=args.interval, queue_size=args.queue)
+    received = [0] * args.viewers
+    received_bytes = [0] * args.viewers
+    send_seconds = [0.0]
+
+    def viewer(i):
+        slow = i < args.slow
+
+        async def send(text):
+            started = time.perf_counter()
+            received[i] += 1
+            received_bytes[i] += len(text)
+            send_seconds[0] += time.perf_counter() - started
+            if slow:
+                await asyncio.sleep(args.slow_delay)
+        return send
+
+    joined = [hub.join('synthetic', 'bench', replay, viewer(i)) for i in range(args.viewers)]
+    room = joined[0][0]
+    pumps = [asyncio.create_task(subscriber.pump()) for _, subscriber in joined]
+    room.control({"action": "speed", "value": args.speed})
+    room.control({"action": "play"})
+
+    started = time.perf_counter()
+    await asyncio.sleep(args.seconds)
+    elapsed = time.perf_counter() - started
+    dropped = sum(subscriber.dropped for _, subscriber in joined)
+    stats = hub.stats()
+    for task in pumps:
+        task.cancel()
+    hub.close()
+
+    delivered = sum(received)
+    fast = received[args.slow:] or [0]
+    print(f"{args.viewers} viewers, speed x{args.speed:g}, {elapsed:.1f}s, replay at {room.now():.0f}s of {room.encoder.duration:.0f}s")
+    print(f"broadcasts {room.broadcasts}  frames encoded {stats['frames_encoded']}  messages delivered {delivered}  dropped {dropped}")
+    print(f"per viewer: {min(fast)}-{max(fast)} messages (fast viewers), {sum(received_bytes) / max(1, args.viewers) / 1024:.0f} KB")
+    print(f"encode-once ratio: {delivered / max(1, stats['frames_encoded']):.0f} deliveries per encoded frame")
+
+
+async def _remote(args):
+    import websockets
+
+    counts = [0] * args.viewers
+    ready = asyncio.Event()
+
+    async def viewer(i):
+        async with websockets.connect(args.url, max_size=None) as ws:
+            if i == 0:
+                await ready.wait()
+                await ws.send(json.dumps({"action": "speed", "value": args.speed}))
+                await ws.send(json.dumps({"action": "play"}))
+            deadline = time.monotonic() + args.seconds
+            while time.monotonic() < deadline:
+                try:
+                    message = await asyncio.wait_for(ws.recv(), timeout=max(0.01, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                if json.loads(message).get('type') == 'frame':
+                    counts[i] += 1
+
+    tasks = [asyncio.create_task(viewer(i)) for i in range(args.viewers)]
+    await asyncio.sleep(1.0)  # let everyone join before playback starts
+    ready.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    print(f"{args.viewers} viewers on {args.url}: frames per viewer min {min(counts)} max {max(counts)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=200)
+    parser.add_argument('--speed', type=float, default=16.0)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--interval', type=float, default=0.1, help="room clock check interval (seconds)")
+    parser.add_argument('--queue', type=int, default=8, help="frames buffered per viewer")
+    parser.add_argument('--slow', type=int, default=0, help="viewers that take --slow-delay per message")
+    parser.add_argument('--slow-delay', type=float, default=0.5)
+    parser.add_argument('--url', help="ws:// URL of a server's playback room instead of the in-process hub")
+    args = parser.parse_args()
+    asyncio.run(_remote(args) if args.url else _in_process(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Replay pipeline benchmarks.
+
+    cd backend
+    python -m benchmarks.run                   # run and compare against baselines.json
+    python -m benchmarks.run --save-baseline   # run and store the results as the new baseline
+    python -m benchmarks.run --check           # exit 1 when a stage regressed
+
+Builds a synthetic session shaped from f1_data_2025_abudhabi (see
+benchmarks/synthetic.py), runs every stage of the telemetry_replay pipeline and
+reports per stage: best wall time over --repeat runs, peak RSS above the RSS at
+stage start (sampled from /proc/self/statm, or ru_maxrss where that is missing;
+freed heap is trimmed before each stage)
+and, for rendering stages, payload bytes raw and gzipped.
+
+Payload sizes are deterministic (seeded fixture), so any change shows up. Times
+and memory depend on the machine, so baselines only compare like with like. Store
+them from the machine that runs the comparison, and compare with some slack
+(--time-slack / --memory-slack). A baseline from another pipeline version or
+benchmark configuration is not compared at all.
+
+The adaptive stages simplify at the server's default minimum tolerance
+(simplify.MIN_TOLERANCE), the tightest a client can ask for.
+"""
+import argparse
+import contextlib
+import ctypes
+import gc
+import gzip
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_session_from_csv
+from replay_builder import (
+    PIPELINE_VERSION, ProcessedReplay, build_manifest, build_replay_grid, extract_sections,
+    load_processed_replay, save_processed_replay,
+)
+from replay_formats import binary_payload, delta_payload, delta_roundtrip_errors, iter_json_payload
+from simplify import MIN_TOLERANCE, simplify_grid
+from standings import build_standings
+from timeline import build_timeline
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+try:
+    _libc = ctypes.CDLL('libc.so.6')
+    _libc.malloc_trim
+except (OSError, AttributeError):  # not glibc
+    _libc = None
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # ru_maxrss is the lifetime peak (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakRSS:
+    """Samples RSS on a background thread while the block runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+    @property
+    def delta(self):
+        return self.peak - self.start
+
+
+def _release_memory():
+    # Give freed heap back to the OS so each stage's RSS delta starts from a clean floor
+    gc.collect()
+    if _libc is not None:
+        _libc.malloc_trim(0)
+
+
+def _measure(fn, repeat):
+    """(result of the last run, best seconds, peak RSS delta in bytes over all runs)."""
+    best, peak, result = float('inf'), 0, None
+    for _ in range(repeat):
+        result = None
+        _release_memory()
+        with PeakRSS() as rss, contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - started
+        best = min(best, elapsed)
+        peak = max(peak, rss.delta)
+    return result, best, peak
+
+
+def _check_delta(replay, buffer):
+    """Fail the run if a delta payload does not decode to within half a quantization step."""
+    for name, (error, tolerance) in delta_roundtrip_errors(replay, buffer).items():
+        # float32 source values add a little rounding on top of the quantization
+        if error > tolerance * (1 + 1e-4) + 1e-6:
+            raise AssertionError(f"delta roundtrip error on {name}: {error} > {tolerance}")
+
+
+def run(repeat=3, resample_rate='1s', fine_resample_rate='250ms', tolerance=MIN_TOLERANCE):
+    results = {}
+
+    def stage(name, fn, payload=False):
+        value, seconds, rss = _measure(fn, repeat)
+        entry = {"seconds": round(seconds, 4), "peak_rss_mb": round(rss / 2 ** 20, 1)}
+        if payload:
+            entry["bytes"] = len(value)
+            entry["gzip_bytes"] = len(gzip.compress(value, compresslevel=6, mtime=0))
+        results[name] = entry
+        print(f"{name:<24} {entry['seconds']:8.3f}s  peak +{entry['peak_rss_mb']:7.1f} MB"
+              + (f"  {entry['bytes']:>11,} B  gz {entry['gzip_bytes']:>10,} B" if payload else ''))
+        return value
+
+    session = stage('fixture', make_session_from_csv)
+    grid = stage('grid', lambda: build_replay_grid(session, resample_rate))
+    sections = stage('sections', lambda: extract_sections(session, grid.t0))
+    standings = stage('standings', lambda: build_standings(grid, sections))
+    timeline = stage('timeline', lambda: build_timeline(sections, grid.duration))
+    replay = ProcessedReplay(grid, sections, standings, timeline=timeline)
+    replay.manifest = stage('manifest', lambda: build_manifest(session, replay, resample_rate))
+
+    tmp = tempfile.mkdtemp(prefix='replay-bench-')
+    try:
+        stage('cache_save', lambda: save_processed_replay(replay, tmp))
+        stage('cache_load', lambda: load_processed_replay(tmp))
+        delta_dir = os.path.join(tmp, 'delta')
+        os.makedirs(delta_dir)
+        stage('cache_save_delta', lambda: save_processed_replay(replay, delta_dir, encoding='delta'))
+        stage('cache_load_delta', lambda: load_processed_replay(delta_dir))
+        for name, path in (('raw', os.path.join(tmp, 'grid.npz')), ('delta', os.path.join(delta_dir, 'grid.dlt'))):
+            print(f"{'':<24} grid on disk ({name}): {os.path.getsize(path):,} B")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    stage('render_records', lambda: b''.join(iter_json_payload(replay, 'records')), payload=True)
+    stage('render_columnar', lambda: b''.join(iter_json_payload(replay, 'columnar')), payload=True)
+    stage('render_binary', lambda: binary_payload(replay), payload=True)
+    delta = stage('render_delta', lambda: delta_payload(replay), payload=True)
+    _check_delta(replay, delta)
+    chunk = replay.window(600.0, 660.0)
+    stage('render_chunk_columnar', lambda: b''.join(iter_json_payload(chunk, 'columnar', False)), payload=True)
+    stage('render_standings', lambda: json.dumps(standings.to_payload(grid.drivers)).encode(), payload=True)
+
+    fine = stage('grid_fine', lambda: build_replay_grid(session, fine_resample_rate))
+    simplified = stage('simplify', lambda: simplify_grid(fine, tolerance))
+    adaptive = ProcessedReplay(simplified, sections, standings)
+    stage('render_adaptive_columnar', lambda: b''.join(iter_json_payload(adaptive, 'columnar')), payload=True)
+    _check_delta(adaptive, stage('render_adaptive_delta', lambda: delta_payload(adaptive), payload=True))
+
+    return {
+        "pipeline_version": PIPELINE_VERSION,
+        "config": {"repeat": repeat, "resample_rate": resample_rate, "fine_resample_rate": fine_resample_rate, "tolerance": tolerance},
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "stages": results,
+    }
+
+
+def incomparable(current, baseline):
+    """Why baseline cannot be compared with current (None if it can): payloads differ by design."""
+    if baseline.get("pipeline_version") != current["pipeline_version"]:
+        return f"pipeline version {baseline.get('pipeline_version')} != {current['pipeline_version']}"
+    config = {k: v for k, v in current["config"].items() if k != "repeat"}
+    stored = {k: v for k, v in baseline.get("config", {}).items() if k != "repeat"}
+    if stored != config:
+        return f"config {stored} != {config}"
+    return None
+
+
+def compare(current, baseline, time_slack=0.25, memory_slack=0.25):
+    """Regression messages (empty if none). Small absolute differences are ignored as noise."""
+    regressions = []
+    print(f"\nvs baseline (pipeline v{baseline.get('pipeline_version')}, {baseline.get('machine', {}).get('platform')}):")
+    for name, now in current["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            print(f"  {name:<24} new stage")
+            continue
+        notes = []
+        for metric, slack, floor in (("seconds", time_slack, 0.02), ("peak_rss_mb", memory_slack, 8.0)):
+            old, new = before.get(metric), now.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            notes.append(f"{metric} {change:+.0%}")
+            if new > old * (1 + slack) and new - old > floor:
+                regressions.append(f"{name}: {metric} {old} -> {new}")
+        for metric in ("bytes", "gzip_bytes"):
+            old, new = before.get(metric), now.get(metric)
+            if old is None or new is None or old == new:
+                continue
+            notes.append(f"{metric} {old:,} -> {new:,}")
+            if new > old * 1.01:
+                regressions.append(f"{name}: {metric} {old} -> {new}")
+        print(f"  {name:<24} " + ", ".join(notes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay pipeline benchmarks")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help="exit with status 1 on regressions")
+    parser.add_argument('--time-slack', type=float, default=0.25)
+    parser.add_argument('--memory-slack', type=float, default=0.25)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    current = run(repeat=args.repeat)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+            f.write('\n')
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline stored yet (run with --save-baseline)")
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    reason = incomparable(current, baseline)
+    if reason is not None:
+        print(f"\nBaseline not comparable ({reason}); store a new one with --save-baseline")
+        if args.check:
+            sys.exit(2)
+        return
+    regressions = compare(current, baseline, args.time_slack, args.memory_slack)
+    if regressions:
+        print("\nRegressions:\n  " + "\n  ".join(regressions))
+        if args.check:
+            sys.exit(1)
+    else:
+        print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Synthetic FastF1-like race sessions for benchmarks (no network, no FastF1 cache).
+
+Both generators return an object with the attributes the replay pipeline reads:
+drivers, pos_data/car_data (per-driver frames with a session-time "Time"
+column), laps, results, track_status, race_control_messages, weather_data,
+event and total_laps.
+
+- make_session(): parametric race, cars lap an elliptical track at slightly
+  different paces. Handy for scaling runs (any driver/lap count).
+- make_session_from_csv(): the real 2025 Abu Dhabi GP tables exported by
+  extract_abudhabi_2025.py (laps, results, weather, track status, race control),
+  with pos/car telemetry synthesized along a track outline at FastF1's sample
+  rates (~3.7 Hz position, ~3.9 Hz car data) over the whole session, driven by
+  the real lap start times so gaps, pit stops and lapped cars match the race.
+"""
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from data_sources import read_csv_tables
+
+# Session time of the race start (FastF1 sessions start well before lights out)
+SESSION_OFFSET_SECONDS = 3000.0
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'f1_data_2025_abudhabi')
+
+# FastF1 sample rates: position ~270 ms, car data ~240-280 ms (jittered)
+POS_HZ = 3.7
+CAR_HZ = 3.9
+
+def make_session(n_drivers=20, n_laps=58, lap_seconds=90.0, hz=4.0, seed=0):
+    rng = np.random.default_rng(seed)
+    drivers = [str(i + 1) for i in range(n_drivers)]
+    duration = n_laps * lap_seconds * 1.05 + 120.0
+    pit_lap = max(1, n_laps // 2)
+
+    pos_data, car_data, laps, results = {}, {}, [], []
+    for i, driver in enumerate(drivers):
+        pace = lap_seconds + 0.08 * i + rng.normal(0.0, 0.05)
+        samples = int(duration * hz)
+        pos_t = np.sort(rng.uniform(0.0, duration, samples))
+        car_t = np.sort(rng.uniform(0.0, duration, samples))
+        angle = 2 * np.pi * pos_t / pace
+        pos_data[driver] = pd.DataFrame({
+            'Time': pd.to_timedelta(pos_t + SESSION_OFFSET_SECONDS, unit='s'),
+            'X': np.cos(angle) * 5000.0,
+            'Y': np.sin(angle) * 3000.0,
+            'Z': 0.0,
+        })
+        phase = 2 * np.pi * car_t / pace
+        speed = 220.0 + 80.0 * np.sin(3 * phase)
+        car_data[driver] = pd.DataFrame({
+            'Time': pd.to_timedelta(car_t + SESSION_OFFSET_SECONDS, unit='s'),
+            'Speed': speed,
+            'RPM': 9000.0 + 30.0 * speed,
+            'nGear': np.clip((speed / 40.0).astype(int), 1, 8),
+            'Throttle': np.clip(50.0 + 60.0 * np.sin(3 * phase), 0.0, 100.0),
+            'Brake': np.sin(3 * phase) < -0.8,
+            'DRS': np.where(np.sin(phase) > 0.9, 12, 0),
+        })
+
+        for lap in range(1, n_laps + 1):
+            start = SESSION_OFFSET_SECONDS + (lap - 1) * pace
+            laps.append({
+                'Driver': f"D{driver:0>2}",
+                'DriverNumber': driver,
+                'LapNumber': float(lap),
+                'Stint': 1.0 if lap <= pit_lap else 2.0,
+                'Compound': 'MEDIUM' if lap <= pit_lap else 'HARD',
+                'TyreLife': float(lap if lap <= pit_lap else lap - pit_lap),
+                'LapTime': pd.Timedelta(seconds=pace),
+                'LapStartTime': pd.Timedelta(seconds=start),
+                'PitInTime': pd.Timedelta(seconds=start + pace) if lap == pit_lap else pd.NaT,
+                'PitOutTime': pd.Timedelta(seconds=start) if lap == pit_lap + 1 else pd.NaT,
+                'Sector1Time': pd.Timedelta(seconds=pace * 0.3),
+                'Sector2Time': pd.Timedelta(seconds=pace * 0.4),
+                'Sector3Time': pd.Timedelta(seconds=pace * 0.3),
+                'Position': float(i + 1),
+            })
+        results.append({
+            'DriverNumber': driver, 'Abbreviation': f"D{driver:0>2}", 'TeamName': f"Team {i // 2}",
+            'TeamColor': 'FFFFFF', 'FirstName': 'Driver', 'LastName': driver, 'HeadshotUrl': '',
+            'Status': 'Finished', 'GridPosition': float(i + 1), 'Position': float(i + 1),
+            'Time': pd.Timedelta(seconds=n_laps * pace),
+        })
+
+    laps = pd.DataFrame(laps)
+    for column in ('PitInTime', 'PitOutTime'):
+        laps[column] = pd.to_timedelta(laps[column])
+
+    return SimpleNamespace(
+        drivers=drivers,
+        pos_data=pos_data,
+        car_data=car_data,
+        laps=laps,
+        results=pd.DataFrame(results),
+        track_status=pd.DataFrame({
+            'Time': pd.to_timedelta([0.0, SESSION_OFFSET_SECONDS + 600.0, SESSION_OFFSET_SECONDS + 800.0], unit='s'),
+            'Status': ['1', '4', '1'],
+            'Message': ['AllClear', 'SCDeployed', 'AllClear'],
+        }),
+        race_control_messages=pd.DataFrame({
+            'Time': pd.to_datetime(['2025-12-07 13:00:00', '2025-12-07 13:10:00']),
+            'Category': ['Flag', 'SafetyCar'],
+            'Message': ['GREEN LIGHT - PIT EXIT OPEN', 'SAFETY CAR DEPLOYED'],
+        }),
+        weather_data=pd.DataFrame({
+            'Time': pd.to_timedelta(np.arange(0.0, SESSION_OFFSET_SECONDS + duration, 60.0), unit='s'),
+            'AirTemp': 27.0,
+            'TrackTemp': 35.0,
+        }),
+        event=SimpleNamespace(
+            Location='Synthetic', OfficialEventName='Synthetic Grand Prix', EventDate='2025-12-07',
+            Country='Nowhere', RoundNumber=1, EventName='Synthetic Grand Prix',
+        ),
+        total_laps=n_laps,
+    )
+
+
+def load_reference_tables(data_dir=DEFAULT_DATA_DIR):
+    """The exported CSVs converted back to FastF1 dtypes (Timedelta session times, str driver numbers)."""
+    tables = read_csv_tables(data_dir)
+    return {
+        'laps': tables['laps'],
+        'results': tables['results'],
+        'track_status': tables['track_status'],
+        'race_control_messages': tables['race_control'],
+        'weather_data': tables['weather'],
+        'session_info': tables['session_info'].iloc[0].to_dict(),
+    }
+
+
+def _track_profile(points=2048, length_units=52800.0, v_max=330.0, v_min=85.0):
+    """
+    Closed track outline (FastF1 position units, 1/10 m, ~5.3 km) with a speed profile
+    that drops in the tight parts. Returns (x, y, speed_kmh, time_fraction) sampled
+    along the outline; time_fraction maps lap time to outline position.
+    """
+    theta = np.linspace(0.0, 2 * np.pi, points, endpoint=False)
+    x = 9000.0 * np.cos(theta) + 2500.0 * np.cos(3 * theta) + 600.0 * np.sin(5 * theta)
+    y = 4500.0 * np.sin(theta) + 1500.0 * np.sin(2 * theta)
+    ds = np.hypot(np.roll(x, -1) - x, np.roll(y, -1) - y)
+    scale = length_units / ds.sum()
+    x, y, ds = x * scale, y * scale, ds * scale
+
+    heading = np.unwrap(np.arctan2(np.roll(y, -1) - y, np.roll(x, -1) - x))
+    curvature = np.abs(np.gradient(heading)) / ds
+    kernel = np.ones(25) / 25
+    curvature = np.convolve(np.concatenate([curvature[-12:], curvature, curvature[:12]]), kernel, 'valid')
+    # Steep drop with curvature, so corners are slow and only long straights reach v_max
+    speed = np.clip(v_max - (v_max - v_min) * (curvature / curvature.max()) ** 0.2, v_min, v_max)
+
+    dt = ds * 0.1 / (speed / 3.6)
+    time_fraction = np.concatenate([[0.0], np.cumsum(dt)[:-1]]) / dt.sum()
+    return x, y, speed, time_fraction, dt.sum()
+
+
+_PROFILE = _track_profile()
+
+
+def _track_at(fraction):
+    """Position and nominal speed at lap-time fraction(s) in [0, 1)."""
+    x, y, speed, time_fraction, _ = _PROFILE
+    i = np.clip(np.searchsorted(time_fraction, fraction, side='right') - 1, 0, len(x) - 1)
+    return x[i], y[i], speed[i]
+
+
+def _lap_fraction(t, starts, durations, end):
+    """Laps completed (float) at session times t, from a driver's lap table; slow laps outside the race."""
+    i = np.clip(np.searchsorted(starts, t, side='right') - 1, 0, len(starts) - 1)
+    progress = i + (t - starts[i]) / durations[i]
+    # Before the start (installation/formation laps) and after the flag (cool-down lap) cars run slower
+    slow = durations[0] * 1.6
+    progress = np.where(t < starts[0], (t - starts[0]) / slow, progress)
+    progress = np.where(t > end, len(starts) + (t - end) / slow, progress)
+    return progress
+
+
+def _sample_times(rng, hz, t_end):
+    step = 1.0 / hz
+    gaps = rng.uniform(0.8 * step, 1.2 * step, int(t_end * hz * 1.05) + 1)
+    t = np.cumsum(gaps)
+    return t[t < t_end]
+
+
+def _driver_telemetry(rng, lap_table, t_end):
+    starts = lap_table['LapStartTime'].dt.total_seconds().to_numpy()
+    durations = lap_table['LapTime'].dt.total_seconds().to_numpy()
+    # Missing lap times (e.g. Lap 1, pit laps): time to the next lap start, else the median
+    next_start = np.append(starts[1:] - starts[:-1], np.nan)
+    durations = np.where(np.isnan(durations), next_start, durations)
+    durations = np.where(np.isnan(durations), np.nanmedian(durations), durations)
+    end = starts[-1] + durations[-1]
+
+    pos_t = _sample_times(rng, POS_HZ, t_end)
+    x, y, _ = _track_at(_lap_fraction(pos_t, starts, durations, end) % 1.0)
+    pos = pd.DataFrame({
+        'Date': pd.Timestamp('2025-12-07 12:01:00') + pd.to_timedelta(pos_t, unit='s'),
+        'Status': 'OnTrack',
+        'X': np.round(x), 'Y': np.round(y), 'Z': 0.0,
+        'Source': 'pos',
+        'Time': pd.to_timedelta(pos_t, unit='s'),
+        'SessionTime': pd.to_timedelta(pos_t, unit='s'),
+    })
+
+    car_t = _sample_times(rng, CAR_HZ, t_end)
+    fraction = _lap_fraction(car_t, starts, durations, end)
+    _, _, speed = _track_at(fraction % 1.0)
+    # The profile is a reference lap; scale to the actual lap time
+    speed = speed * _PROFILE[4] / np.interp(car_t, starts, durations)
+    speed = np.where((car_t < starts[0]) | (car_t > end), speed / 1.6, speed)
+    accel = np.gradient(speed, car_t)
+    car = pd.DataFrame({
+        'Date': pd.Timestamp('2025-12-07 12:01:00') + pd.to_timedelta(car_t, unit='s'),
+        'RPM': np.round(4000.0 + 28.0 * speed),
+        'Speed': np.round(speed),
+        'nGear': np.clip((speed / 42.0).astype(int) + 1, 1, 8),
+        'Throttle': np.where(accel >= 0, 100.0, np.clip(60.0 + accel, 0.0, 99.0)),
+        'Brake': accel < -8.0,
+        'DRS': np.where(((fraction % 1.0) > 0.12) & ((fraction % 1.0) < 0.22) & (fraction > 2), 12, 0),
+        'Source': 'car',
+        'Time': pd.to_timedelta(car_t, unit='s'),
+        'SessionTime': pd.to_timedelta(car_t, unit='s'),
+    })
+    return pos, car
+
+
+def make_session_from_csv(data_dir=DEFAULT_DATA_DIR, seed=0):
+    tables = load_reference_tables(data_dir)
+    rng = np.random.default_rng(seed)
+    laps, results = tables['laps'], tables['results']
+    info = tables['session_info']
+
+    # Telemetry runs from the session start until a few minutes after the last car's flag
+    lap_ends = (laps['LapStartTime'] + laps['LapTime'].fillna(pd.Timedelta(seconds=90))).dt.total_seconds()
+    t_end = float(lap_ends.max()) + 300.0
+
+    drivers = [d for d in results['DriverNumber'] if d in set(laps['DriverNumber'])]
+    pos_data, car_data = {}, {}
+    for driver in drivers:
+        lap_table = laps[laps['DriverNumber'] == driver].sort_values('LapNumber')
+        pos_data[driver], car_data[driver] = _driver_telemetry(rng, lap_table, t_end)
+
+    return SimpleNamespace(
+        drivers=drivers,
+        pos_data=pos_data,
+        car_data=car_data,
+        laps=laps,
+        results=results,
+        track_status=tables['track_status'],
+        race_control_messages=tables['race_control_messages'],
+        weather_data=tables['weather_data'],
+        event=SimpleNamespace(
+            Location=info['Location'], OfficialEventName=info['OfficialEventName'], EventDate='2025-12-07',
+            Country=info['Country'], RoundNumber=int(info['RoundNumber']), EventName=info['EventName'],
+        ),
+        total_laps=int(info['TotalLaps']),
+    )
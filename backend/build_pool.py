@@ -0,0 +1,144 @@
+"""
+Process pool for heavy, FastF1-bound work behind the async API handlers.
+
+Handlers await builds without holding one of uvicorn's threadpool workers, so
+cheap endpoints stay responsive while races are being built. Builds are keyed:
+concurrent requests for the same key share one submission. Admission control
+bounds the number of distinct in-flight builds; beyond it callers get PoolFull
+(served as 503 with Retry-After).
+
+Each finished job's status records how long it waited for a worker (queue_wait)
+and how long it ran (run_seconds); on_finished(key, status) is called with it.
+"""
+import asyncio
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+
+class PoolFull(Exception):
+    pass
+
+
+def _timed_call(fn, *args):
+    # Runs in the worker: report when the job actually started, so queue wait can be told apart from run time
+    return time.time(), fn(*args)
+
+
+def _init_worker(fastf1_cache_dir):
+    import fastf1
+
+    if fastf1_cache_dir:
+        fastf1.Cache.enable_cache(fastf1_cache_dir)
+
+
+class BuildPool:
+    def __init__(self, max_workers=2, max_pending=8, fastf1_cache_dir=None, executor=None, history=200, on_finished=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.fastf1_cache_dir = fastf1_cache_dir
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._builds = {}
+        self._status = OrderedDict()
+        self._history = history
+        self.on_finished = on_finished
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: the API process is multi-threaded, forking it is not safe
+            self._executor = ProcessPoolExecutor(
+                self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.fastf1_cache_dir,),
+            )
+        return self._executor
+
+    def _reset_executor(self):
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self):
+        return len(self._builds)
+
+    def get(self, key):
+        return self._builds.get(key)
+
+    def submit(self, key, fn, *args, info=None):
+        """
+        Start fn(*args) in the pool unless a build for key is already in flight.
+        Must be called from the event loop. Returns an asyncio future.
+        """
+        future = self._builds.get(key)
+        if future is not None:
+            return future
+        if len(self._builds) >= self.max_pending:
+            raise PoolFull(f"{len(self._builds)} builds already in progress")
+
+        loop = asyncio.get_running_loop()
+        try:
+            job = loop.run_in_executor(self._get_executor(), _timed_call, fn, *args)
+        except BrokenExecutor:
+            self._reset_executor()
+            job = loop.run_in_executor(self._get_executor(), _timed_call, fn, *args)
+        future = loop.create_future()
+        self._builds[key] = future
+        self._set_status(key, dict(info or {}, state='building', submitted_at=time.time()))
+        job.add_done_callback(lambda f: self._finished(key, f, future))
+        return future
+
+    def _finished(self, key, job, future):
+        self._builds.pop(key, None)
+        status = self._status.get(key, {})
+        finished = time.time()
+        if job.cancelled():
+            status.update(state='failed', error='cancelled')
+            future.cancel()
+        elif job.exception() is not None:
+            error = job.exception()
+            status.update(state='failed', error=str(error))
+            if isinstance(error, BrokenExecutor):
+                # A worker died (e.g. OOM) and took the pool with it
+                self._reset_executor()
+            if not future.done():
+                future.set_exception(error)
+                # Async (202) callers never await the future; don't log the error as unretrieved
+                future.exception()
+        else:
+            started, result = job.result()
+            status.update(state='done', queue_wait=round(max(0.0, started - status.get('submitted_at', started)), 3),
+                          run_seconds=round(finished - started, 3))
+            if not future.done():
+                future.set_result(result)
+        status['finished_at'] = finished
+        self._set_status(key, status)
+        if self.on_finished is not None:
+            try:
+                self.on_finished(key, status)
+            except Exception as e:
+                print(f"Build pool: on_finished failed for {key}: {e}")
+
+    def _set_status(self, key, status):
+        self._status[key] = status
+        self._status.move_to_end(key)
+        while len(self._status) > self._history:
+            self._status.popitem(last=False)
+
+    def status(self, key):
+        return self._status.get(key)
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+        }
+
+    def shutdown(self):
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,408 @@
+"""
+Where session data comes from.
+
+- FastF1Source: fastf1.get_session (live timing API behind the FastF1 cache)
+- LocalDatasetSource: datasets on disk, either exported by export_dataset.py
+  (Parquet partitions, read memory-mapped) or by extract_abudhabi_2025.py (one
+  CSV directory per race)
+- FallbackSource: the local dataset for races it has, FastF1 for the rest
+
+Every source hands out session objects with FastF1's contract: get_session()
+is cheap, session.load(telemetry=, laps=, weather=, messages=) reads the data
+and sets the same attributes (laps, results, pos_data, car_data, ...). The
+session registry in sessions.py loads through the configured source, so the
+replay builds, the track and every session-level endpoint work unchanged on
+either.
+
+Configured from the environment (so build workers pick it up too):
+DATA_SOURCE=fastf1 | local | auto and LOCAL_DATASET_DIR. auto (the default
+when LOCAL_DATASET_DIR is set) serves races from the dataset when it has
+telemetry for them and falls back to FastF1 otherwise.
+"""
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+# Timedelta columns of the exported tables (CSV stores them as text, Parquet natively)
+LAP_TIME_COLUMNS = (
+    'Time', 'LapTime', 'PitOutTime', 'PitInTime', 'Sector1Time', 'Sector2Time', 'Sector3Time',
+    'Sector1SessionTime', 'Sector2SessionTime', 'Sector3SessionTime', 'LapStartTime',
+)
+
+# SessionName in session_info -> session type identifier
+SESSION_TYPES = {
+    'race': 'R', 'qualifying': 'Q', 'sprint': 'S', 'sprint qualifying': 'SQ', 'sprint shootout': 'SS',
+    'practice 1': 'FP1', 'practice 2': 'FP2', 'practice 3': 'FP3',
+}
+
+TELEMETRY_STREAMS = ('pos_data', 'car_data', 'telemetry')
+
+# Seconds between rescans of the dataset directory after a lookup miss
+RESCAN_SECONDS = 30.0
+
+
+def _norm(name):
+    return re.sub(r'[^a-z0-9]', '', str(name).lower())
+
+
+def _drop_export_columns(frame, extra=()):
+    # The exporters add *_seconds copies (and per-driver Driver columns) that FastF1 frames don't have
+    return frame.drop(columns=[c for c in frame.columns if c.endswith('_seconds') or c == 'Time_str' or c in extra])
+
+
+def _timedeltas(frame, columns):
+    import pandas as pd
+
+    for column in columns:
+        if column in frame.columns and not pd.api.types.is_timedelta64_dtype(frame[column]):
+            frame[column] = pd.to_timedelta(frame[column])
+    return frame
+
+
+def _fastf1_dtypes(tables):
+    """Exported tables -> FastF1 dtypes (Timedelta session times, str driver numbers), in place."""
+    import pandas as pd
+
+    laps = tables.get('laps')
+    if laps is not None:
+        laps = _timedeltas(_drop_export_columns(laps), LAP_TIME_COLUMNS)
+        laps['DriverNumber'] = laps['DriverNumber'].astype(str)
+        if 'LapStartDate' in laps.columns:
+            laps['LapStartDate'] = pd.to_datetime(laps['LapStartDate'])
+        tables['laps'] = laps
+    results = tables.get('results')
+    if results is not None:
+        results = _timedeltas(_drop_export_columns(results), ('Time', 'Q1', 'Q2', 'Q3'))
+        results['DriverNumber'] = results['DriverNumber'].astype(str)
+        if 'TeamColor' in results.columns:
+            results['TeamColor'] = results['TeamColor'].astype(str)
+        tables['results'] = results
+    track_status = tables.get('track_status')
+    if track_status is not None:
+        track_status = _timedeltas(_drop_export_columns(track_status), ('Time',))
+        track_status['Status'] = track_status['Status'].astype(str)
+        tables['track_status'] = track_status
+    race_control = tables.get('race_control')
+    if race_control is not None:
+        race_control = _drop_export_columns(race_control)
+        if 'Time' in race_control.columns:
+            race_control['Time'] = pd.to_datetime(race_control['Time'])
+        tables['race_control'] = race_control
+    for name in ('weather', 'team_radio'):
+        if tables.get(name) is not None:
+            tables[name] = _timedeltas(_drop_export_columns(tables[name]), ('Time',))
+    return tables
+
+
+def read_csv_tables(directory):
+    """The tables of an extract_abudhabi_2025.py CSV directory with FastF1 dtypes (missing files are left out)."""
+    import pandas as pd
+
+    files = {
+        'laps': 'all_laps.csv', 'results': 'race_results.csv', 'track_status': 'track_status.csv',
+        'race_control': 'race_control_messages.csv', 'weather': 'weather.csv', 'team_radio': 'team_radio.csv',
+        'session_info': 'session_info.csv',
+    }
+    tables = {}
+    for name, filename in files.items():
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            tables[name] = pd.read_csv(path)
+    return _fastf1_dtypes(tables)
+
+
+def _read_parquet(path):
+    import pyarrow.parquet as pq
+
+    # memory_map: pages are read straight from the page cache instead of through a read buffer
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+
+class _Race:
+    """One session found in the dataset directory."""
+
+    def __init__(self, kind, path, year, session_type, names, event_name=None, telemetry=False):
+        self.kind = kind  # 'parquet' or 'csv'
+        self.path = path
+        self.year = int(year)
+        self.session_type = session_type
+        self.names = {_norm(n) for n in names if n}
+        self.event_name = event_name
+        self.telemetry = telemetry
+
+
+def _scan_parquet(root):
+    for path in sorted(glob.glob(os.path.join(root, '[0-9][0-9][0-9][0-9]', '*', '*'))):
+        if not os.path.isdir(path):
+            continue
+        done = {s for s in os.listdir(path) if os.path.isfile(os.path.join(path, s, '_SUCCESS'))}
+        if not done:
+            continue
+        year = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        slug = os.path.basename(os.path.dirname(path))
+        info = {}
+        if os.path.isfile(os.path.join(path, 'export.json')):
+            with open(os.path.join(path, 'export.json'), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        event_name = info.get('event_name') or info.get('race_name') or slug.replace('_', ' ').title()
+        yield _Race('parquet', path, year, os.path.basename(path), (slug, info.get('race_name'), event_name), event_name,
+                    telemetry=bool(done & set(TELEMETRY_STREAMS)))
+
+
+def _scan_csv(root):
+    import pandas as pd
+
+    candidates = [root] + sorted(glob.glob(os.path.join(root, '*')))
+    for path in candidates:
+        info_path = os.path.join(path, 'session_info.csv')
+        if not (os.path.isfile(info_path) and os.path.isfile(os.path.join(path, 'all_laps.csv'))):
+            continue
+        info = pd.read_csv(info_path).iloc[0].to_dict()
+        session_type = SESSION_TYPES.get(str(info.get('SessionName', 'Race')).strip().lower(), 'R')
+        # extract_abudhabi_2025.py names its directory f1_data_<year>_<race>
+        dirname = re.sub(r'^f1_data_\d{4}_', '', os.path.basename(os.path.normpath(path)))
+        names = (info.get('EventName'), info.get('Location'), info.get('Country'), dirname)
+        yield _Race('csv', path, info['Year'], session_type, names, info.get('EventName'),
+                    telemetry=os.path.isfile(os.path.join(path, 'telemetry.csv')))
+
+
+class LocalSession:
+    """FastF1-like session read from a local dataset. Attributes are None until load() reads them."""
+
+    def __init__(self, race):
+        self._race = race
+        self.name = None
+        self.event = None
+        self.date = None
+        self.total_laps = None
+        self.drivers = []
+        self.results = None
+        self.laps = None
+        self.track_status = None
+        self.weather_data = None
+        self.race_control_messages = None
+        self.team_radio = None
+        self.pos_data = None
+        self.car_data = None
+        self._tables = {}
+        self._info()
+
+    def _table(self, name):
+        """One exported table with FastF1 dtypes, or None. CSV directories are small and read whole."""
+        if name not in self._tables:
+            race = self._race
+            if race.kind == 'csv':
+                tables = read_csv_tables(race.path)
+                self._tables.update({k: tables.get(k) for k in (*tables, name) if k not in self._tables})
+            else:
+                path = os.path.join(race.path, name, 'data.parquet')
+                self._tables[name] = _fastf1_dtypes({name: _read_parquet(path)})[name] if os.path.isfile(path) else None
+        return self._tables[name]
+
+    def _info(self):
+        import pandas as pd
+
+        info = self._table('session_info')
+        info = info.iloc[0].to_dict() if info is not None and not info.empty else {}
+        self.name = info.get('SessionName')
+        self.event = pd.Series({
+            'EventName': info.get('EventName', self._race.event_name),
+            'OfficialEventName': info.get('OfficialEventName', ''),
+            'Location': info.get('Location', ''),
+            'Country': info.get('Country', ''),
+            'RoundNumber': info.get('RoundNumber', ''),
+            'EventDate': info.get('EventDate', ''),
+        })
+        total_laps = info.get('TotalLaps')
+        self.total_laps = int(total_laps) if total_laps is not None and pd.notna(total_laps) else None
+        session_date = info.get('SessionDate')
+        self.date = pd.Timestamp(session_date) if session_date is not None and pd.notna(session_date) else None
+
+    def load(self, telemetry=True, laps=True, weather=True, messages=True):
+        race = self._race
+        self.results = self._table('results')
+        if laps or telemetry:
+            self.laps = self._table('laps')
+            self.track_status = self._table('track_status')
+        if self.date is None and self.laps is not None and 'LapStartDate' in self.laps.columns:
+            # Session start = wall-clock start of any lap minus its session time
+            start = (self.laps['LapStartDate'] - self.laps['LapStartTime']).dropna()
+            self.date = start.iloc[0] if not start.empty else None
+        if weather:
+            self.weather_data = self._table('weather')
+        if messages:
+            self.race_control_messages = self._table('race_control')
+            self.team_radio = self._table('team_radio')
+        if telemetry:
+            if not race.telemetry:
+                raise LookupError(f"No telemetry in the local dataset for {race.year} {race.event_name}")
+            self.pos_data, self.car_data = self._telemetry()
+
+        if self.results is not None and not self.results.empty:
+            self.drivers = list(self.results['DriverNumber'])
+        elif self.laps is not None:
+            self.drivers = list(self.laps['DriverNumber'].unique())
+
+    def get_circuit_info(self):
+        # Corners and marshal sectors are not part of the exported datasets
+        return None
+
+    def _telemetry(self):
+        """(pos_data, car_data) per driver; merged 'telemetry' frames stand in for both when the raw streams are missing."""
+        import pandas as pd
+
+        race = self._race
+        if race.kind == 'csv':
+            tel = _timedeltas(pd.read_csv(os.path.join(race.path, 'telemetry.csv')), ('Time',))
+            frames = {str(d): _drop_export_columns(f, ('Driver', 'DriverName', 'Team')).reset_index(drop=True)
+                      for d, f in tel.groupby('Driver', sort=False)}
+            return frames, frames
+        streams = {}
+        for stream in TELEMETRY_STREAMS:
+            path = os.path.join(race.path, stream)
+            if not os.path.isfile(os.path.join(path, '_SUCCESS')):
+                continue
+            streams[stream] = {
+                name[len('driver='):-len('.parquet')]: _drop_export_columns(_read_parquet(os.path.join(path, name)), ('Driver',))
+                for name in sorted(os.listdir(path)) if name.startswith('driver=') and name.endswith('.parquet')
+            }
+        merged = streams.get('telemetry', {})
+        return streams.get('pos_data', merged), streams.get('car_data', merged)
+
+
+class LocalDatasetSource:
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._races = None
+        self._scanned_at = 0.0
+
+    def _scan(self):
+        races = []
+        if os.path.isdir(self.root):
+            races.extend(_scan_parquet(self.root))
+            races.extend(_scan_csv(self.root))
+        self._races = races
+        self._scanned_at = time.time()
+        return races
+
+    def races(self, rescan=False):
+        with self._lock:
+            if self._races is None or (rescan and time.time() - self._scanned_at >= RESCAN_SECONDS):
+                self._scan()
+            return list(self._races)
+
+    def _match(self, races, year, race_name, session_type):
+        wanted = _norm(race_name)
+        candidates = [r for r in races if r.year == int(year) and r.session_type == str(session_type).upper()]
+        # Exact name first (event name, location, country, directory), then "Abu Dhabi" in "Abu Dhabi Grand Prix"
+        for race in candidates:
+            if wanted in race.names:
+                return race
+        for race in candidates:
+            if wanted and any(wanted in name for name in race.names):
+                return race
+        return None
+
+    def find(self, year, race_name, session_type='R'):
+        race = self._match(self.races(), year, race_name, session_type)
+        if race is None:
+            # Races exported while the server runs show up after a rescan
+            race = self._match(self.races(rescan=True), year, race_name, session_type)
+        return race
+
+    def has(self, year, race_name, session_type='R', telemetry=False):
+        race = self.find(year, race_name, session_type)
+        return race is not None and (race.telemetry or not telemetry)
+
+    def get_session(self, year, race_name, session_type='R'):
+        race = self.find(year, race_name, session_type)
+        if race is None:
+            raise LookupError(f"{year} {race_name} ({session_type}) is not in the local dataset at {self.root}")
+        return LocalSession(race)
+
+    def event_schedule(self, year):
+        """Schedule records (FastF1 column names) of the dataset's races of the season."""
+        events = {}
+        for race in self.races(rescan=True):
+            if race.year != int(year) or race.event_name in events:
+                continue
+            event = LocalSession(race).event
+            events[race.event_name] = {
+                'RoundNumber': int(event['RoundNumber']) if str(event['RoundNumber']).isdigit() else None,
+                'EventName': race.event_name,
+                'OfficialEventName': event['OfficialEventName'],
+                'Location': event['Location'],
+                'Country': event['Country'],
+                'EventDate': str(event['EventDate']) or None,
+            }
+        return sorted(events.values(), key=lambda e: (e['RoundNumber'] is None, e['RoundNumber'] or 0, e['EventName']))
+
+    def describe(self):
+        return {"source": self.name, "root": self.root, "races": len(self.races())}
+
+
+class FastF1Source:
+    name = 'fastf1'
+
+    def get_session(self, year, race_name, session_type='R'):
+        import fastf1
+
+        return fastf1.get_session(year, race_name, session_type)
+
+    def event_schedule(self, year):
+        import fastf1
+
+        schedule = fastf1.get_event_schedule(year)
+        # Timestamps -> ISO strings through pandas' JSON writer
+        return json.loads(schedule.to_json(orient='records'))
+
+    def describe(self):
+        return {"source": self.name}
+
+
+class FallbackSource:
+    """Local dataset for the races it has with telemetry, FastF1 for everything else."""
+
+    name = 'auto'
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def get_session(self, year, race_name, session_type='R'):
+        if self.local.has(year, race_name, session_type, telemetry=True):
+            return self.local.get_session(year, race_name, session_type)
+        return self.remote.get_session(year, race_name, session_type)
+
+    def event_schedule(self, year):
+        try:
+            return self.remote.event_schedule(year)
+        except Exception as e:
+            print(f"Schedule for {year} unavailable from {self.remote.name} ({e}); using the local dataset")
+            return self.local.event_schedule(year)
+
+    def describe(self):
+        return {"source": self.name, "local": self.local.describe(), "remote": self.remote.describe()}
+
+
+def source_from_env():
+    root = os.environ.get('LOCAL_DATASET_DIR')
+    kind = os.environ.get('DATA_SOURCE', 'auto' if root else 'fastf1').strip().lower()
+    if kind == 'fastf1':
+        return FastF1Source()
+    if not root:
+        raise ValueError(f"DATA_SOURCE={kind} needs LOCAL_DATASET_DIR")
+    if kind == 'local':
+        return LocalDatasetSource(root)
+    if kind == 'auto':
+        return FallbackSource(LocalDatasetSource(root), FastF1Source())
+    raise ValueError(f"Unknown DATA_SOURCE {kind!r} (fastf1, local or auto)")
+
+
+data_source = source_from_env()
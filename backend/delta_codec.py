@@ -0,0 +1,146 @@
+"""
+Quantized delta / run-length coding of telemetry channels.
+
+A channel (float values, NaN = missing) is stored as:
+
+- scale: the fixed-point step; values are quantized to round(v / scale)
+- the quantized values of the present samples as first-order deltas, either
+  plain ("delta") or as (delta, run length) pairs ("rle"), whichever is smaller.
+  RLE wins for channels that rarely change (LapNumber, Compound, nGear, DRS)
+  and for regular time vectors
+- a validity mask as alternating run lengths (present, missing, present, ...),
+  omitted when every sample is present
+
+Integers are packed as int8 with -128 as an escape; escaped values follow in a
+separate int32 array, in order. Everything is vectorized with numpy.
+
+Decoding is exact in the quantized domain, so a decoded value differs from the
+encoded one by at most scale / 2 (plus float rounding).
+
+Container (shared by the wire format and the on-disk cache):
+
+    bytes 0..7     magic b"PRAHDLT1"
+    bytes 8..11    uint32 header length H
+    bytes 12..     UTF-8 JSON header, space-padded so the body starts 8-byte aligned
+    body           the arrays referenced by {"offset", "length", "dtype"} in the header
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'PRAHDLT1'
+
+_ESCAPE = -128
+
+
+class Body:
+    """Growing byte body; add() appends an array (4-byte aligned) and returns its reference."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def add(self, array):
+        self.buffer.extend(b'\x00' * ((-len(self.buffer)) % 4))
+        ref = {'offset': len(self.buffer), 'length': int(array.size), 'dtype': array.dtype.str}
+        self.buffer.extend(array.tobytes())
+        return ref
+
+
+def _view(body, ref):
+    return np.frombuffer(body, dtype=ref['dtype'], count=ref['length'], offset=ref['offset'])
+
+
+def _pack_ints(values, body):
+    small = np.abs(values) < 128
+    packed = np.where(small, values, _ESCAPE).astype('<i1')
+    out = {'values': body.add(packed)}
+    if not small.all():
+        escapes = values[~small]
+        if np.abs(escapes).max() >= 2 ** 31:
+            raise ValueError("quantized value out of int32 range; use a coarser scale")
+        out['escapes'] = body.add(escapes.astype('<i4'))
+    return out
+
+
+def _unpack_ints(packed, body):
+    values = _view(body, packed['values']).astype(np.int64)
+    if 'escapes' in packed:
+        values[values == _ESCAPE] = _view(body, packed['escapes'])
+    return values
+
+
+def _runs(values):
+    """(run values, run lengths) of consecutive equal values."""
+    if len(values) == 0:
+        return values, values
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    lengths = np.diff(np.append(starts, len(values)))
+    return values[starts], lengths
+
+
+def encode_channel(values, scale, body):
+    """Descriptor of one channel; its arrays are appended to body."""
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    quantized = np.round(values[present] / scale).astype(np.int64)
+    deltas = np.diff(quantized, prepend=0)
+    entry = {'scale': scale, 'length': int(len(values))}
+
+    run_values, run_lengths = _runs(deltas)
+    # Plain deltas cost about a byte per sample; RLE about two bytes per run
+    if 2 * len(run_values) < len(deltas):
+        entry['codec'] = 'rle'
+        entry['deltas'] = _pack_ints(run_values, body)
+        entry['runs'] = _pack_ints(run_lengths, body)
+    else:
+        entry['codec'] = 'delta'
+        entry['deltas'] = _pack_ints(deltas, body)
+
+    if not present.all():
+        flags, lengths = _runs(present)
+        if not flags[0]:
+            # Mask runs always start with a "present" run, possibly empty
+            lengths = np.concatenate(([0], lengths))
+        entry['mask'] = _pack_ints(lengths, body)
+    return entry
+
+
+def _dequantize(quantized, scale):
+    # Divide by 10/100/1000 rather than multiply by 0.1/0.01/0.001, so decoded values are
+    # the doubles nearest to the decimals (e.g. 600.0, not 600.0000000000001)
+    inverse = 1.0 / scale
+    if scale < 1 and abs(inverse - round(inverse)) < 1e-9:
+        return quantized / round(inverse)
+    return quantized * scale
+
+
+def decode_channel(entry, body):
+    """Reference decoder: float64 values with NaN where the sample was missing."""
+    deltas = _unpack_ints(entry['deltas'], body)
+    if entry['codec'] == 'rle':
+        deltas = np.repeat(deltas, _unpack_ints(entry['runs'], body))
+    present_values = _dequantize(np.cumsum(deltas), entry['scale'])
+    if 'mask' not in entry:
+        return present_values
+    lengths = _unpack_ints(entry['mask'], body)
+    present = np.repeat(np.arange(len(lengths)) % 2 == 0, lengths)
+    out = np.full(entry['length'], np.nan)
+    out[present] = present_values
+    return out
+
+
+def pack(header, body):
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Pad so the body starts 8-byte aligned (magic + length prefix = 12 bytes)
+    header_bytes += b' ' * ((-(12 + len(header_bytes))) % 8)
+    return MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes + bytes(body.buffer)
+
+
+def unpack(buffer):
+    """(header, body) of a container; body is a memoryview for decode_channel."""
+    if buffer[:8] != MAGIC:
+        raise ValueError("not a PRAH delta-coded buffer")
+    (header_len,) = struct.unpack_from('<I', buffer, 8)
+    header = json.loads(bytes(buffer[12:12 + header_len]).decode('utf-8'))
+    return header, memoryview(buffer)[12 + header_len:]
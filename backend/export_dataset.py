@@ -0,0 +1,445 @@
+"""
+Bulk export of FastF1 sessions into a local Parquet dataset.
+
+    cd backend
+    python -m export_dataset --years 2023-2025 --out ../f1_dataset
+    python -m export_dataset --years 2025 --rounds 20-24 --max-races 3
+    python -m export_dataset --years 2025 --races "Abu Dhabi Grand Prix" --streams laps,weather
+
+Generalizes extract_abudhabi_2025.py to any range of races. Layout, one
+partition per (year, race, session, stream):
+
+    <out>/<year>/<race slug>/<session type>/<stream>/
+        data.parquet          session-level streams (laps, results, weather, ...)
+        driver=<number>.parquet   per-driver streams (pos_data, car_data, telemetry)
+        _SUCCESS              written last: {"rows", "files"} of the partition
+
+Per-driver streams are written one driver at a time, so memory is bounded by the
+loaded session plus one driver's frame (the old script concatenated every
+driver's telemetry before writing one CSV). Files are written to a temporary
+name and renamed, so a file that exists is complete.
+
+Resumable: partitions with a _SUCCESS marker are skipped, and a race whose
+requested partitions are all done is skipped without loading its session. An
+interrupted per-driver partition keeps its finished driver files and only
+exports the missing drivers on the next run. export.json next to the streams
+records what was exported for the session.
+
+Races are exported on a process pool of --max-races workers (each holds one
+loaded session, so that bounds memory as well as FastF1 download concurrency).
+Requires pyarrow.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+SUCCESS = '_SUCCESS'
+
+# Default resample rate of the "telemetry" stream (as in extract_abudhabi_2025.py); 'raw' keeps every sample
+TELEMETRY_RATE = '1s'
+
+COMPRESSION = 'zstd'
+
+
+def race_slug(race_name):
+    """Directory name of a race: 'Abu Dhabi Grand Prix' -> 'abu_dhabi_grand_prix'."""
+    return re.sub(r'[^a-z0-9]+', '_', str(race_name).strip().lower()).strip('_')
+
+
+def session_dir(root, year, race_name, session_type='R'):
+    return os.path.join(root, str(int(year)), race_slug(race_name), str(session_type).upper())
+
+
+def partition_dir(root, year, race_name, session_type, stream):
+    return os.path.join(session_dir(root, year, race_name, session_type), stream)
+
+
+def partition_done(path):
+    return os.path.isfile(os.path.join(path, SUCCESS))
+
+
+def _attr(session, name):
+    # FastF1 raises DataNotLoadedError for parts of the session that were not loaded
+    try:
+        return getattr(session, name, None)
+    except Exception:
+        return None
+
+
+def _text_or_none(value):
+    if value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value):
+        return None
+    return str(value)
+
+
+def _arrow_safe(frame):
+    """Plain DataFrame pyarrow can write: string column names, mixed-type object columns as text."""
+    import pyarrow as pa
+
+    frame = pd.DataFrame(frame).reset_index(drop=True)
+    frame.columns = [str(c) for c in frame.columns]
+    for column in frame.columns[frame.dtypes == object]:
+        try:
+            pa.array(frame[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            frame[column] = frame[column].map(_text_or_none)
+    return frame
+
+
+def _write_parquet(frame, path):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    _arrow_safe(frame).to_parquet(tmp, index=False, engine='pyarrow', compression=COMPRESSION)
+    os.replace(tmp, path)
+
+
+def _finish_partition(path, rows, files):
+    tmp = os.path.join(path, f"{SUCCESS}.tmp-{os.getpid()}")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"rows": int(rows), "files": sorted(files)}, f)
+    os.replace(tmp, os.path.join(path, SUCCESS))
+
+
+def _with_seconds(frame, columns):
+    """Copy of frame with a <column>_seconds float column for each timedelta column."""
+    frame = frame.copy()
+    for column in columns:
+        if column in frame.columns and pd.api.types.is_timedelta64_dtype(frame[column]):
+            frame[f'{column}_seconds'] = frame[column].dt.total_seconds()
+    return frame
+
+
+# Session-level streams: name -> (FastF1 load flags it needs, extractor returning a frame or None)
+
+def _session_info(session, year, session_type):
+    event = _attr(session, 'event')
+    total_laps = _attr(session, 'total_laps')
+    session_date = _attr(session, 'date')
+    return pd.DataFrame([{
+        'Year': int(year),
+        'EventName': getattr(event, 'EventName', None),
+        'OfficialEventName': getattr(event, 'OfficialEventName', None),
+        'Location': getattr(event, 'Location', None),
+        'Country': getattr(event, 'Country', None),
+        'RoundNumber': getattr(event, 'RoundNumber', None),
+        'EventDate': str(getattr(event, 'EventDate', '') or '') or None,
+        'SessionName': getattr(session, 'name', None),
+        # Start of the session clock; race control messages carry wall-clock times relative to it
+        'SessionDate': str(session_date) if session_date is not None and pd.notna(session_date) else None,
+        'SessionType': session_type,
+        'TotalLaps': int(total_laps) if total_laps is not None and pd.notna(total_laps) else None,
+    }])
+
+
+def _laps(session, year, session_type):
+    laps = _attr(session, 'laps')
+    if laps is None:
+        return None
+    return _with_seconds(laps, (
+        'LapTime', 'Sector1Time', 'Sector2Time', 'Sector3Time', 'LapStartTime', 'PitInTime', 'PitOutTime',
+        'Sector1SessionTime', 'Sector2SessionTime', 'Sector3SessionTime',
+    ))
+
+
+def _timed_frame(name):
+    def extract(session, year, session_type):
+        frame = _attr(session, name)
+        if frame is None:
+            return None
+        return _with_seconds(frame, ('Time',))
+    return extract
+
+
+def _driver_summary(session, year, session_type):
+    laps = _attr(session, 'laps')
+    results = _attr(session, 'results')
+    if laps is None or laps.empty:
+        return None
+    laps = laps.assign(DriverNumber=laps['DriverNumber'].astype(str))
+    grouped = laps.groupby('DriverNumber', sort=False)
+    summary = pd.DataFrame({
+        'TotalLapsCompleted': grouped.size(),
+        'FastestLap_seconds': grouped['LapTime'].min().dt.total_seconds(),
+        'AverageLap_seconds': grouped['LapTime'].mean().dt.total_seconds(),
+        'PitStops': grouped['PitOutTime'].count() if 'PitOutTime' in laps.columns else 0,
+    }).reset_index()
+    if results is not None and not results.empty:
+        columns = [c for c in ('Abbreviation', 'FullName', 'TeamName', 'TeamColor', 'Position', 'GridPosition', 'Status', 'Points')
+                   if c in results.columns]
+        info = results[['DriverNumber'] + columns].assign(DriverNumber=results['DriverNumber'].astype(str))
+        summary = summary.merge(info, on='DriverNumber', how='left')
+    return summary
+
+
+SESSION_STREAMS = {
+    'session_info': ((), _session_info),
+    'results': ((), lambda session, year, session_type: _attr(session, 'results')),
+    'laps': (('laps',), _laps),
+    'driver_summary': (('laps',), _driver_summary),
+    'track_status': (('laps',), _timed_frame('track_status')),
+    'weather': (('weather',), _timed_frame('weather_data')),
+    'race_control': (('messages',), _timed_frame('race_control_messages')),
+    'team_radio': (('messages',), _timed_frame('team_radio')),
+}
+
+
+# Per-driver streams: name -> (load flags, extractor(session, driver, telemetry_rate) returning a frame or None)
+
+def _raw_stream(name):
+    def extract(session, driver, telemetry_rate):
+        frames = _attr(session, name)
+        if not isinstance(frames, dict) or driver not in frames:
+            return None
+        return frames[driver]
+    return extract
+
+
+def _driver_telemetry(session, driver, telemetry_rate):
+    """Merged car + position telemetry of the driver's laps (FastF1 get_telemetry), optionally resampled."""
+    laps = _attr(session, 'laps')
+    if laps is None or laps.empty:
+        return None
+    driver_laps = laps.pick_drivers(driver) if hasattr(laps, 'pick_drivers') else laps.pick_driver(driver)
+    if driver_laps.empty:
+        return None
+    tel = driver_laps.get_telemetry()
+    if tel is None or tel.empty:
+        return None
+    if telemetry_rate != 'raw':
+        tel = tel.set_index('Time').resample(telemetry_rate).first().reset_index()
+    tel = pd.DataFrame(tel)
+    tel['Time_seconds'] = tel['Time'].dt.total_seconds()
+    return tel
+
+
+DRIVER_STREAMS = {
+    'pos_data': (('telemetry',), _raw_stream('pos_data')),
+    'car_data': (('telemetry',), _raw_stream('car_data')),
+    'telemetry': (('telemetry', 'laps'), _driver_telemetry),
+}
+
+STREAMS = tuple(SESSION_STREAMS) + tuple(DRIVER_STREAMS)
+
+
+def _export_session_stream(path, frame):
+    os.makedirs(path, exist_ok=True)
+    files = []
+    if frame is not None and not frame.empty:
+        _write_parquet(frame, os.path.join(path, 'data.parquet'))
+        files.append('data.parquet')
+    _finish_partition(path, 0 if frame is None else len(frame), files)
+    return 0 if frame is None else len(frame)
+
+
+def _export_driver_stream(path, session, extract, telemetry_rate):
+    """Write the drivers that are not on disk yet; the partition is finished only if every driver succeeded."""
+    os.makedirs(path, exist_ok=True)
+    failed = 0
+    for driver in map(str, _attr(session, 'drivers') or []):
+        name = f'driver={driver}.parquet'
+        target = os.path.join(path, name)
+        if os.path.isfile(target):
+            continue
+        try:
+            frame = extract(session, driver, telemetry_rate)
+            if frame is None or frame.empty:
+                continue
+            frame = pd.DataFrame(frame)
+            frame['Driver'] = driver
+            _write_parquet(frame, target)
+            print(f"  {os.path.basename(path)} {driver}: {len(frame)} rows")
+        except Exception as e:
+            failed += 1
+            print(f"  {os.path.basename(path)} {driver} failed: {e}")
+        finally:
+            # Release this driver's frame before the next one is extracted
+            frame = None
+    if failed:
+        return None
+    import pyarrow.parquet as pq
+
+    files = sorted(f for f in os.listdir(path) if f.endswith('.parquet'))
+    rows = sum(pq.read_metadata(os.path.join(path, f)).num_rows for f in files)
+    _finish_partition(path, rows, files)
+    return rows
+
+
+def _write_export_info(root, year, race_name, session_type, session, results):
+    directory = session_dir(root, year, race_name, session_type)
+    path = os.path.join(directory, 'export.json')
+    info = {}
+    if os.path.isfile(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    event = _attr(session, 'event') if session is not None else None
+    info.update({
+        "year": int(year),
+        "race_name": race_name,
+        "event_name": getattr(event, 'EventName', None) or info.get("event_name"),
+        "session_type": session_type,
+        "exported_at": time.time(),
+    })
+    info.setdefault("streams", {}).update({stream: rows for stream, rows in results.items() if isinstance(rows, int)})
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp, path)
+
+
+def export_race(root, fastf1_cache_dir, year, race_name, session_type='R', streams=STREAMS, telemetry_rate=TELEMETRY_RATE,
+                load=None):
+    """
+    Process-pool entry point: export the requested streams of one session.
+    Returns {"year", "race_name", "session_type", "status", "streams": {stream: rows | 'done' | 'incomplete'}}
+    with status 'skipped' (everything was already on disk), 'done' or 'incomplete' (some driver failed).
+    load(year, race_name, session_type, **flags) loads the session (default: sessions.load_session).
+    """
+    import fastf1
+
+    from sessions import load_session, session_registry
+
+    pending = [s for s in streams if not partition_done(partition_dir(root, year, race_name, session_type, s))]
+    summary = {"year": int(year), "race_name": race_name, "session_type": session_type,
+               "streams": {s: 'done' for s in streams if s not in pending}}
+    if not pending:
+        summary["status"] = 'skipped'
+        return summary
+
+    needed = set()
+    for stream in pending:
+        needed.update((SESSION_STREAMS.get(stream) or DRIVER_STREAMS[stream])[0])
+    flags = {name: name in needed for name in ('telemetry', 'laps', 'weather', 'messages')}
+    if fastf1_cache_dir:
+        fastf1.Cache.enable_cache(fastf1_cache_dir)
+    print(f"Exporting {year} {race_name} {session_type}: {', '.join(pending)}")
+    session = (load or load_session)(year, race_name, session_type, **flags)
+    try:
+        for stream in pending:
+            path = partition_dir(root, year, race_name, session_type, stream)
+            if stream in SESSION_STREAMS:
+                rows = _export_session_stream(path, SESSION_STREAMS[stream][1](session, year, session_type))
+            else:
+                rows = _export_driver_stream(path, session, DRIVER_STREAMS[stream][1], telemetry_rate)
+            summary["streams"][stream] = 'incomplete' if rows is None else rows
+        _write_export_info(root, year, race_name, session_type, session, summary["streams"])
+    finally:
+        # Exporter processes serve nothing else; drop the raw session before the next race
+        session_registry.discard(year, race_name, session_type)
+    summary["status"] = 'incomplete' if 'incomplete' in summary["streams"].values() else 'done'
+    return summary
+
+
+def _int_range(text):
+    """'2023-2025' or '2023,2025' (or a mix) -> sorted ints."""
+    values = set()
+    for part in str(text).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            values.update(range(int(first), int(last) + 1))
+        else:
+            values.add(int(part))
+    return sorted(values)
+
+
+def plan_races(years, rounds=None, races=None, schedule=None):
+    """
+    (year, race_name) pairs to export. Without explicit race names the completed races of each
+    season come from schedule(year) -> [(round, name)], filtered by rounds.
+    """
+    if schedule is None:
+        from prewarm import fastf1_completed_events as schedule
+
+    planned = []
+    for year in years:
+        if races:
+            planned.extend((year, race) for race in races)
+            continue
+        for round_number, race in schedule(year):
+            if rounds is None or round_number in rounds:
+                planned.append((year, race))
+    return planned
+
+
+def run_export(root, planned, fastf1_cache_dir=None, session_type='R', streams=STREAMS, telemetry_rate=TELEMETRY_RATE,
+               max_races=1, executor=None):
+    """Export the planned races, at most max_races at a time. Returns the per-race summaries (failures included)."""
+    os.makedirs(root, exist_ok=True)
+    summaries = []
+
+    def report(summary):
+        summaries.append(summary)
+        print(f"{summary['year']} {summary['race_name']}: {summary['status']}"
+              + (f" ({summary['error']})" if 'error' in summary else ''))
+
+    args = [(root, fastf1_cache_dir, year, race, session_type, tuple(streams), telemetry_rate) for year, race in planned]
+    if executor is None and max_races <= 1:
+        for job in args:
+            try:
+                report(export_race(*job))
+            except Exception as e:
+                report({"year": job[2], "race_name": job[3], "session_type": session_type, "status": 'failed', "error": str(e)})
+        return summaries
+
+    # spawn: FastF1/pandas state should not be forked into the workers
+    pool = executor or ProcessPoolExecutor(max_races, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = {pool.submit(export_race, *job): job for job in args}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                report(future.result())
+            except Exception as e:
+                report({"year": job[2], "race_name": job[3], "session_type": session_type, "status": 'failed', "error": str(e)})
+    finally:
+        if executor is None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export FastF1 sessions into a partitioned Parquet dataset")
+    parser.add_argument('--years', required=True, help="e.g. 2025, 2023-2025 or 2018,2021")
+    parser.add_argument('--rounds', help="round numbers to export, e.g. 1-10 (default: every completed race)")
+    parser.add_argument('--races', help="comma-separated event names instead of the schedule, e.g. 'Abu Dhabi Grand Prix'")
+    parser.add_argument('--session', default='R', help="session type (R, Q, S, SQ, FP1, ...)")
+    parser.add_argument('--streams', default=','.join(STREAMS), help=f"comma-separated subset of {','.join(STREAMS)}")
+    parser.add_argument('--telemetry-rate', default=TELEMETRY_RATE, help="resample rate of the telemetry stream, or 'raw'")
+    parser.add_argument('--max-races', type=int, default=2, help="races exported in parallel (one process each)")
+    parser.add_argument('--out', default='f1_dataset')
+    parser.add_argument('--fastf1-cache', default='f1_cache')
+    args = parser.parse_args()
+
+    streams = [s.strip() for s in args.streams.split(',') if s.strip()]
+    unknown = sorted(set(streams) - set(STREAMS))
+    if unknown:
+        parser.error(f"unknown streams: {', '.join(unknown)}")
+    races = [r.strip() for r in args.races.split(',') if r.strip()] if args.races else None
+    rounds = set(_int_range(args.rounds)) if args.rounds else None
+    os.makedirs(args.fastf1_cache, exist_ok=True)
+
+    planned = plan_races(_int_range(args.years), rounds, races)
+    print(f"{len(planned)} races to export into {args.out} ({args.max_races} at a time)")
+    started = time.time()
+    summaries = run_export(
+        args.out, planned, os.path.abspath(args.fastf1_cache), args.session.upper(), streams, args.telemetry_rate,
+        max_races=args.max_races,
+    )
+    counts = {}
+    for summary in summaries:
+        counts[summary['status']] = counts.get(summary['status'], 0) + 1
+    print(f"\nFinished in {time.time() - started:.0f}s: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    if counts.get('failed') or counts.get('incomplete'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
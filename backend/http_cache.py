@@ -0,0 +1,250 @@
+"""
+HTTP caching of replay payloads.
+
+A processed replay never changes for a given cache key, so every rendered
+response variant (endpoint + format + query options) gets an ETag derived
+from that key and is rendered once: the body is stored next to the processed
+cache entry as identity, gzip and (if the brotli package is installed) brotli
+artifacts. Later requests are served straight from the artifact matching their
+Accept-Encoding, or answered 304 when If-None-Match matches.
+
+Artifacts live inside the cache entry directory, so they disappear with it
+when the entry is rebuilt. Streamed responses are written incrementally while
+they are sent (see stream_through), so no full copy of the body is held.
+
+Compression on the request path uses cheap levels; once a set is committed,
+recompress() rewrites its gzip/brotli files at the final (slow, smaller)
+levels on a single background thread, off the request path.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip artifacts are written
+    brotli = None
+
+ARTIFACT_DIR = 'http'
+_SUFFIXES = {'identity': '.raw', 'gzip': '.gz', 'br': '.br'}
+
+
+def make_etag(key, variant):
+    """
+    Weak ETag of a response variant. It is the same for the identity, gzip and brotli bodies
+    (and for bodies the GZip middleware compresses on the fly), which are semantically
+    equivalent but not byte-identical, so it must not claim to be a strong validator.
+    """
+    return 'W/"' + hashlib.sha256(f"{key}|{variant}".encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match check (weak comparison, as RFC 9110 requires for GET)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def choose_encoding(accept_encoding, available):
+    """Best of br/gzip acceptable to the client and available on disk, else 'identity'."""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    for encoding in ('br', 'gzip'):
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > 0 and encoding in available:
+            return encoding
+    return 'identity'
+
+
+def _variant_name(variant):
+    return hashlib.sha256(variant.encode('utf-8')).hexdigest()[:24]
+
+
+class ArtifactStore:
+    def __init__(self, gzip_level=6, brotli_quality=5, final_gzip_level=9, final_brotli_quality=11):
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.final_gzip_level = final_gzip_level
+        self.final_brotli_quality = final_brotli_quality
+        self._recompressor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def encodings(self):
+        return ('identity', 'gzip', 'br') if brotli is not None else ('identity', 'gzip')
+
+    def path(self, entry_dir, variant, encoding='identity'):
+        return os.path.join(entry_dir, ARTIFACT_DIR, _variant_name(variant) + _SUFFIXES[encoding])
+
+    def available(self, entry_dir, variant):
+        """Encodings stored for variant; empty until the identity artifact (written last) exists."""
+        if not os.path.exists(self.path(entry_dir, variant)):
+            return ()
+        return tuple(e for e in self.encodings if os.path.exists(self.path(entry_dir, variant, e)))
+
+    def _compress(self, body, encoding, final=False):
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=self.final_gzip_level if final else self.gzip_level, mtime=0)
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.final_brotli_quality if final else self.brotli_quality)
+        return body
+
+    def _replace(self, entry_dir, variant, encoding, data):
+        directory = os.path.join(entry_dir, ARTIFACT_DIR)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path(entry_dir, variant, encoding))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def writer(self, entry_dir, variant):
+        return ArtifactWriter(self, entry_dir, variant)
+
+    def write(self, entry_dir, variant, body):
+        directory = os.path.join(entry_dir, ARTIFACT_DIR)
+        os.makedirs(directory, exist_ok=True)
+        # Compressed files first, identity last: its presence marks the set complete
+        for encoding in sorted(self.encodings, key=lambda e: e == 'identity'):
+            self._replace(entry_dir, variant, encoding, self._compress(body, encoding))
+        self.schedule_recompress(entry_dir, variant)
+
+    def recompress(self, entry_dir, variant):
+        """Rewrite the compressed artifacts of a complete set at the final levels (readers keep the old file)."""
+        identity = self.path(entry_dir, variant)
+        with open(identity, 'rb') as f:
+            body = f.read()
+            stamp = os.fstat(f.fileno()).st_ino
+        for encoding in self.encodings:
+            if encoding != 'identity':
+                data = self._compress(body, encoding, final=True)
+                if os.stat(identity).st_ino != stamp:
+                    return  # rewritten meanwhile; its writer schedules its own pass
+                self._replace(entry_dir, variant, encoding, data)
+
+    def schedule_recompress(self, entry_dir, variant):
+        """Queue recompress() on the background thread; a no-op when the final levels are no better."""
+        if (self.final_gzip_level <= self.gzip_level
+                and (brotli is None or self.final_brotli_quality <= self.brotli_quality)):
+            return
+        job = (entry_dir, variant)
+        with self._lock:
+            if job in self._pending:
+                return
+            self._pending.add(job)
+            if self._recompressor is None:
+                self._recompressor = ThreadPoolExecutor(1, thread_name_prefix='artifact-recompress')
+            self._recompressor.submit(self._run_recompress, job)
+
+    def close(self):
+        """Drop queued recompressions (a running one finishes)."""
+        with self._lock:
+            if self._recompressor is not None:
+                self._recompressor.shutdown(wait=False, cancel_futures=True)
+                self._recompressor = None
+            self._pending.clear()
+
+    def _run_recompress(self, job):
+        try:
+            self.recompress(*job)
+        except OSError as e:
+            # Entry evicted or rebuilt meanwhile: the cheap artifacts (if any) stay valid
+            print(f"Could not recompress HTTP artifact: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(job)
+
+
+class ArtifactWriter:
+    """Incremental version of ArtifactStore.write: feed chunks, then commit (or abort)."""
+
+    def __init__(self, store, entry_dir, variant):
+        self.store = store
+        self.entry_dir = entry_dir
+        self.variant = variant
+        directory = os.path.join(entry_dir, ARTIFACT_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}
+        self._compressors = {}
+        for encoding in store.encodings:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            self._files[encoding] = (os.fdopen(fd, 'wb'), tmp)
+            if encoding == 'gzip':
+                # wbits 31: gzip container (header mtime 0, like gzip.compress(mtime=0))
+                self._compressors[encoding] = zlib.compressobj(store.gzip_level, zlib.DEFLATED, 31)
+            elif encoding == 'br':
+                self._compressors[encoding] = brotli.Compressor(quality=store.brotli_quality)
+
+    def _process(self, encoding, chunk):
+        compressor = self._compressors.get(encoding)
+        if compressor is None:
+            return chunk
+        return compressor.compress(chunk) if encoding == 'gzip' else compressor.process(chunk)
+
+    def write(self, chunk):
+        for encoding, (f, tmp) in self._files.items():
+            f.write(self._process(encoding, chunk))
+
+    def commit(self):
+        for encoding, (f, tmp) in self._files.items():
+            compressor = self._compressors.get(encoding)
+            if compressor is not None:
+                f.write(compressor.flush() if encoding == 'gzip' else compressor.finish())
+            f.close()
+        # Identity last: its presence marks the set complete
+        for encoding in sorted(self._files, key=lambda e: e == 'identity'):
+            os.replace(self._files[encoding][1], self.store.path(self.entry_dir, self.variant, encoding))
+        self._files = {}
+        self.store.schedule_recompress(self.entry_dir, self.variant)
+
+    def abort(self):
+        for f, tmp in self._files.values():
+            f.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._files = {}
+
+
+def stream_through(chunks, writer=None):
+    """
+    Yield chunks to the client while feeding them to writer; the artifacts are
+    committed only if the whole body was produced. A failing writer is dropped
+    without interrupting the response.
+    """
+    try:
+        for chunk in chunks:
+            if writer is not None:
+                try:
+                    writer.write(chunk)
+                except OSError as e:
+                    print(f"Could not store HTTP artifact: {e}")
+                    writer.abort()
+                    writer = None
+            yield chunk
+        if writer is not None:
+            writer.commit()
+            writer = None
+    finally:
+        # Client went away (generator closed) or rendering failed
+        if writer is not None:
+            writer.abort()
@@ -0,0 +1,251 @@
+"""
+Distance-aligned lap comparison.
+
+Every lap is resampled once onto its session's distance grid and cached on its own
+(see build_lap_traces_job), so comparing any set of laps is just stacking cached traces:
+
+- distance: the lap's position samples are projected onto the session's track
+  (track.TrackIndex.locate), unwrapped around the start line and made monotonic
+- time: elapsed seconds since the lap passed distance 0, interpolated per grid point
+- Speed/Throttle: linear interpolation in distance; Brake/nGear: last value at or before
+  each grid point (they are steps, not ramps)
+
+The grid runs from 0 to the track length in GRID_STEP position units (1/10 m), the same
+distance axis as the /track payload, so sectors and corners line up with the traces.
+"""
+import json
+import os
+
+import numpy as np
+
+from track import TRACK_VERSION
+
+# Bump whenever a trace changes (invalidates cached laps)
+LAP_TRACE_VERSION = 1
+
+# Session identifiers as FastF1 understands them
+SESSION_TYPES = ('R', 'Q', 'S', 'SQ', 'SS', 'FP1', 'FP2', 'FP3')
+
+# Spacing of the shared distance grid (position units, i.e. 5 m)
+GRID_STEP = 50.0
+# Seconds of samples kept either side of the lap, so the trace reaches the start line
+LAP_MARGIN = 1.0
+
+LINEAR_CHANNELS = ('Speed', 'Throttle')
+STEP_CHANNELS = ('Brake', 'nGear')
+CHANNELS = LINEAR_CHANNELS + STEP_CHANNELS
+
+
+class LapTrace:
+    """One lap on the session's distance grid: meta (driver, lap, lap time, ...) plus float32 channels and Time."""
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.arrays = arrays
+
+
+def _seconds(value):
+    import pandas as pd
+
+    return pd.to_timedelta(value).total_seconds() if value is not None and pd.notna(value) else None
+
+
+def _lap_row(laps, driver, lap_number):
+    import pandas as pd
+
+    if laps is None or laps.empty:
+        raise LookupError("Session has no laps")
+    rows = laps[(laps['DriverNumber'].astype(str) == str(driver)) & (laps['LapNumber'] == lap_number)]
+    if rows.empty:
+        raise LookupError(f"Driver {driver} has no lap {lap_number}")
+    lap = rows.iloc[0]
+    if pd.isna(lap.get('LapStartTime')):
+        raise LookupError(f"Lap {lap_number} of driver {driver} has no start time")
+    return lap
+
+
+def _window(frame, start, end):
+    """(time, frame) of the samples within [start, end] session seconds, sorted by time."""
+    import pandas as pd
+
+    t = pd.to_timedelta(frame['Time']).dt.total_seconds().to_numpy(dtype=np.float64)
+    inside = (t >= start) & (t <= end)
+    t, frame = t[inside], frame[inside]
+    order = np.argsort(t, kind='stable')
+    return t[order], frame.iloc[order]
+
+
+def _increasing(x):
+    """Mask keeping only samples where x strictly increases (np.interp needs increasing xp)."""
+    keep = np.ones(len(x), dtype=bool)
+    keep[1:] = x[1:] > np.maximum.accumulate(x)[:-1]
+    return keep
+
+
+def build_lap_trace(session, track, driver, lap_number, step=GRID_STEP):
+    """LapTrace of one lap, resampled onto [0, track length] every step position units."""
+    import pandas as pd
+
+    lap = _lap_row(getattr(session, 'laps', None), driver, lap_number)
+    driver = str(lap['DriverNumber'])
+    pos_data = getattr(session, 'pos_data', None) or {}
+    car_data = getattr(session, 'car_data', None) or {}
+    if driver not in pos_data or driver not in car_data:
+        raise LookupError(f"No telemetry for driver {driver}")
+
+    start = _seconds(lap['LapStartTime'])
+    lap_time = _seconds(lap.get('LapTime'))
+    # Laps without a time (e.g. the last lap of a red-flagged session) run until the next lap starts
+    duration = lap_time
+    if duration is None:
+        later = session.laps[(session.laps['DriverNumber'].astype(str) == driver) & (session.laps['LapNumber'] > lap_number)]
+        duration = _seconds(later['LapStartTime'].min()) - start if not later.empty else None
+    if duration is None or duration <= 0:
+        raise LookupError(f"Lap {lap_number} of driver {driver} has no end time")
+
+    pos_t, pos = _window(pos_data[driver], start - LAP_MARGIN, start + duration + LAP_MARGIN)
+    x = pd.to_numeric(pos['X'], errors='coerce').to_numpy(dtype=np.float64)
+    y = pd.to_numeric(pos['Y'], errors='coerce').to_numpy(dtype=np.float64)
+    ok = ~(np.isnan(x) | np.isnan(y))
+    pos_t, x, y = pos_t[ok], x[ok], y[ok]
+    if len(pos_t) < 10:
+        raise LookupError(f"Lap {lap_number} of driver {driver} has no position data")
+
+    # Project onto the track, then pick the lap (-1, 0, +1) of each point that matches its
+    # time-based progress, so the margins land before 0 and after the track length
+    length = track.index.length
+    distance, _ = track.locate(x, y)
+    expected = (pos_t - start) / duration * length
+    distance = distance + np.round((expected - distance) / length) * length
+    distance = np.maximum.accumulate(distance)
+    keep = _increasing(distance)
+    pos_t, distance = pos_t[keep], distance[keep]
+
+    grid = np.arange(0.0, length + step / 2, step)
+    covered = (grid >= distance[0]) & (grid <= distance[-1])
+    at = np.interp(grid, distance, pos_t)
+    elapsed = at - at[0] if covered[0] else at - start
+    arrays = {'Time': np.where(covered, elapsed, np.nan)}
+
+    car_t, car = _window(car_data[driver], start - LAP_MARGIN, start + duration + LAP_MARGIN)
+    car_distance = np.interp(car_t, pos_t, distance)
+    keep = _increasing(car_distance)
+    car_distance, car = car_distance[keep], car.iloc[np.flatnonzero(keep)]
+    for name in CHANNELS:
+        values = np.full(len(grid), np.nan)
+        if name in car.columns and len(car_distance):
+            src = pd.to_numeric(car[name], errors='coerce').to_numpy(dtype=np.float64)
+            if name in LINEAR_CHANNELS:
+                values = np.interp(grid, car_distance, src)
+            else:
+                idx = np.clip(np.searchsorted(car_distance, grid, side='right') - 1, 0, len(src) - 1)
+                values = src[idx]
+        arrays[name] = np.where(covered, values, np.nan)
+
+    compound = lap.get('Compound')
+    meta = {
+        "driver": driver,
+        "abbreviation": lap['Driver'] if isinstance(lap.get('Driver'), str) else None,
+        "lap": int(lap_number),
+        "lap_time": lap_time,
+        "compound": compound if isinstance(compound, str) else None,
+        "tyre_life": float(lap['TyreLife']) if pd.notna(lap.get('TyreLife')) else None,
+        "step": step,
+        "length": round(length, 1),
+    }
+    return LapTrace(meta, {name: values.astype(np.float32) for name, values in arrays.items()})
+
+
+def save_trace(trace, entry_dir):
+    np.savez(os.path.join(entry_dir, 'trace.npz'), **trace.arrays)
+    with open(os.path.join(entry_dir, 'trace.json'), 'w', encoding='utf-8') as f:
+        json.dump(trace.meta, f, separators=(',', ':'))
+
+
+def load_trace(entry_dir):
+    with open(os.path.join(entry_dir, 'trace.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    with np.load(os.path.join(entry_dir, 'trace.npz')) as arrays:
+        return LapTrace(meta, {name: arrays[name] for name in arrays.files})
+
+
+def lap_trace_key(year, race_name, session_type, driver, lap_number):
+    from replay_cache import make_cache_key
+
+    # The rate slot names the lap; the version also covers the track the distances come from
+    return make_cache_key(year, race_name, session_type, f"lap:{driver}:{int(lap_number)}",
+                          f"{LAP_TRACE_VERSION}.{TRACK_VERSION}")
+
+
+def compare_traces(traces, decimals=3):
+    """
+    Comparison payload of LapTraces from one session: the shared distance grid, each lap's
+    channels and its time delta to the first lap (positive = behind) at every grid point.
+    """
+    length = min(len(trace.arrays['Time']) for trace in traces)
+    reference = traces[0].arrays['Time'][:length].astype(np.float64)
+    step = traces[0].meta['step']
+
+    def listed(values, places=decimals):
+        values = np.round(values.astype(np.float64), places)
+        return [None if v != v else float(v) for v in values]
+
+    laps = []
+    for trace in traces:
+        time = trace.arrays['Time'][:length].astype(np.float64)
+        entry = dict(trace.meta)
+        entry.pop('step', None)
+        entry.pop('length', None)
+        entry["Time"] = listed(time)
+        entry["Delta"] = listed(time - reference)
+        for name in CHANNELS:
+            entry[name] = listed(trace.arrays[name][:length], 0 if name in STEP_CHANNELS else 1)
+        laps.append(entry)
+    return {
+        "version": LAP_TRACE_VERSION,
+        "step": step,
+        "length": traces[0].meta['length'],
+        "distance": listed(np.arange(length) * step, 1),
+        "reference": {"driver": traces[0].meta['driver'], "lap": traces[0].meta['lap']},
+        "laps": laps,
+    }
+
+
+def build_lap_traces_job(cache_root, track_cache_root, fastf1_cache_dir, year, race_name, session_type, pairs):
+    """
+    Process-pool entry point: load the session once and publish the trace of every
+    (driver, lap) pair not cached yet. Raises LookupError when a lap cannot be traced
+    (after publishing the others).
+    """
+    import fastf1
+
+    from replay_cache import ReplayCache
+    from sessions import load_session
+    from track import load_track, publish_track, save_track, track_cache_key
+
+    if fastf1_cache_dir:
+        fastf1.Cache.enable_cache(fastf1_cache_dir)
+    cache = ReplayCache(cache_root, max_memory_items=0, dump=save_trace, load=load_trace)
+    missing = [(driver, lap) for driver, lap in pairs if not cache.on_disk(lap_trace_key(year, race_name, session_type, driver, lap)[0])]
+    if not missing:
+        return 'cached'
+
+    session = load_session(year, race_name, session_type, weather=False, messages=False)
+    # The distance axis of the session: its track, built from the same session when needed
+    if publish_track(track_cache_root, year, race_name, session_type, session) is None:
+        raise LookupError(f"No lap with position data for {year} {race_name} ({session_type})")
+    tracks = ReplayCache(track_cache_root, max_memory_items=0, dump=save_track, load=load_track)
+    track = tracks.get(track_cache_key(year, race_name, session_type)[0])
+
+    errors = []
+    for driver, lap in missing:
+        try:
+            trace = build_lap_trace(session, track, driver, lap)
+        except LookupError as e:
+            errors.append(str(e))
+            continue
+        key, params = lap_trace_key(year, race_name, session_type, driver, lap)
+        cache.put(key, trace, params=params)
+    if errors:
+        raise LookupError("; ".join(errors))
+    return 'built'
@@ -1,20 +1,210 @@
 import os
-import fastf1
-from fastapi import FastAPI, HTTPException
+import asyncio
+import functools
+import sys
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import pandas as pd
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import json
 from pathlib import Path
+from replay_cache import ReplayCache, make_cache_key
+from replay_builder import (
+    PIPELINE_VERSION, ProcessedReplay, save_processed_replay, load_processed_replay, read_build_timings, read_manifest,
+)
+from replay_formats import (
+    BINARY_MEDIA_TYPE, DELTA_MEDIA_TYPE, binary_payload, columnar_payload, delta_payload, iter_json_payload,
+    negotiate_format,
+)
+from simplify import DEFAULT_MAX_GAP_SECONDS, MIN_TOLERANCE, simplify_grid
+from data_sources import data_source
+from sessions import fetch_replay_meta, fetch_team_radio, replay_meta_from_manifest
+from build_pool import BuildPool, PoolFull
+from http_cache import ArtifactStore, choose_encoding, etag_matches, make_etag, stream_through
+from prewarm import JobQueue, PrewarmWorker, build_replay_job, fastf1_completed_races
+from track import build_track_job, load_track, save_track, track_cache_key
+from analytics import PARTS as ANALYTICS_PARTS, analytics_cache_key, build_analytics_job
+from timeline import TYPES as TIMELINE_TYPES
+from lap_compare import SESSION_TYPES, build_lap_traces_job, compare_traces, lap_trace_key, load_trace, save_trace
+from playback import PlaybackHub, log_task_error
+from prebuild import parse_races
+from schedule_index import ScheduleIndex
+import metrics
+from metrics import timed
 
 # Setup caching
 # Use /tmp for cloud environments (Render/Vercel), local folder for dev
 cache_dir = '/tmp/f1_cache' if os.environ.get('VERCEL') or os.environ.get('RENDER') else 'f1_cache'
 if not os.path.exists(cache_dir):
     os.makedirs(cache_dir)
-fastf1.Cache.enable_cache(cache_dir)
 
-app = FastAPI(title="PRAH Backend")
+# Cold start: fastf1/pandas/scipy are not imported at module load. Builds and session reads run on
+# the pool (whose workers enable the FastF1 cache themselves); the few in-process FastF1 calls
+# (schedules) import it on first use. Cached races are served without ever loading it.
+STARTED_AT = time.time()
+
+
+@functools.cache
+def _fastf1():
+    import fastf1
+
+    fastf1.Cache.enable_cache(cache_dir)
+    return fastf1
+
+
+def _fetch_schedule(year):
+    if data_source.name != 'local':
+        _fastf1()
+    return data_source.event_schedule(year)
+
+
+def _completed_races(year):
+    _fastf1()
+    return fastf1_completed_races(year)
+
+
+# Processed replay cache (sits in front of the FastF1 raw cache).
+# Keys include replay_builder.PIPELINE_VERSION, so changing the pipeline invalidates old entries.
+REPLAY_RESAMPLE_RATE = '1s'
+# Base rate used when a client asks for tolerance-driven (adaptive) downsampling
+REPLAY_FINE_RESAMPLE_RATE = os.environ.get('REPLAY_FINE_RESAMPLE_RATE', '250ms')
+# Smallest tolerance accepted (position units): tighter ones keep more samples than the fixed 1 Hz grid
+REPLAY_MIN_TOLERANCE = float(os.environ.get('REPLAY_MIN_TOLERANCE', MIN_TOLERANCE))
+# Default and maximum window served by telemetry_replay/chunk (seconds)
+REPLAY_CHUNK_SECONDS = float(os.environ.get('REPLAY_CHUNK_SECONDS', '60'))
+REPLAY_CHUNK_MAX_SECONDS = float(os.environ.get('REPLAY_CHUNK_MAX_SECONDS', '600'))
+replay_cache = ReplayCache(
+    os.environ.get('REPLAY_CACHE_DIR', os.path.join(cache_dir, 'processed')),
+    max_memory_items=int(os.environ.get('REPLAY_CACHE_MEMORY_ITEMS', '4')),
+    dump=save_processed_replay,
+    load=load_processed_replay,
+)
+
+# Circuit outline + spatial index per race (track.py), built alongside the replay or on demand
+track_cache = ReplayCache(
+    os.environ.get('TRACK_CACHE_DIR', os.path.join(cache_dir, 'tracks')),
+    max_memory_items=int(os.environ.get('TRACK_CACHE_MEMORY_ITEMS', '16')),
+    dump=save_track,
+    load=load_track,
+)
+
+# Lap / sector / stint / pit / gap analytics per race (analytics.py), built alongside the replay or on demand
+analytics_cache = ReplayCache(
+    os.environ.get('ANALYTICS_CACHE_DIR', os.path.join(cache_dir, 'analytics')),
+    max_memory_items=int(os.environ.get('ANALYTICS_CACHE_MEMORY_ITEMS', '32')),
+)
+
+# Single laps resampled onto their session's distance grid (lap_compare.py), built on demand
+lap_trace_cache = ReplayCache(
+    os.environ.get('LAP_TRACE_CACHE_DIR', os.path.join(cache_dir, 'laps')),
+    max_memory_items=int(os.environ.get('LAP_TRACE_CACHE_MEMORY_ITEMS', '256')),
+    dump=save_trace,
+    load=load_trace,
+)
+# Most laps one comparison may ask for
+LAP_COMPARE_MAX_LAPS = int(os.environ.get('LAP_COMPARE_MAX_LAPS', '10'))
+# Failed builds of other requests' laps a compare request may join before reporting the failure
+LAP_COMPARE_BUILD_RETRIES = 2
+
+# Shared-clock playback rooms (playback.py): how often a room checks its clock, and the frames
+# buffered per viewer before a slow one starts dropping them
+playback_hub = PlaybackHub(
+    interval=float(os.environ.get('PLAYBACK_FRAME_INTERVAL', '0.1')),
+    queue_size=int(os.environ.get('PLAYBACK_CLIENT_QUEUE', '8')),
+)
+
+# Rendered replay responses are immutable per cache key: (weak) ETags, and the full payloads are
+# stored precompressed (gzip/brotli) next to the cache entry so they're rendered and compressed once.
+# Cheap levels while the first response is sent, then the final levels on a background thread.
+REPLAY_HTTP_MAX_AGE = int(os.environ.get('REPLAY_HTTP_MAX_AGE', '86400'))
+http_artifacts = ArtifactStore(
+    gzip_level=int(os.environ.get('REPLAY_ARTIFACT_GZIP_LEVEL', '6')),
+    brotli_quality=int(os.environ.get('REPLAY_ARTIFACT_BROTLI_QUALITY', '5')),
+    final_gzip_level=int(os.environ.get('REPLAY_ARTIFACT_FINAL_GZIP_LEVEL', '9')),
+    final_brotli_quality=int(os.environ.get('REPLAY_ARTIFACT_FINAL_BROTLI_QUALITY', '11')),
+)
+
+# Heavy FastF1/pandas work (replay builds, session reads) runs on a dedicated process pool.
+# Admission control: at most REPLAY_BUILD_QUEUE distinct builds in flight, beyond that 503.
+# A request waits up to REPLAY_BUILD_WAIT_SECONDS for its build, then gets 202 + a poll URL.
+REPLAY_BUILD_WAIT_SECONDS = float(os.environ.get('REPLAY_BUILD_WAIT_SECONDS', '900'))
+REPLAY_BUILD_RETRY_AFTER = int(os.environ.get('REPLAY_BUILD_RETRY_AFTER', '5'))
+# Processes used to fill the per-driver telemetry within one build (1 = serial)
+REPLAY_DRIVER_WORKERS = int(os.environ.get('REPLAY_DRIVER_WORKERS', '1'))
+
+
+def _build_finished(key, status):
+    """Build pool hook: queue wait / run time per job kind, plus the stage timings of replay builds."""
+    kind = status.get('kind', 'replay')
+    metrics.observe_job(kind, status)
+    if kind == 'replay' and status.get('state') == 'done':
+        build = read_build_timings(replay_cache.entry_dir(key))
+        if build is not None:
+            race = f"{status.get('year')} {str(status.get('race_name', '')).strip().lower()} {status.get('resample_rate')}"
+            metrics.observe_build(race, build)
+
+
+build_pool = BuildPool(
+    max_workers=int(os.environ.get('REPLAY_BUILD_WORKERS', '2')),
+    max_pending=int(os.environ.get('REPLAY_BUILD_QUEUE', '8')),
+    fastf1_cache_dir=os.path.abspath(cache_dir),
+    on_finished=_build_finished,
+)
+
+# Season schedules (schedule_index.py): persisted under the cache dir, past seasons kept for good,
+# the current one refetched after SCHEDULE_TTL_SECONDS. Its seasons are advertised by /api/seasons
+# (and prewarmed in the background when enabled).
+schedule_index = ScheduleIndex(
+    os.environ.get('SCHEDULE_CACHE_DIR', os.path.join(cache_dir, 'schedule')),
+    fetch=_fetch_schedule,
+    first_season=int(os.environ.get('SCHEDULE_FIRST_SEASON', '2018')),
+    ttl_seconds=float(os.environ.get('SCHEDULE_TTL_SECONDS', '21600')),
+    # The local dataset can grow any season, and scanning it is cheap
+    keep_past_seasons=data_source.name != 'local',
+)
+SCHEDULE_REFRESH_ENABLED = os.environ.get('SCHEDULE_REFRESH_ENABLED', '1') == '1'
+
+# Races baked into the cache at image build time (prebuild.py); /api/ready reports warm once they're all on disk
+PREBUILD_RACES = parse_races(os.environ.get('PREBUILD_RACES', ''))
+
+# Background prewarm of processed replays for completed races (opt-in)
+prewarm_worker = None
+if os.environ.get('PREWARM_ENABLED', '0') == '1':
+    prewarm_seasons = os.environ.get('PREWARM_SEASONS')
+    prewarm_worker = PrewarmWorker(
+        JobQueue(
+            os.environ.get('PREWARM_DB', os.path.join(cache_dir, 'prewarm.sqlite3')),
+            max_attempts=int(os.environ.get('PREWARM_MAX_ATTEMPTS', '5')),
+            backoff_seconds=float(os.environ.get('PREWARM_BACKOFF_SECONDS', '60')),
+        ),
+        seasons=[int(y) for y in prewarm_seasons.split(',')] if prewarm_seasons else schedule_index.seasons(),
+        schedule=_completed_races,
+        job=functools.partial(build_replay_job, replay_cache.root, os.path.abspath(cache_dir), resample_rate=REPLAY_RESAMPLE_RATE,
+                              keep_session=False, driver_workers=REPLAY_DRIVER_WORKERS, track_cache_root=track_cache.root,
+                              analytics_cache_root=analytics_cache.root),
+        max_concurrency=int(os.environ.get('PREWARM_CONCURRENCY', '1')),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if SCHEDULE_REFRESH_ENABLED:
+        schedule_index.start()
+    if prewarm_worker is not None:
+        prewarm_worker.start()
+    yield
+    playback_hub.close()
+    schedule_index.stop()
+    if prewarm_worker is not None:
+        prewarm_worker.stop()
+    http_artifacts.close()
+    build_pool.shutdown()
+
+
+app = FastAPI(title="PRAH Backend", lifespan=lifespan)
 
 # CORS Setup
 # Handle the case where ALLOWED_ORIGINS is just "*" (common in dev/simple setups)
@@ -27,6 +217,7 @@ else:
     origins = [origin.strip().rstrip("/") for origin in allowed_origins_env.split(",")]
 
 print(f"Configured CORS origins: {origins}")
+print(f"Data source: {data_source.describe()}")
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,13 +225,50 @@ app.add_middleware(
     allow_credentials=True if origins != ["*"] else False, # Disable credentials if allowing all origins to avoid CORS error
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing", "X-Profile"],
 )
 
+# Compresses everything else on the fly; responses that already carry Content-Encoding
+# (precompressed replay artifacts) pass through untouched
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Outermost: per-request stage timings (Server-Timing header), request metrics, and with
+# PROFILE_DIR set, a sampling profile of any request sent with ?profile=1
+app.add_middleware(metrics.RequestMetrics, profile_dir=os.environ.get('PROFILE_DIR') or None)
+
+
+def _collect_component_metrics():
+    """Gauges/counters read from the cache, build pool and prewarm queue at scrape time."""
+    lookups = metrics.Counter('prah_replay_cache_lookups_total', "Processed replay cache lookups by result.", ('result',))
+    for result in ('memory_hits', 'disk_hits', 'misses'):
+        lookups.inc(replay_cache.stats[result], result=result)
+    memory_items = metrics.Gauge('prah_replay_cache_memory_items', "Processed replays held in memory.")
+    memory_items.set(len(replay_cache._memory))
+    pool = metrics.Gauge('prah_build_pool', "Build pool capacity and in-flight jobs.", ('field',))
+    for field, value in build_pool.stats().items():
+        pool.set(value, field=field)
+    collected = [lookups, memory_items, pool]
+    if prewarm_worker is not None:
+        jobs = metrics.Gauge('prah_prewarm_jobs', "Prewarm queue jobs by state.", ('state',))
+        for state, count in prewarm_worker.queue.counts().items():
+            jobs.set(count, state=state)
+        collected.append(jobs)
+    return collected
+
+
+metrics.registry.add_collector(_collect_component_metrics)
+
 @app.get("/")
 def read_root():
     return {"message": "Oracle Red Bull Racing - Post-Race Analytics Hub API is running"}
 
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of the backend metrics."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/build_info")
 def get_build_info():
     """Return container build metadata (helps verify HF is running latest build)."""
@@ -52,569 +280,659 @@ def get_build_info():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/data_source")
+def get_data_source():
+    """Where session data is read from (FastF1, a local dataset, or the dataset with FastF1 fallback)."""
+    return data_source.describe()
+
+
 @app.get("/api/seasons")
 def get_seasons():
-    # FastF1 doesn't have a direct "list all seasons" lightweight call, 
-    # but we can return a list of recent years for the UI.
-    return {"seasons": list(range(2018, 2026))}
+    return {"seasons": schedule_index.seasons()}
+
+
+@app.get("/api/schedule/status")
+def get_schedule_status():
+    """Which season schedules are cached, their age and whether they are final."""
+    return schedule_index.status()
+
+
+@app.get("/api/ready")
+def get_ready():
+    """
+    Cold-start readiness: "warm" when every PREBUILD_RACES replay (or, without that list, any replay)
+    is on disk and can be served without building, "cold" otherwise. Also whether the heavy
+    modules have been loaded in this process yet.
+    """
+    prebuilt = [
+        {"year": year, "race_name": race_name, "cached": replay_cache.on_disk(_replay_key(year, race_name))}
+        for year, race_name in PREBUILD_RACES
+    ]
+    cached_replays = len(replay_cache.keys())
+    warm = all(race["cached"] for race in prebuilt) if prebuilt else cached_replays > 0
+    return {
+        "state": "warm" if warm else "cold",
+        "uptime_seconds": round(time.time() - STARTED_AT, 3),
+        "cached_replays": cached_replays,
+        "prebuilt": prebuilt,
+        "schedule_seasons_cached": sum(1 for season in schedule_index.status()["seasons"] if season["cached"]),
+        "modules_loaded": {name: name in sys.modules for name in ('fastf1', 'pandas', 'scipy')},
+    }
+
+
+@app.get("/api/prewarm/status")
+def get_prewarm_status():
+    """State of the background replay prewarm queue."""
+    if prewarm_worker is None:
+        return {"enabled": False}
+    return prewarm_worker.status()
 
 @app.get("/api/{year}/races")
 def get_races(year: int):
+    """
+    The season's events (FastF1 schedule, or the races of the local dataset; see data_sources.py),
+    from the schedule index. ReplayCached marks races whose replay is already built (instant load).
+    """
     try:
-        schedule = fastf1.get_event_schedule(year)
-        # Convert timestamp objects to strings for JSON serialization
-        data = json.loads(schedule.to_json(orient='records'))
-        return data
+        events = schedule_index.races(year)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return [
+        dict(event, ReplayCached=bool(event.get('EventName')) and replay_cache.on_disk(_replay_key(year, event['EventName'])))
+        for event in events
+    ]
 
 @app.get("/api/{year}/{race_name}/race/telemetry_replay")
-def get_telemetry_replay(year: int, race_name: str):
+async def get_telemetry_replay(
+    year: int,
+    race_name: str,
+    request: Request,
+    fmt: str | None = Query(None, alias="format"),
+    tolerance: float | None = None,
+    max_gap: float = DEFAULT_MAX_GAP_SECONDS,
+    respond_async: bool = Query(False, alias="async"),
+):
+    """
+    Full race replay. Wire format: ?format=records|columnar|binary|delta, or negotiated from the Accept header.
+    With ?tolerance= (position units) the fixed 1 Hz grid is replaced by an adaptive, error-bounded
+    simplification of a finer grid: more points in corners, fewer on straights, at least one every max_gap seconds.
+    Cold races are built on the build pool; with ?async=true (or Prefer: respond-async) a cold race
+    answers 202 with a poll URL instead of waiting.
+    """
     try:
-        # Load the session
-        print(f"Loading session for {year} {race_name}...")
-        session = fastf1.get_session(year, race_name, 'R')
-        
-        # Load all data including messages (for race control)
-        try:
-            session.load(telemetry=True, laps=True, weather=True, messages=True)
-        except TypeError:
-            # Older FastF1 version doesn't have messages parameter
-            session.load(telemetry=True, laps=True, weather=True)
-        print("Session loaded successfully.")
-        
-        drivers = session.drivers
-        all_drivers_data = []
-        global_t0 = None  # global minimum telemetry time in seconds (used to shift all outputs)
-        
-        print(f"Processing {len(drivers)} drivers for {year} {race_name}...")
-
-        # Limit drivers for debugging/performance if needed (e.g. first 5)
-        # drivers = drivers[:5] 
-
-        for driver in drivers:
-            try:
-                # Build per-driver laps (used for LapNumber/Compound mapping)
-                if hasattr(session, 'laps') and session.laps is not None and not session.laps.empty and 'DriverNumber' in session.laps.columns:
-                    driver_laps = session.laps[session.laps['DriverNumber'].astype(str) == str(driver)]
-                else:
-                    driver_laps = session.laps.pick_driver(driver)
-
-                if driver_laps is None or driver_laps.empty:
-                    continue
-
-                # Prefer full-session telemetry (pos_data + car_data) to avoid truncated lap telemetry
-                tel = None
-                try:
-                    pos_dict = getattr(session, 'pos_data', None)
-                    car_dict = getattr(session, 'car_data', None)
-                    if isinstance(pos_dict, dict) and isinstance(car_dict, dict) and driver in pos_dict and driver in car_dict:
-                        pos = pos_dict[driver].copy()
-                        car = car_dict[driver].copy()
-
-                        # Ensure Time is Timedelta for both
-                        for df in (pos, car):
-                            if 'Time' in df.columns and not pd.api.types.is_timedelta64_ns_dtype(df['Time']):
-                                df['Time'] = pd.to_timedelta(df['Time'])
-
-                        # Merge position (X,Y) with car channels (Speed/Distance/etc) on Time
-                        pos = pos.sort_values('Time')
-                        car = car.sort_values('Time')
-                        tel = pd.merge_asof(
-                            pos,
-                            car,
-                            on='Time',
-                            direction='nearest',
-                            tolerance=pd.Timedelta(milliseconds=250)
-                        )
-                except Exception:
-                    tel = None
-
-                # Fallback to lap-based telemetry if full-session data isn't available
-                if tel is None:
-                    tel = driver_laps.get_telemetry()
-                
-                # Create a mapping for Compound and LapNumber based on Time
-                # We need to merge 'Compound' and 'LapNumber' from laps into telemetry
-                # We can use merge_asof, but we need to prepare the laps dataframe
-                laps_data = driver_laps[['LapStartTime', 'Compound', 'LapNumber']].copy()
-                laps_data['Time'] = laps_data['LapStartTime'] # Rename for merge
-                laps_data = laps_data.dropna(subset=['Time'])
-                
-                # Ensure Time is Timedelta
-                if not isinstance(tel['Time'].dtype, pd.Timedelta):
-                    tel['Time'] = pd.to_timedelta(tel['Time'])
-                
-                # NOTE:
-                # Do NOT inject a synthetic row at time=0.
-                # Doing so forces LapNumber=1 for all telemetry prior to the real Lap 1 start,
-                # which makes Lap 1 appear to last tens of minutes (formation/grid delay).
-                # We intentionally keep leading LapNumber as NaN until the first LapStartTime.
-
-                # Merge Compound and LapNumber info
-                # We use merge_asof to find the last LapStartTime <= Telemetry Time
-                tel = pd.merge_asof(tel.sort_values('Time'), 
-                                    laps_data[['Time', 'Compound', 'LapNumber']].sort_values('Time'), 
-                                    on='Time', 
-                                    direction='backward')
-                
-                # Resample to 1 second frequency for smoother playback (was 2S)
-                tel = tel.set_index('Time')
-                
-                # Create the full time grid
-                resampled = tel.resample('1S').first()
-                
-                # Interpolate continuous variables to fill gaps (prevents disappearing cars)
-                continuous_cols = ['X', 'Y', 'Speed', 'Distance', 'Throttle', 'Brake', 'RPM']
-                cols_to_interp = [c for c in continuous_cols if c in resampled.columns]
-                resampled[cols_to_interp] = resampled[cols_to_interp].interpolate(method='linear', limit_direction='both')
-                
-                # Forward fill categorical/discrete variables
-                categorical_cols = ['LapNumber', 'Compound', 'nGear', 'DRS']
-                cols_to_ffill = [c for c in categorical_cols if c in resampled.columns]
-                resampled[cols_to_ffill] = resampled[cols_to_ffill].ffill()
-                
-                resampled = resampled.reset_index()
-                
-                # Select relevant columns
-                cols_to_keep = ['Time', 'X', 'Y', 'Speed', 'Compound', 'LapNumber', 'Distance', 'Throttle', 'Brake', 'nGear', 'RPM', 'DRS']
-                available_cols = [c for c in cols_to_keep if c in resampled.columns]
-                
-                final_df = resampled[available_cols].copy()
-                
-                # Convert Time to total seconds for JSON
-                final_df['Time'] = final_df['Time'].dt.total_seconds()
-                # Track global t0 across all drivers
-                try:
-                    driver_min = float(final_df['Time'].min()) if not final_df.empty else None
-                    if driver_min is not None:
-                        global_t0 = driver_min if global_t0 is None else min(global_t0, driver_min)
-                except Exception:
-                    pass
-                final_df['Driver'] = driver
-                
-                # REMOVED: Filter out data after the race is officially over
-                # This was causing the race to end early if total_laps was incorrect or if data was slightly misaligned.
-                # We will let the frontend handle the "stop" logic.
-                # if hasattr(session, 'total_laps'):
-                #      final_df = final_df[final_df['LapNumber'] <= session.total_laps + 1]
-
-                # Use pandas to_json string then load it back to ensure compliance
-                # This handles NaN -> null automatically
-                records = json.loads(final_df.to_json(orient='records'))
-                all_drivers_data.extend(records)
-                
-                print(f"Processed {driver} - {len(records)} points")
-                
-                # Explicitly clear large variables to help GC
-                del tel
-                del resampled
-                del final_df
-                del records
-                
-            except Exception as e:
-                print(f"Error processing driver {driver}: {e}")
-                continue
-        
-        print(f"Finished processing all drivers. Total points: {len(all_drivers_data)}")
-
-        # Normalize to a common timeline starting at zero (matches reference implementation)
-        if global_t0 is None:
-            global_t0 = 0.0
-        else:
-            global_t0 = float(global_t0)
-
-        for rec in all_drivers_data:
+        wire_format = negotiate_format(fmt, request.headers.get('accept'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = _replay_key(year, race_name, tolerance)
+    variant = f"replay|{wire_format}|{_simplify_variant(tolerance, max_gap)}"
+    with timed('artifact_lookup'):
+        cached = await run_in_threadpool(_artifact_response, request, key, variant, _media_type(wire_format))
+    if cached is not None:
+        return cached
+
+    replay = await _get_replay_for_request(request, year, race_name, tolerance, max_gap, respond_async)
+    if isinstance(replay, Response):
+        return replay
+    return await _replay_render(request, key, variant, replay, wire_format)
+
+
+@app.get("/api/{year}/{race_name}/race/telemetry_replay/chunk")
+async def get_telemetry_replay_chunk(
+    year: int,
+    race_name: str,
+    request: Request,
+    start: float = 0.0,
+    end: float | None = None,
+    sections: bool = False,
+    fmt: str | None = Query(None, alias="format"),
+    tolerance: float | None = None,
+    max_gap: float = DEFAULT_MAX_GAP_SECONDS,
+    respond_async: bool = Query(False, alias="async"),
+):
+    """
+    One time window [start, end) of the replay, in seconds on the zero-based
+    (time_base aligned) timeline. end defaults to start + REPLAY_CHUNK_SECONDS.
+    Pass sections=true (typically on the first chunk) to also get drivers/laps/events/etc.
+    A start at or past the end of the replay (its duration) is rejected with 416 rather than
+    answered with an empty window.
+    """
+    try:
+        wire_format = negotiate_format(fmt, request.headers.get('accept'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if end is None:
+        end = start + REPLAY_CHUNK_SECONDS
+    if start < 0 or end <= start:
+        raise HTTPException(status_code=400, detail="Expected 0 <= start < end")
+    if end - start > REPLAY_CHUNK_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Window larger than {REPLAY_CHUNK_MAX_SECONDS} seconds")
+
+    key = _replay_key(year, race_name, tolerance)
+    variant = f"chunk|{wire_format}|{start:g}|{end:g}|{int(sections)}|{_simplify_variant(tolerance, max_gap)}"
+    # Only windows on the default chunk grid are stored precompressed (arbitrary windows would grow the cache unbounded)
+    store = start % REPLAY_CHUNK_SECONDS == 0 and end - start == REPLAY_CHUNK_SECONDS
+    with timed('artifact_lookup'):
+        cached = await run_in_threadpool(_artifact_response, request, key, variant, _media_type(wire_format), store)
+    if cached is not None:
+        return cached
+
+    replay = await _get_replay_for_request(request, year, race_name, tolerance, max_gap, respond_async)
+    if isinstance(replay, Response):
+        return replay
+    duration = replay.grid.duration
+    if start > 0 and start >= duration:
+        raise HTTPException(status_code=416, detail=f"start {start:g} is past the end of the replay ({duration:g} s)")
+    # The chunk reaching the end of the race also carries the final tick (at t == duration),
+    # so no one-tick chunk is left to fetch after it
+    last = end >= duration
+    chunk = {
+        "start": start,
+        "end": end,
+        "chunk_seconds": REPLAY_CHUNK_SECONDS,
+        "duration": duration,
+        # Where the client should prefetch from next (None once the race is covered)
+        "next_start": None if last else end,
+    }
+    window = replay.window(start, float('inf') if last else end)
+    return await _replay_render(
+        request, key, variant, window, wire_format, include_sections=sections, extra={"chunk": chunk}, store=store
+    )
+
+
+@app.get("/api/{year}/{race_name}/race/standings")
+async def get_standings(
+    year: int,
+    race_name: str,
+    request: Request,
+    start: float = 0.0,
+    end: float | None = None,
+    respond_async: bool = Query(False, alias="async"),
+):
+    """
+    Precomputed running order per replay tick (same timeline and driver list as the replay).
+    Row i of every array is the standings at time[i]; order[i] lists driver indices from P1.
+    """
+    key = _replay_key(year, race_name)
+    windowed = end is not None or start > 0
+    variant = f"standings|{start:g}|{end}" if windowed else "standings"
+    with timed('artifact_lookup'):
+        cached = await run_in_threadpool(_artifact_response, request, key, variant, 'application/json', not windowed)
+    if cached is not None:
+        return cached
+
+    replay = await _get_processed_replay(request, year, race_name, respond_async=respond_async)
+    if isinstance(replay, Response):
+        return replay
+    table = replay.standings
+    if windowed:
+        table = table.window(start, end if end is not None else float('inf'))
+    render = lambda: JSONResponse(table.to_payload(replay.grid.drivers))
+    return await run_in_threadpool(_render_cached, request, key, variant, render, not windowed)
+
+
+@app.get("/api/{year}/{race_name}/race/timeline")
+async def get_timeline(
+    year: int,
+    race_name: str,
+    request: Request,
+    start: float | None = Query(None, alias="from"),
+    end: float | None = Query(None, alias="to"),
+    types: str | None = None,
+    respond_async: bool = Query(False, alias="async"),
+):
+    """
+    Track status, SC/VSC/red flag periods, race control messages, pit stops and team radio merged into
+    one time-sorted list (replay timeline seconds). ?from=&to= returns the entries overlapping that
+    window, ?types=race_control,pit_stop filters by type; ids are stable across windows.
+    """
+    wanted = sorted({t.strip() for t in types.split(',') if t.strip()}) if types else []
+    unknown = [t for t in wanted if t not in TIMELINE_TYPES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown timeline types: {', '.join(unknown)} (use {', '.join(TIMELINE_TYPES)})")
+    key = _replay_key(year, race_name)
+    windowed = start is not None or end is not None or bool(wanted)
+    variant = f"timeline|{start}|{end}|{','.join(wanted)}" if windowed else "timeline"
+    with timed('artifact_lookup'):
+        cached = await run_in_threadpool(_artifact_response, request, key, variant, 'application/json', not windowed)
+    if cached is not None:
+        return cached
+
+    replay = await _get_processed_replay(request, year, race_name, respond_async=respond_async)
+    if isinstance(replay, Response):
+        return replay
+    timeline = replay.timeline
+    render = lambda: JSONResponse({
+        "from": start,
+        "to": end,
+        "total": len(timeline.entries),
+        "counts": timeline.counts(),
+        "entries": timeline.window(start, end, wanted),
+    })
+    return await run_in_threadpool(_render_cached, request, key, variant, render, not windowed)
+
+
+@app.websocket("/api/{year}/{race_name}/playback/{room}")
+async def playback_socket(websocket: WebSocket, year: int, race_name: str, room: str):
+    """
+    Watch-party playback: everyone in a room sees the same replay clock. The server sends
+    "hello" (drivers, duration), then "state" on every change and a "frame" (positions and
+    standings) per replay tick; viewers send {"action": "play"|"pause"|"seek"|"speed", "value": ...}.
+    """
+    await websocket.accept()
+    try:
+        replay = await _get_processed_replay(websocket, year, race_name)
+    except HTTPException as e:
+        await websocket.send_text(json.dumps({"type": "error", "detail": e.detail}))
+        await websocket.close(code=1011)
+        return
+    if isinstance(replay, Response):
+        # Still building: the viewer reconnects later
+        await websocket.send_text(json.dumps({"type": "building", "retry_after": REPLAY_BUILD_RETRY_AFTER}))
+        await websocket.close(code=1013)
+        return
+
+    key = _replay_key(year, race_name)
+    playback_room, subscriber = playback_hub.join(key, room, replay, websocket.send_text)
+    # Only the sender task writes to the socket; replies to this viewer go through its queue
+    sender = asyncio.create_task(subscriber.pump(), name=f"sender {room}")
+    sender.add_done_callback(log_task_error)
+    try:
+        while True:
+            text = await websocket.receive_text()
             try:
-                if rec.get('Time') is not None:
-                    rec['Time'] = float(rec['Time']) - global_t0
-            except Exception:
-                pass
-        
-        # Extract Driver Info
-        drivers_info = {}
-        if hasattr(session, 'results'):
-            for i, row in session.results.iterrows():
-                driver_number = str(row['DriverNumber'])
-
-                total_time_s = None
-                try:
-                    if 'Time' in row and pd.notna(row['Time']):
-                        # FastF1 typically stores this as a Timedelta
-                        total_time_s = pd.to_timedelta(row['Time']).total_seconds()
-                except Exception:
-                    total_time_s = None
-
-                drivers_info[driver_number] = {
-                    "DriverNumber": driver_number,
-                    "Abbreviation": row['Abbreviation'],
-                    "TeamName": row['TeamName'],
-                    "TeamColor": f"#{row['TeamColor']}" if row['TeamColor'] else "#FFFFFF",
-                    "FirstName": row['FirstName'],
-                    "LastName": row['LastName'],
-                    "HeadshotUrl": row.get('HeadshotUrl', ''),
-                    "Status": row.get('Status', 'Finished'),
-                    "GridPosition": int(row['GridPosition']) if pd.notna(row.get('GridPosition')) else 20,
-                    "ClassifiedPosition": int(row['Position']) if pd.notna(row.get('Position')) else 20,
-                    "TotalTime": total_time_s
-                }
-
-        # Extract Lap Data (Strategy & Pit Stops)
-        laps_data = []
-        if hasattr(session, 'laps'):
-            laps = session.laps.copy()
-
-            # Align identifiers with telemetry/drivers_info:
-            # telemetry uses driver numbers (session.drivers) and drivers_info is keyed by DriverNumber.
-            # FastF1 laps typically uses driver abbreviations in the 'Driver' column.
-            # Keep abbreviation in a separate field and use DriverNumber for 'Driver'.
-            if 'DriverNumber' in laps.columns and 'Driver' in laps.columns:
-                laps['DriverAbbreviation'] = laps['Driver']
-                laps['Driver'] = laps['DriverNumber'].astype(str)
-
-            # Convert Timedeltas
-            time_cols = ['LapStartTime', 'LapTime', 'Sector1Time', 'Sector2Time', 'Sector3Time', 'PitInTime', 'PitOutTime']
-            for col in time_cols:
-                if col in laps.columns:
-                    laps[col] = laps[col].dt.total_seconds()
-            
-            # Select columns - including sector times for analysis
-            laps_cols = ['Driver', 'DriverAbbreviation', 'LapNumber', 'Stint', 'Compound', 'TyreLife', 'LapTime', 'LapStartTime', 'PitInTime', 'PitOutTime', 'Sector1Time', 'Sector2Time', 'Sector3Time']
-            available_laps_cols = [c for c in laps_cols if c in laps.columns]
-            laps_data = json.loads(laps[available_laps_cols].to_json(orient='records'))
-
-            # Shift lap times to the same zero-based timeline
-            if global_t0 and global_t0 > 0:
-                for l in laps_data:
-                    if l.get('LapStartTime') is not None:
-                        try:
-                            l['LapStartTime'] = float(l['LapStartTime']) - global_t0
-                        except Exception:
-                            pass
-                    if l.get('PitInTime') is not None:
-                        try:
-                            l['PitInTime'] = float(l['PitInTime']) - global_t0
-                        except Exception:
-                            pass
-                    if l.get('PitOutTime') is not None:
-                        try:
-                            l['PitOutTime'] = float(l['PitOutTime']) - global_t0
-                        except Exception:
-                            pass
-
-        # Extract Track Status (Safety Car, etc.)
-        events = []
-        if hasattr(session, 'track_status') and session.track_status is not None:
-            ts = session.track_status.copy()
-            ts['Time'] = ts['Time'].dt.total_seconds()
-            events = json.loads(ts.to_json(orient='records'))
-            print(f"Track status events: {len(events)}")
-
-            if global_t0 and global_t0 > 0:
-                for ev in events:
-                    if ev.get('Time') is not None:
-                        try:
-                            ev['Time'] = float(ev['Time']) - global_t0
-                        except Exception:
-                            pass
-
-        # Extract Race Control Messages
-        race_control = []
-        if hasattr(session, 'race_control_messages') and session.race_control_messages is not None:
-            rc = session.race_control_messages
-            if not rc.empty:
-                rc = rc.copy()
-                if 'Time' in rc.columns:
-                    t = rc['Time']
-                    if pd.api.types.is_timedelta64_ns_dtype(t):
-                        rc['Time'] = t.dt.total_seconds()
-                    elif pd.api.types.is_datetime64_any_dtype(t) or (len(t) > 0 and isinstance(t.iloc[0], pd.Timestamp)):
-                        # FastF1 often provides absolute timestamps for race control messages.
-                        # Convert to seconds since session start so it aligns with telemetry/laps.
-                        start_date = None
-                        try:
-                            # session.date is typically the session start timestamp and tends to align best
-                            start_date = getattr(session, 'date', None)
-                        except Exception:
-                            start_date = None
-
-                        if start_date is None:
-                            try:
-                                info = getattr(session, 'session_info', None)
-                                if info is not None and hasattr(info, 'get'):
-                                    start_date = info.get('StartDate')
-                            except Exception:
-                                start_date = None
-
-                        try:
-                            rc_time = pd.to_datetime(rc['Time'])
-                            if start_date is not None:
-                                rc['Time'] = (rc_time - pd.to_datetime(start_date)).dt.total_seconds()
-                            else:
-                                # Fallback: epoch seconds
-                                rc['Time'] = rc_time.astype('int64') / 1e9
-                        except Exception:
-                            pass
-                    else:
-                        # Last resort: try parsing into timedelta-like values
-                        try:
-                            rc['Time'] = pd.to_timedelta(rc['Time']).dt.total_seconds()
-                        except Exception:
-                            pass
-                race_control = json.loads(rc.to_json(orient='records'))
-                print(f"Race control messages: {len(race_control)}")
-
-                if global_t0 and global_t0 > 0:
-                    for msg in race_control:
-                        if msg.get('Time') is not None:
-                            try:
-                                msg['Time'] = float(msg['Time']) - global_t0
-                            except Exception:
-                                pass
-
-        # Extract Circuit Info
-        circuit_info = {}
-        if hasattr(session, 'event'):
-            # Handle potential missing keys safely
-            def get_event_attr(attr):
-                try:
-                    return getattr(session.event, attr, "")
-                except:
-                    return ""
-
-            circuit_info = {
-                "Location": get_event_attr("Location"),
-                "OfficialEventName": get_event_attr("OfficialEventName"),
-                "EventDate": str(get_event_attr("EventDate")),
-                "Country": get_event_attr("Country"),
-                "RoundNumber": str(get_event_attr("RoundNumber"))
-            }
-
-        # Extract Weather Data
-        weather_data = []
-        if hasattr(session, 'weather_data') and session.weather_data is not None:
-            wd = session.weather_data.copy()
-            if 'Time' in wd.columns:
-                if pd.api.types.is_timedelta64_ns_dtype(wd['Time']):
-                    wd['Time'] = wd['Time'].dt.total_seconds()
-                else:
-                    # Attempt to force conversion if it's not already timedelta
-                    try:
-                        wd['Time'] = pd.to_timedelta(wd['Time']).dt.total_seconds()
-                    except:
-                        # If conversion fails, we might have datetimes or something else.
-                        # For now, let's just not crash.
-                        pass
-            weather_data = json.loads(wd.to_json(orient='records'))
-
-            if global_t0 and global_t0 > 0:
-                for w in weather_data:
-                    if w.get('Time') is not None:
-                        try:
-                            w['Time'] = float(w['Time']) - global_t0
-                        except Exception:
-                            pass
-
-        # Calculate Total Laps
-        total_laps = 0
-        if hasattr(session, 'total_laps'):
-             total_laps = session.total_laps
-        elif hasattr(session, 'laps') and not session.laps.empty:
-             total_laps = int(session.laps['LapNumber'].max())
-
-        # Process Laps for all drivers (Global Laps Data)
-        all_laps_data = []
-        if hasattr(session, 'laps') and not session.laps.empty:
-            laps_df = session.laps.copy()
-            # Select relevant columns
-            laps_cols = ['Driver', 'LapTime', 'LapNumber', 'LapStartTime', 'Compound', 'TyreLife']
-            # Ensure columns exist
-            laps_cols = [c for c in laps_cols if c in laps_df.columns]
-            laps_export = laps_df[laps_cols].copy()
-            
-            # Convert Timedeltas
-            for col in ['LapTime', 'LapStartTime']:
-                if col in laps_export.columns:
-                    laps_export[col] = laps_export[col].dt.total_seconds()
-            
-            # Handle NaNs - DO NOT fill Time columns with 0 as it breaks logic
-            # We only fill non-time columns if needed, or let JSON handle nulls
-            # laps_export = laps_export.fillna(0) 
-            
-            all_laps_data = json.loads(laps_export.to_json(orient='records'))
-
-        return {
-            "telemetry": all_drivers_data,
-            "drivers": drivers_info,
-            "laps": laps_data,  # Changed from all_laps_data - this includes sector times and pit times
-            "events": events,
-            "race_control": race_control,
-            "circuit_info": circuit_info,
-            "weather": weather_data,
-            "total_laps": total_laps,
-            "time_base": global_t0
-        }
+                playback_room.control(json.loads(text))
+            except ValueError as e:
+                subscriber.offer(json.dumps({"type": "error", "detail": str(e)}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        playback_hub.leave(key, playback_room, subscriber)
+
+
+@app.get("/api/playback")
+def get_playback_rooms():
+    """Open playback rooms and their viewers."""
+    rooms = [
+        {**room.state(), "replay": key, "dropped_frames": sum(s.dropped for s in room.subscribers)}
+        for (key, _), room in playback_hub.rooms.items()
+    ]
+    return dict(playback_hub.stats(), room_list=rooms)
+
+
+@app.get("/api/{year}/{race_name}/track")
+async def get_track(year: int, race_name: str, request: Request, respond_async: bool = Query(False, alias="async")):
+    """
+    Circuit outline (simplified fastest-lap polyline with cumulative distance), timing sector
+    boundaries, corners and marshal sectors, all on the same distance axis (position units, 1/10 m).
+    """
+    key, params = track_cache_key(year, race_name, 'R')
+    etag = make_etag(key, "track")
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={REPLAY_HTTP_MAX_AGE}"}
+    if track_cache.on_disk(key) and etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    track = await _get_track(request, year, race_name, respond_async)
+    if isinstance(track, Response):
+        return track
+    return JSONResponse(track.payload, headers=headers)
+
+
+@app.get("/api/{year}/{race_name}/analytics")
+async def get_analytics(
+    year: int,
+    race_name: str,
+    request: Request,
+    parts: str | None = None,
+    respond_async: bool = Query(False, alias="async"),
+):
+    """
+    Lap analytics computed server-side from the race's laps: best / theoretical-best laps and sector deltas
+    ("laps"), stints with degradation slopes ("stints"), pit lane time and pit loss ("pit_stops") and the
+    gap-to-leader series ("gaps"). ?parts=laps,gaps returns a subset.
+    """
+    wanted = [p.strip() for p in parts.split(',') if p.strip()] if parts else list(ANALYTICS_PARTS)
+    unknown = sorted(set(wanted) - set(ANALYTICS_PARTS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown analytics parts: {', '.join(unknown)} (use {', '.join(ANALYTICS_PARTS)})")
+    key, params = analytics_cache_key(year, race_name, 'R')
+    etag = make_etag(key, "analytics:" + ",".join(wanted))
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={REPLAY_HTTP_MAX_AGE}"}
+    if analytics_cache.on_disk(key) and etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    job = (build_analytics_job, analytics_cache.root, os.path.abspath(cache_dir), year, race_name, 'R')
+    info = {"kind": "analytics", "year": year, "race_name": race_name}
+    payload = await _get_or_build(request, analytics_cache, key, job, info, respond_async)
+    if isinstance(payload, Response):
+        return payload
+    body = {"version": payload["version"], "drivers": payload["drivers"], **{part: payload[part] for part in wanted}}
+    return JSONResponse(body, headers=headers)
+
+
+def _parse_lap_pairs(laps: str):
+    """'1:12,44:15' -> [('1', 12), ('44', 15)] (driver number : lap number)."""
+    pairs = []
+    for item in laps.split(','):
+        driver, sep, lap = item.strip().partition(':')
+        if not sep or not driver.strip().isdigit() or not lap.strip().isdigit():
+            raise HTTPException(status_code=400, detail=f"Bad lap '{item}': use <driver number>:<lap number>")
+        pairs.append((driver.strip(), int(lap)))
+    if not pairs or len(pairs) > LAP_COMPARE_MAX_LAPS:
+        raise HTTPException(status_code=400, detail=f"Compare between 1 and {LAP_COMPARE_MAX_LAPS} laps")
+    return pairs
+
+
+@app.get("/api/{year}/{race_name}/compare")
+async def get_lap_comparison(
+    year: int,
+    race_name: str,
+    request: Request,
+    laps: str,
+    session: str = 'R',
+    respond_async: bool = Query(False, alias="async"),
+):
+    """
+    Laps of one session aligned by track distance: ?laps=1:12,44:15&session=Q returns the shared
+    distance grid (position units, as /track), each lap's Speed/Throttle/Brake/nGear and elapsed
+    Time on it, and its cumulative Delta to the first lap. Each lap is resampled once and cached.
+    """
+    session_type = session.upper()
+    if session_type not in SESSION_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown session '{session}' (use {', '.join(SESSION_TYPES)})")
+    pairs = _parse_lap_pairs(laps)
+    keys = [lap_trace_key(year, race_name, session_type, driver, lap)[0] for driver, lap in pairs]
+    etag = make_etag(",".join(keys), "compare")
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={REPLAY_HTTP_MAX_AGE}"}
+    if all(lap_trace_cache.on_disk(key) for key in keys) and etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    retries = 0
+    while True:
+        missing = [pair for pair, key in zip(pairs, keys) if not lap_trace_cache.on_disk(key)]
+        if not missing:
+            break
+        # One build per request loads the session once for all its missing laps; it is tracked
+        # under the first missing lap's key, so another request may own it: loop until all are in
+        key = keys[pairs.index(missing[0])]
+        laps_built = [f"{driver}:{lap}" for driver, lap in missing]
+        info = {"kind": "laps", "year": year, "race_name": race_name, "session_type": session_type, "laps": laps_built}
+        job = (build_lap_traces_job, lap_trace_cache.root, track_cache.root, os.path.abspath(cache_dir),
+               year, race_name, session_type, missing)
+        try:
+            built = await _get_or_build(request, lap_trace_cache, key, job, info, respond_async)
+        except HTTPException as e:
+            # A joined build for other laps failed on those laps: ours were published or still
+            # need a build of their own. Only a failed build of exactly our laps is our error.
+            status = build_pool.status(key) or {}
+            if e.status_code != 404 or set(status.get("laps", ())) == set(laps_built):
+                raise
+            if retries >= LAP_COMPARE_BUILD_RETRIES:
+                raise HTTPException(status_code=503, detail=f"Laps {', '.join(laps_built)} not built yet: other builds failed",
+                                    headers={"Retry-After": str(REPLAY_BUILD_RETRY_AFTER)})
+            retries += 1
+            continue
+        if isinstance(built, Response):
+            return built
+
+    traces = []
+    with timed('cache_load'):
+        for key in keys:
+            traces.append(await run_in_threadpool(lap_trace_cache.get, key))
+    return JSONResponse(compare_traces(traces), headers=headers)
+
+
+@app.get("/api/builds/{key}")
+def get_build_status(key: str):
+    """Poll target for 202 "building" responses."""
+    if any(cache.on_disk(key) for cache in (replay_cache, track_cache, analytics_cache, lap_trace_cache)):
+        status = dict(build_pool.status(key) or {}, state='done')
+    else:
+        status = build_pool.status(key)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown build")
+    return dict(status, key=key)
+
+
+def _replay_response(replay, wire_format, include_sections=True, extra=None):
+    # Payloads are already plain JSON types; JSONResponse skips the (slow) jsonable_encoder pass
+    if wire_format == 'binary':
+        return Response(content=binary_payload(replay, include_sections, extra), media_type=BINARY_MEDIA_TYPE)
+    if wire_format == 'delta':
+        return Response(content=delta_payload(replay, include_sections, extra), media_type=DELTA_MEDIA_TYPE)
+    if wire_format == 'columnar':
+        payload = columnar_payload(replay, include_sections)
+    else:
+        payload = replay.to_payload(include_sections)
+    payload.update(extra or {})
+    return JSONResponse(payload)
+
+
+def _media_type(wire_format):
+    if wire_format == 'binary':
+        return BINARY_MEDIA_TYPE
+    if wire_format == 'delta':
+        return DELTA_MEDIA_TYPE
+    return 'application/json'
+
+
+def _replay_key(year: int, race_name: str, tolerance: float | None = None):
+    resample_rate = REPLAY_RESAMPLE_RATE if tolerance is None else REPLAY_FINE_RESAMPLE_RATE
+    key, params = make_cache_key(year, race_name, 'R', resample_rate, PIPELINE_VERSION)
+    return key
+
+
+def _simplify_variant(tolerance, max_gap):
+    if tolerance is None:
+        return "full"
+    return f"tol={round(tolerance, 3):g}|gap={round(max_gap, 3):g}"
+
+
+def _cache_headers(etag):
+    # Vary: Accept because the wire format can be negotiated from it
+    return {"ETag": etag, "Cache-Control": f"public, max-age={REPLAY_HTTP_MAX_AGE}", "Vary": "Accept, Accept-Encoding"}
+
+
+def _artifact_response(request, key, variant, media_type, store=True):
+    """304, or the stored artifact in the best accepted encoding, for a cached replay; None otherwise."""
+    if not replay_cache.on_disk(key):
+        return None
+    etag = make_etag(key, variant)
+    headers = _cache_headers(etag)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        metrics.ARTIFACT_LOOKUPS.inc(result='not_modified')
+        return Response(status_code=304, headers=headers)
+    if not store:
+        return None
+    entry_dir = replay_cache.entry_dir(key)
+    available = http_artifacts.available(entry_dir, variant)
+    if not available:
+        metrics.ARTIFACT_LOOKUPS.inc(result='miss')
+        return None
+    metrics.ARTIFACT_LOOKUPS.inc(result='hit')
+    encoding = choose_encoding(request.headers.get('accept-encoding'), available)
+    if encoding != 'identity':
+        headers["Content-Encoding"] = encoding
+    return FileResponse(http_artifacts.path(entry_dir, variant, encoding), media_type=media_type, headers=headers)
+
+
+def _render_cached(request, key, variant, render, store=True):
+    """Render a response once; store it as precompressed artifacts when asked, and tag it with the ETag."""
+    with timed('render'):
+        response = render()
+    if store and replay_cache.on_disk(key):
+        try:
+            with timed('artifact_write'):
+                http_artifacts.write(replay_cache.entry_dir(key), variant, response.body)
+            served = _artifact_response(request, key, variant, response.media_type)
+            if served is not None:
+                return served
+        except OSError as e:
+            print(f"Could not store HTTP artifact for {key}: {e}")
+    response.headers.update(_cache_headers(make_etag(key, variant)))
+    return response
+
+
+async def _replay_render(request, key, variant, replay, wire_format, include_sections=True, extra=None, store=True):
+    """
+    Render a replay response. JSON formats are streamed one driver at a time (and teed into the
+    precompressed artifacts), which bounds peak memory and sends the first byte right away.
+    """
+    if wire_format in ('binary', 'delta'):
+        render = functools.partial(_replay_response, replay, wire_format, include_sections, extra)
+        return await run_in_threadpool(_render_cached, request, key, variant, render, store)
+
+    writer = None
+    if store and replay_cache.on_disk(key):
+        try:
+            writer = http_artifacts.writer(replay_cache.entry_dir(key), variant)
+        except OSError as e:
+            print(f"Could not store HTTP artifact for {key}: {e}")
+    chunks = iter_json_payload(replay, wire_format, include_sections, extra)
+    return StreamingResponse(
+        stream_through(chunks, writer), media_type='application/json', headers=_cache_headers(make_etag(key, variant))
+    )
+
+
+def _building_response(request, key):
+    poll_url = f"/api/builds/{key}"
+    return JSONResponse(
+        status_code=202,
+        content={"status": "building", "key": key, "poll_url": poll_url, "result_url": str(request.url)},
+        headers={"Location": poll_url, "Retry-After": str(REPLAY_BUILD_RETRY_AFTER)},
+    )
+
+
+async def _run_heavy(key, fn, *args):
+    """Run a FastF1-bound call on the build pool (deduplicated by key) and await its result."""
+    kind = key.split(':', 1)[0]
+    try:
+        future = build_pool.submit(key, fn, *args, info={"kind": kind})
+    except PoolFull as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": str(REPLAY_BUILD_RETRY_AFTER)})
+    with timed(kind):
+        return await asyncio.shield(future)
+
+
+def _note_build_timings(cache, key):
+    """Add the stages of the build this request waited for to its Server-Timing (as build.<stage>)."""
+    timings = metrics.current()
+    build = read_build_timings(cache.entry_dir(key))
+    if timings is not None and build is not None:
+        for stage, seconds in build["stages"].items():
+            timings.add(f"build.{stage}", seconds)
+
+
+async def _get_processed_replay(request, year: int, race_name: str, resample_rate: str = REPLAY_RESAMPLE_RATE, respond_async: bool = False):
+    """The cached replay, or a 202/503 Response when it still has to be built and the caller won't wait."""
+    key, params = make_cache_key(year, race_name, 'R', resample_rate, PIPELINE_VERSION)
+    job = (build_replay_job, replay_cache.root, os.path.abspath(cache_dir), year, race_name, 'R', resample_rate,
+           True, REPLAY_DRIVER_WORKERS, track_cache.root, analytics_cache.root)
+    info = {"kind": "replay", "year": year, "race_name": race_name, "resample_rate": resample_rate}
+    return await _get_or_build(request, replay_cache, key, job, info, respond_async)
+
+
+async def _get_track(request, year: int, race_name: str, respond_async: bool = False):
+    """The cached Track (outline + spatial index) of a race, or a 202/503 Response like _get_processed_replay."""
+    key, params = track_cache_key(year, race_name, 'R')
+    job = (build_track_job, track_cache.root, os.path.abspath(cache_dir), year, race_name, 'R')
+    return await _get_or_build(request, track_cache, key, job, {"kind": "track", "year": year, "race_name": race_name}, respond_async)
+
+
+async def _get_or_build(request, cache, key, job, info, respond_async):
+    """
+    cache.get(key), building it first on the build pool when it's cold: job is (fn, *args),
+    and fn publishes the value to the on-disk cache from the worker process.
+    """
+    with timed('cache_lookup'):
+        value = await run_in_threadpool(cache.get, key)
+    if value is not None:
+        return value
+
+    try:
+        future = build_pool.submit(key, *job, info=info)
+    except PoolFull as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": str(REPLAY_BUILD_RETRY_AFTER)})
 
+    if respond_async or 'respond-async' in request.headers.get('prefer', ''):
+        return _building_response(request, key)
+    try:
+        with timed('build_wait'):
+            await asyncio.wait_for(asyncio.shield(future), timeout=REPLAY_BUILD_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        return _building_response(request, key)
+    except LookupError as e:
+        # The session has no data to build from
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        # In production, log the error
         print(f"Endpoint Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    with timed('cache_load'):
+        value = await run_in_threadpool(cache.get, key)
+    if value is None:
+        raise HTTPException(status_code=500, detail="Build finished but no cache entry was written")
+    _note_build_timings(cache, key)
+    return value
+
+
+def _cached_manifest(year: int, race_name: str):
+    for resample_rate in (REPLAY_RESAMPLE_RATE, REPLAY_FINE_RESAMPLE_RATE):
+        key, params = make_cache_key(year, race_name, 'R', resample_rate, PIPELINE_VERSION)
+        if replay_cache.on_disk(key):
+            manifest = read_manifest(replay_cache.entry_dir(key))
+            if manifest is not None:
+                return manifest
+    return None
+
+
+async def _get_replay_for_request(request, year: int, race_name: str, tolerance: float | None, max_gap: float, respond_async: bool):
+    if tolerance is None:
+        return await _get_processed_replay(request, year, race_name, respond_async=respond_async)
+    if not tolerance >= REPLAY_MIN_TOLERANCE or not max_gap >= 0:
+        raise HTTPException(status_code=400, detail=f"tolerance must be >= {REPLAY_MIN_TOLERANCE:g} and max_gap >= 0")
+
+    replay = await _get_processed_replay(request, year, race_name, REPLAY_FINE_RESAMPLE_RATE, respond_async)
+    if isinstance(replay, Response):
+        return replay
+    memo_key = ('simplified', round(tolerance, 3), round(max_gap, 3))
+    grid = replay.derived.get(memo_key)
+    if grid is None:
+        with timed('simplify'):
+            grid = await run_in_threadpool(simplify_grid, replay.grid, tolerance, max_gap)
+        if len(replay.derived) >= 8:
+            replay.derived.clear()
+        replay.derived[memo_key] = grid
+    return ProcessedReplay(grid, replay.sections, replay.standings, replay.manifest, replay.timeline)
+
 
 @app.get("/api/{year}/{race_name}/race/telemetry_replay_meta")
-def get_telemetry_replay_meta(year: int, race_name: str):
-    """Lightweight debug endpoint to confirm what's in telemetry_replay without downloading huge payloads."""
+async def get_telemetry_replay_meta(year: int, race_name: str):
+    """
+    Lightweight debug endpoint to confirm what's in telemetry_replay without downloading huge payloads.
+    Answered from the manifest of the cached replay; races that were never built fall back to a
+    session load without telemetry.
+    """
+    manifest = await run_in_threadpool(_cached_manifest, year, race_name)
+    if manifest is not None:
+        return replay_meta_from_manifest(year, race_name, manifest)
     try:
-        print(f"Loading session (meta) for {year} {race_name}...")
-        session = fastf1.get_session(year, race_name, 'R')
-
-        try:
-            session.load(telemetry=True, laps=True, weather=True, messages=True)
-        except TypeError:
-            session.load(telemetry=True, laps=True, weather=True)
-
-        drivers = list(getattr(session, 'drivers', []) or [])
-
-        # Total laps
-        total_laps = 0
-        if hasattr(session, 'total_laps'):
-            total_laps = session.total_laps
-        elif hasattr(session, 'laps') and session.laps is not None and not session.laps.empty and 'LapNumber' in session.laps.columns:
-            total_laps = int(session.laps['LapNumber'].max())
-
-        # Time ranges from full-session data if available
-        t_min = None
-        t_max = None
-        pos_dict = getattr(session, 'pos_data', None)
-        car_dict = getattr(session, 'car_data', None)
-        has_pos = isinstance(pos_dict, dict)
-        has_car = isinstance(car_dict, dict)
-
-        def _update_min_max(seconds_value: float):
-            nonlocal t_min, t_max
-            if seconds_value is None:
-                return
-            seconds_value = float(seconds_value)
-            t_min = seconds_value if t_min is None else min(t_min, seconds_value)
-            t_max = seconds_value if t_max is None else max(t_max, seconds_value)
-
-        if has_pos or has_car:
-            for d in drivers:
-                for src in (pos_dict, car_dict):
-                    if not isinstance(src, dict) or d not in src:
-                        continue
-                    df = src[d]
-                    if df is None or df.empty or 'Time' not in df.columns:
-                        continue
-                    time_col = df['Time']
-                    try:
-                        if not pd.api.types.is_timedelta64_ns_dtype(time_col):
-                            time_col = pd.to_timedelta(time_col)
-                        _update_min_max(time_col.min().total_seconds())
-                        _update_min_max(time_col.max().total_seconds())
-                    except Exception:
-                        continue
-
-        # Fallback: lap-based times
-        if t_min is None or t_max is None:
-            try:
-                if hasattr(session, 'laps') and session.laps is not None and not session.laps.empty and 'LapStartTime' in session.laps.columns:
-                    lst = session.laps['LapStartTime'].dropna()
-                    if not lst.empty:
-                        _update_min_max(pd.to_timedelta(lst.min()).total_seconds())
-                        _update_min_max(pd.to_timedelta(lst.max()).total_seconds())
-            except Exception:
-                pass
-
-        # Counts of other streams
-        laps_count = int(len(session.laps)) if hasattr(session, 'laps') and session.laps is not None else 0
-        events_count = int(len(session.track_status)) if hasattr(session, 'track_status') and session.track_status is not None else 0
-        rc_count = int(len(session.race_control_messages)) if hasattr(session, 'race_control_messages') and session.race_control_messages is not None else 0
-        weather_count = int(len(session.weather_data)) if hasattr(session, 'weather_data') and session.weather_data is not None else 0
-
-        # Shape hints (without building telemetry)
-        pos_rows = 0
-        car_rows = 0
-        if has_pos:
-            for d in drivers:
-                if d in pos_dict and pos_dict[d] is not None:
-                    pos_rows += int(len(pos_dict[d]))
-        if has_car:
-            for d in drivers:
-                if d in car_dict and car_dict[d] is not None:
-                    car_rows += int(len(car_dict[d]))
-
-        return {
-            "year": year,
-            "race_name": race_name,
-            "drivers_count": len(drivers),
-            "total_laps": total_laps,
-            "time_min_seconds": t_min,
-            "time_max_seconds": t_max,
-            "has_pos_data": has_pos,
-            "has_car_data": has_car,
-            "pos_rows_total": pos_rows,
-            "car_rows_total": car_rows,
-            "laps_rows": laps_count,
-            "events_rows": events_count,
-            "race_control_rows": rc_count,
-            "weather_rows": weather_count,
-            "expected_top_level_keys": [
-                "telemetry",
-                "drivers",
-                "laps",
-                "events",
-                "race_control",
-                "circuit_info",
-                "weather",
-                "total_laps",
-                "time_base",
-            ],
-        }
+        return await _run_heavy(f"meta:{year}:{race_name.strip().lower()}", fetch_replay_meta, year, race_name)
+    except HTTPException:
+        raise
+    except LookupError as e:
+        # e.g. a race that is not in the local dataset (data_sources.py)
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         print(f"Meta endpoint error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/{year}/{race_name}/race/team_radio")
-def get_team_radio(year: int, race_name: str):
+async def get_team_radio(year: int, race_name: str):
     try:
-        session = fastf1.get_session(year, race_name, 'R')
-        # Need to load messages (FastF1 >= 3.0 requires explicit messages=True)
-        try:
-            session.load(telemetry=False, laps=False, weather=False, messages=True)
-        except TypeError:
-            # Older FastF1 version doesn't have messages parameter
-            session.load(telemetry=False, laps=False, weather=False)
-        
-        radio_data = []
-        
-        # Try team_radio attribute (FastF1 >= 3.0)
-        if hasattr(session, 'team_radio') and session.team_radio is not None and not session.team_radio.empty:
-            radios = session.team_radio.copy()
-            if 'Time' in radios.columns:
-                radios['Time'] = radios['Time'].dt.total_seconds()
-            cols = [c for c in ['Time', 'Driver', 'Message'] if c in radios.columns]
-            radio_data = json.loads(radios[cols].to_json(orient='records'))
-        # Fallback: Try get_driver_radio (older FastF1)
-        elif hasattr(session, 'get_driver_radio'):
-            for driver in session.drivers[:10]:  # Limit to first 10 drivers
-                try:
-                    radio = session.get_driver_radio(driver)
-                    if radio is not None and not radio.empty:
-                        radio['Driver'] = driver
-                        if 'Time' in radio.columns:
-                            radio['Time'] = radio['Time'].dt.total_seconds()
-                        cols = [c for c in ['Time', 'Driver', 'Message'] if c in radio.columns]
-                        radio_data.extend(json.loads(radio[cols].to_json(orient='records')))
-                except:
-                    pass
-        
-        print(f"Team radio: {len(radio_data)} messages loaded")
-        return radio_data
+        return await _run_heavy(f"radio:{year}:{race_name.strip().lower()}", fetch_team_radio, year, race_name)
     except Exception as e:
         print(f"Error fetching radio: {e}")
-        import traceback
-        traceback.print_exc()
         return []
 
 if __name__ == "__main__":
@@ -0,0 +1,372 @@
+"""
+Backend instrumentation.
+
+- A small Prometheus registry (counters, gauges, histograms with labels) rendered
+  in the text exposition format by GET /metrics, without a client library.
+- Stage timings: hot-path code wraps its work in timed('stage'). Each stage feeds
+  the prah_stage_seconds histogram and the Timings of the current request (or
+  build), which RequestMetrics turns into a Server-Timing response header.
+- Replay builds run in worker processes, so their per-stage and per-driver
+  timings are written next to the cached replay (build.json) and recorded here by
+  observe_build when the build finishes.
+- Opt-in sampling profiler for single requests (PROFILE_DIR + ?profile=1).
+"""
+import contextlib
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from collections import OrderedDict
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def remove(self, **labels):
+        """Drop every series whose labels include the given ones."""
+        wanted = {self.labels.index(name): str(value) for name, value in labels.items()}
+        with self._lock:
+            for key in [k for k in self._values if all(k[i] == v for i, v in wanted.items())]:
+                del self._values[key]
+
+    def _samples(self):
+        with self._lock:
+            return [('', self.labels, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append(('_bucket', self.labels + ('le',), key + (_format_value(bound),), cumulative))
+                samples.append(('_sum', self.labels, key, total))
+                samples.append(('_count', self.labels, key, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        """collect() -> metrics built at scrape time (e.g. from another component's stats)."""
+        self._collectors.append(collect)
+
+    def render(self):
+        metrics = list(self._metrics)
+        for collect in self._collectors:
+            try:
+                metrics.extend(collect())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter('prah_http_requests_total', "HTTP requests by route, method and status.", ('route', 'method', 'status'))
+REQUEST_SECONDS = registry.histogram(
+    'prah_http_request_duration_seconds', "Time until the response body was sent.", ('route', 'method'))
+STAGE_SECONDS = registry.histogram('prah_stage_seconds', "Request hot-path stages (see Server-Timing).", ('stage',))
+BUILD_STAGE_SECONDS = registry.histogram('prah_build_stage_seconds', "Replay build stages, from the build workers.", ('stage',))
+BUILD_LAST_STAGE = registry.gauge('prah_build_last_stage_seconds', "Stages of the latest build of a race.", ('race', 'stage'))
+BUILD_LAST_DRIVER = registry.gauge(
+    'prah_build_last_driver_seconds', "Per-driver stages of the latest build of a race.", ('race', 'driver', 'stage'))
+QUEUE_WAIT_SECONDS = registry.histogram(
+    'prah_build_queue_wait_seconds', "Time a build pool job waited for a worker.", ('kind',))
+RUN_SECONDS = registry.histogram('prah_build_run_seconds', "Time a build pool job ran in its worker.", ('kind',))
+BUILD_FAILURES = registry.counter('prah_build_failures_total', "Build pool jobs that failed.", ('kind',))
+ARTIFACT_LOOKUPS = registry.counter(
+    'prah_http_artifact_lookups_total', "Precompressed response lookups (hit, not_modified, miss).", ('result',))
+
+# Races with per-race build gauges; older ones are dropped to bound the label cardinality
+BUILD_RACE_LABELS = int(os.environ.get('METRICS_BUILD_RACES', '16'))
+_build_races = OrderedDict()
+_build_races_lock = threading.Lock()
+
+
+class Timings:
+    """Stage durations (seconds) collected for one request or one replay build."""
+
+    def __init__(self):
+        self.stages = {}
+        self.drivers = {}
+
+    def add(self, stage, seconds, driver=None):
+        if driver is None:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        else:
+            per_driver = self.drivers.setdefault(str(driver), {})
+            per_driver[stage] = per_driver.get(stage, 0.0) + seconds
+
+    def to_dict(self):
+        return {
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "drivers": {
+                driver: {stage: round(seconds, 6) for stage, seconds in stages.items()}
+                for driver, stages in self.drivers.items()
+            },
+        }
+
+    def server_timing(self):
+        return ', '.join(
+            f"{re.sub(r'[^A-Za-z0-9_.-]', '_', stage)};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()
+        )
+
+
+_current = contextvars.ContextVar('prah_timings', default=None)
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def collect(timings=None):
+    """Make timings (a new Timings by default) the target of timed()/record() in this context."""
+    timings = Timings() if timings is None else timings
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record(stage, seconds, driver=None):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds, driver)
+    if driver is None:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextlib.contextmanager
+def timed(stage, driver=None):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started, driver)
+
+
+def observe_build(race, build):
+    """Record the timings a build worker stored with its replay (stages and per-driver stages)."""
+    for stage, seconds in build.get("stages", {}).items():
+        BUILD_STAGE_SECONDS.observe(seconds, stage=stage)
+    with _build_races_lock:
+        BUILD_LAST_STAGE.remove(race=race)
+        BUILD_LAST_DRIVER.remove(race=race)
+        for stage, seconds in build.get("stages", {}).items():
+            BUILD_LAST_STAGE.set(seconds, race=race, stage=stage)
+        for driver, stages in build.get("drivers", {}).items():
+            for stage, seconds in stages.items():
+                BUILD_LAST_DRIVER.set(seconds, race=race, driver=driver, stage=stage)
+        _build_races[race] = True
+        _build_races.move_to_end(race)
+        while len(_build_races) > max(1, BUILD_RACE_LABELS):
+            old, _ = _build_races.popitem(last=False)
+            BUILD_LAST_STAGE.remove(race=old)
+            BUILD_LAST_DRIVER.remove(race=old)
+
+
+def observe_job(kind, status):
+    """Record a finished build pool job from its status (see BuildPool)."""
+    if status.get('state') != 'done':
+        BUILD_FAILURES.inc(kind=kind)
+        return
+    if status.get('queue_wait') is not None:
+        QUEUE_WAIT_SECONDS.observe(status['queue_wait'], kind=kind)
+    if status.get('run_seconds') is not None:
+        RUN_SECONDS.observe(status['run_seconds'], kind=kind)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread in the process at a fixed interval and writes
+    them as collapsed stacks ("thread;outer;...;inner count", readable by
+    flamegraph.pl and speedscope). Sampling all threads covers the work a request
+    hands to the threadpool, which a per-thread cProfile would miss; other requests
+    served at the same time show up too.
+    """
+
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.interval = interval
+        self._counts = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for stack, count in self._counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestMetrics:
+    """
+    ASGI middleware: collects the Timings of each request, adds them as a
+    Server-Timing header (stages finished before the headers were sent, plus
+    "total" up to that point), and records request counts and durations per route.
+
+    With profile_dir set, a request carrying ?profile=1 (or an X-Profile header)
+    runs under SamplingProfiler; the output file name is returned in X-Profile.
+    """
+
+    def __init__(self, app, profile_dir=None):
+        self.app = app
+        self.profile_dir = profile_dir
+
+    def _wants_profile(self, scope):
+        if not self.profile_dir:
+            return False
+        if any(name == b'x-profile' for name, _ in scope.get('headers', ())):
+            return True
+        return re.search(rb'(^|&)profile=(1|true)(&|$)', scope.get('query_string', b'')) is not None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        from starlette.datastructures import MutableHeaders
+
+        started = time.perf_counter()
+        status = [500]
+        profiler = None
+        if self._wants_profile(scope):
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9]+', '_', scope['path']).strip('_')}.collapsed"
+            profiler = SamplingProfiler(os.path.join(self.profile_dir, name)).start()
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                timings.add('total', time.perf_counter() - started)
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', timings.server_timing())
+                if profiler is not None:
+                    headers.append('X-Profile', os.path.basename(profiler.path))
+            await send(message)
+
+        with collect() as timings:
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                elapsed = time.perf_counter() - started
+                route = getattr(scope.get('route'), 'path', 'unmatched')
+                REQUESTS.inc(route=route, method=scope['method'], status=status[0])
+                REQUEST_SECONDS.observe(elapsed, route=route, method=scope['method'])
+                if profiler is not None:
+                    profiler.stop()
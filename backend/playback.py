@@ -0,0 +1,288 @@
+"""
+Shared-clock replay playback for many viewers (watch parties).
+
+A PlaybackRoom plays one cached ProcessedReplay on a server-side clock
+(play / pause / seek / speed, changed by any viewer) and pushes the frame of the
+current replay tick to every subscriber:
+
+- FrameEncoder turns a tick (positions, speed, lap and the standings row) into
+  JSON text once; every room playing the same replay shares its encoder
+- a tick's text is handed to each subscriber's bounded queue, so the per-viewer
+  cost is a queue put plus the socket write done by that viewer's sender task
+- a slow viewer's queue drops its oldest frames rather than holding up the room
+
+Subscribers are plain async callables taking the text to send (WebSocket.send_text
+in the server, counters in benchmarks/playback_clients.py).
+"""
+import asyncio
+import json
+import math
+import time
+
+import numpy as np
+
+# How often a room checks its clock for a new tick (seconds)
+FRAME_INTERVAL = 0.1
+# Frames buffered per viewer before the oldest are dropped
+CLIENT_QUEUE_FRAMES = 8
+# Accepted playback speeds
+MIN_SPEED = 0.1
+MAX_SPEED = 64.0
+
+
+def _number(value):
+    """value as a finite float, or None (JSON also decodes NaN / Infinity, and bools are ints)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    try:
+        value = float(value)
+    except OverflowError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def log_task_error(task):
+    """Done callback: report why a background task died (its exception is never awaited)."""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Playback task {task.get_name()} failed: {task.exception()!r}")
+
+
+def _listed(values, decimals):
+    values = np.round(values.astype(np.float64), decimals)
+    return [None if v != v else v for v in values.tolist()]
+
+
+class FrameEncoder:
+    """Encoded frames of one replay, one per grid tick, built on first use."""
+
+    def __init__(self, replay):
+        grid = replay.grid
+        self.time = grid.time
+        self.drivers = grid.drivers
+        self.duration = grid.duration
+        self.standings = replay.standings
+        self._grid = grid
+        self._frames = {}
+        self.encoded = 0
+
+        # Outside its span a driver has no position
+        active = np.zeros((len(grid.time), len(grid.drivers)), dtype=bool)
+        for d in range(len(grid.drivers)):
+            active[grid.spans[d, 0]:grid.spans[d, 1], d] = True
+        self._active = active
+
+        drivers_info = replay.sections.get('drivers') or {}
+        self.hello = json.dumps({
+            "type": "hello",
+            "drivers": self.drivers,
+            "abbreviations": [(drivers_info.get(d) or {}).get('Abbreviation') for d in self.drivers],
+            "duration": self.duration,
+            "ticks": len(self.time),
+        }, separators=(',', ':'))
+
+    def tick_at(self, t):
+        """Index of the last tick at or before replay time t."""
+        if not len(self.time):
+            return 0
+        return int(np.clip(np.searchsorted(self.time, t, side='right') - 1, 0, len(self.time) - 1))
+
+    def _channel(self, tick, name, decimals):
+        values = self._grid.data[tick, :, self._grid.channel_index(name)]
+        return _listed(np.where(self._active[tick], values, np.nan), decimals)
+
+    def frame(self, tick):
+        text = self._frames.get(tick)
+        if text is None:
+            frame = {
+                "type": "frame",
+                "tick": tick,
+                "time": round(float(self.time[tick]), 3),
+                "x": self._channel(tick, 'X', 1),
+                "y": self._channel(tick, 'Y', 1),
+                "speed": self._channel(tick, 'Speed', 0),
+            }
+            table = self.standings
+            if table is not None and tick < len(table.time):
+                frame.update(
+                    order=table.order[tick].tolist(),
+                    lap=table.lap[tick].tolist(),
+                    gap=_listed(table.gap[tick], 3),
+                    interval=_listed(table.interval[tick], 3),
+                    status=table.status[tick].tolist(),
+                )
+            text = self._frames[tick] = json.dumps(frame, separators=(',', ':'))
+            self.encoded += 1
+        return text
+
+
+class Subscriber:
+    def __init__(self, send, queue_size):
+        self.send = send
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.sent = 0
+
+    def offer(self, text):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(text)
+
+    async def pump(self):
+        """Sender task: write queued frames to the viewer until cancelled (or the send fails)."""
+        while True:
+            text = await self.queue.get()
+            await self.send(text)
+            self.sent += 1
+
+
+class PlaybackRoom:
+    """One shared clock over a replay; position is in replay (zero-based) seconds."""
+
+    def __init__(self, name, encoder, interval=FRAME_INTERVAL, queue_size=CLIENT_QUEUE_FRAMES, clock=time.monotonic):
+        self.name = name
+        self.encoder = encoder
+        self.interval = interval
+        self.queue_size = queue_size
+        self._clock = clock
+        self.position = 0.0
+        self.speed = 1.0
+        self.playing = False
+        self._anchor = clock()
+        self._last_tick = None
+        self._task = None
+        self.subscribers = []
+        self.broadcasts = 0
+
+    def now(self):
+        if not self.playing:
+            return self.position
+        return min(self.encoder.duration, self.position + (self._clock() - self._anchor) * self.speed)
+
+    def state(self):
+        return {
+            "type": "state",
+            "room": self.name,
+            "playing": self.playing,
+            "speed": self.speed,
+            "time": round(self.now(), 3),
+            "duration": self.encoder.duration,
+            "viewers": len(self.subscribers),
+        }
+
+    def control(self, message):
+        """Apply a viewer's command ({"action": "play"|"pause"|"seek"|"speed", "value": ...}). Raises ValueError."""
+        action = message.get('action') if isinstance(message, dict) else None
+        value = message.get('value') if isinstance(message, dict) else None
+        position = self.now()
+        if action == 'play':
+            if position >= self.encoder.duration:
+                position = 0.0
+            self.playing = True
+        elif action == 'pause':
+            self.playing = False
+        elif action == 'seek':
+            value = _number(value)
+            if value is None:
+                raise ValueError("seek needs a finite numeric value (seconds)")
+            position = min(max(value, 0.0), self.encoder.duration)
+        elif action == 'speed':
+            value = _number(value)
+            if value is None or not MIN_SPEED <= value <= MAX_SPEED:
+                raise ValueError(f"speed must be between {MIN_SPEED:g} and {MAX_SPEED:g}")
+            self.speed = value
+        else:
+            raise ValueError(f"Unknown action {action!r} (use play, pause, seek or speed)")
+        self.position = position
+        self._anchor = self._clock()
+        self._last_tick = None
+        self.broadcast(json.dumps(self.state(), separators=(',', ':')))
+
+    def subscribe(self, send):
+        subscriber = Subscriber(send, self.queue_size)
+        # Added first, so the state it is sent counts it among the viewers
+        self.subscribers.append(subscriber)
+        subscriber.offer(self.encoder.hello)
+        subscriber.offer(json.dumps(self.state(), separators=(',', ':')))
+        subscriber.offer(self.encoder.frame(self.encoder.tick_at(self.now())))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def broadcast(self, text):
+        for subscriber in self.subscribers:
+            subscriber.offer(text)
+        self.broadcasts += 1
+
+    def step(self):
+        """Push the current tick's frame if it changed since the last push; stop at the end of the replay."""
+        position = self.now()
+        if self.playing and position >= self.encoder.duration:
+            self.position, self.playing = self.encoder.duration, False
+            self._anchor = self._clock()
+            self.broadcast(json.dumps(self.state(), separators=(',', ':')))
+        tick = self.encoder.tick_at(position)
+        if tick != self._last_tick:
+            self._last_tick = tick
+            self.broadcast(self.encoder.frame(tick))
+
+    async def run(self):
+        while True:
+            self.step()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run(), name=f"room {self.name}")
+            self._task.add_done_callback(log_task_error)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class PlaybackHub:
+    """Rooms by (replay key, room name), and the frame encoders they share by replay key."""
+
+    def __init__(self, interval=FRAME_INTERVAL, queue_size=CLIENT_QUEUE_FRAMES):
+        self.interval = interval
+        self.queue_size = queue_size
+        self.rooms = {}
+        self.encoders = {}
+
+    def join(self, key, name, replay, send):
+        """(room, subscriber) for a new viewer; the room (and its clock task) is created by the first one."""
+        room = self.rooms.get((key, name))
+        if room is None:
+            encoder = self.encoders.get(key)
+            if encoder is None:
+                encoder = self.encoders[key] = FrameEncoder(replay)
+            room = self.rooms[(key, name)] = PlaybackRoom(name, encoder, self.interval, self.queue_size)
+            room.start()
+        return room, room.subscribe(send)
+
+    def leave(self, key, room, subscriber):
+        room.unsubscribe(subscriber)
+        if room.subscribers:
+            room.broadcast(json.dumps(room.state(), separators=(',', ':')))
+            return
+        room.stop()
+        self.rooms.pop((key, room.name), None)
+        if not any(k == key for k, _ in self.rooms):
+            self.encoders.pop(key, None)
+
+    def close(self):
+        for room in self.rooms.values():
+            room.stop()
+        self.rooms.clear()
+        self.encoders.clear()
+
+    def stats(self):
+        return {
+            "rooms": len(self.rooms),
+            "viewers": sum(len(room.subscribers) for room in self.rooms.values()),
+            "frames_encoded": sum(encoder.encoded for encoder in self.encoders.values()),
+        }
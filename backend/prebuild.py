@@ -0,0 +1,82 @@
+"""
+Bake processed replays into the cache ahead of the first request (e.g. at image build time).
+
+    cd backend
+    python -m prebuild "2025:Abu Dhabi Grand Prix,2025:Las Vegas Grand Prix"
+    PREBUILD_RACES="2025:Abu Dhabi Grand Prix" python -m prebuild
+
+For each race, the season schedule is stored in the schedule index, and the replay, track
+and analytics are built by the same job the build pool and prewarm worker run
+(prewarm.build_replay_job). The default replay response (records JSON) is then rendered
+into its precompressed artifacts, so the first request for it is a file read.
+Cache locations follow main.py's environment, so run it with the same env as the server.
+"""
+import argparse
+import os
+import sys
+import time
+
+
+def parse_races(spec):
+    """[(year, EventName)] of a comma-separated "year:EventName" list."""
+    races = []
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        year, sep, name = item.partition(':')
+        if not sep or not year.strip().isdigit() or not name.strip():
+            raise ValueError(f"Expected year:EventName, got {item!r}")
+        races.append((int(year), name.strip()))
+    return races
+
+
+def prebuild(races):
+    """Build and render every race; returns the (year, race, error) of those that failed."""
+    import main
+    from prewarm import build_replay_job
+    from http_cache import stream_through
+    from replay_formats import iter_json_payload
+
+    failed = []
+    for year, race_name in races:
+        started = time.time()
+        try:
+            main.schedule_index.races(year)
+            status = build_replay_job(
+                main.replay_cache.root, os.path.abspath(main.cache_dir), year, race_name, 'R', main.REPLAY_RESAMPLE_RATE,
+                keep_session=False, driver_workers=main.REPLAY_DRIVER_WORKERS, track_cache_root=main.track_cache.root,
+                analytics_cache_root=main.analytics_cache.root,
+            )
+            key = main._replay_key(year, race_name)
+            entry_dir = main.replay_cache.entry_dir(key)
+            variant = f"replay|records|{main._simplify_variant(None, main.DEFAULT_MAX_GAP_SECONDS)}"
+            if not main.http_artifacts.available(entry_dir, variant):
+                replay = main.replay_cache.get(key)
+                writer = main.http_artifacts.writer(entry_dir, variant)
+                for _ in stream_through(iter_json_payload(replay, 'records', True, None), writer):
+                    pass
+        except Exception as e:
+            print(f"Prebuild of {year} {race_name} failed: {e}")
+            failed.append((year, race_name, str(e)))
+            continue
+        print(f"Prebuilt {year} {race_name} ({status}, {time.time() - started:.0f}s)")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('races', nargs='?', default=os.environ.get('PREBUILD_RACES', ''),
+                        help='comma-separated "year:EventName" list (default: PREBUILD_RACES)')
+    args = parser.parse_args()
+    races = parse_races(args.races)
+    if not races:
+        print("Nothing to prebuild (PREBUILD_RACES is empty)")
+        return 0
+    failed = prebuild(races)
+    print(f"Prebuilt {len(races) - len(failed)} of {len(races)} races")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Background prewarming of processed replays.
+
+A persisted job queue (SQLite) holds one job per (year, race, session). A
+dispatcher thread seeds it from the season schedules, claims due jobs and runs
+them on a process pool, so cold races are downloaded and built before anyone
+asks for them. Failed jobs are retried with exponential backoff; jobs left
+"running" by a crashed process are requeued on startup.
+
+The schedule and the build are plain callables, so the queue and dispatcher can
+be driven by a local stand-in for FastF1 (e.g. a schedule function returning a
+fixed race list and a job function that builds from a synthetic session) and by
+a ThreadPoolExecutor instead of processes.
+"""
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, ProcessPoolExecutor, wait
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    year INTEGER NOT NULL,
+    race_name TEXT NOT NULL,
+    session_type TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (year, race_name, session_type)
+)
+"""
+
+
+class JobQueue:
+    def __init__(self, db_path, max_attempts=5, backoff_seconds=60.0, max_backoff_seconds=6 * 3600.0):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def enqueue(self, year, race_name, session_type='R'):
+        """Add a job unless one already exists for the race. Returns True if added."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO jobs (year, race_name, session_type, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (int(year), race_name, session_type, QUEUED, now, now),
+            )
+            return cur.rowcount > 0
+
+    def recover(self):
+        """Requeue jobs that were running when the previous process died."""
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?", (QUEUED, time.time(), RUNNING))
+
+    def claim(self, now=None):
+        """Mark the next due job as running and return it as a dict, or None."""
+        now = time.time() if now is None else now
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, year, race_name, session_type, attempts FROM jobs "
+                "WHERE state = ? AND next_attempt_at <= ? ORDER BY year DESC, id LIMIT 1",
+                (QUEUED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, now, row[0]),
+            )
+        return {"id": row[0], "year": row[1], "race_name": row[2], "session_type": row[3], "attempts": row[4] + 1}
+
+    def complete(self, job_id, result=None):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                (DONE, result, time.time(), job_id),
+            )
+
+    def fail(self, job_id, error):
+        """Schedule a retry with exponential backoff, or give up after max_attempts."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            attempts = row[0] if row else self.max_attempts
+            if attempts >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, str(error), now, job_id),
+                )
+            else:
+                delay = min(self.backoff_seconds * (2 ** (attempts - 1)), self.max_backoff_seconds)
+                conn.execute(
+                    "UPDATE jobs SET state = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                    (QUEUED, str(error), now + delay, now, job_id),
+                )
+
+    def counts(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def recent(self, limit=20):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, year, race_name, session_type, state, attempts, next_attempt_at, last_error, result, updated_at "
+                "FROM jobs ORDER BY updated_at DESC LIMIT ?",
+                (int(limit),),
+            ).fetchall()
+        keys = ("id", "year", "race_name", "session_type", "state", "attempts", "next_attempt_at", "last_error", "result", "updated_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+def fastf1_completed_events(year, now=None, margin_hours=6):
+    """(RoundNumber, EventName) of the season's races whose race session finished at least margin_hours ago."""
+    import fastf1
+    import pandas as pd
+
+    schedule = fastf1.get_event_schedule(year, include_testing=False)
+    now = pd.Timestamp.now(tz='UTC').tz_localize(None) if now is None else now
+    events = []
+    for _, event in schedule.iterrows():
+        race_date = event.get('Session5DateUtc')
+        if race_date is None or pd.isna(race_date):
+            race_date = event.get('EventDate')
+        if race_date is None or pd.isna(race_date):
+            continue
+        race_date = pd.Timestamp(race_date)
+        if race_date.tzinfo is not None:
+            race_date = race_date.tz_convert(None)
+        if race_date + pd.Timedelta(hours=margin_hours) <= now:
+            events.append((int(event['RoundNumber']), event['EventName']))
+    return events
+
+
+def fastf1_completed_races(year, now=None, margin_hours=6):
+    """EventNames of the season's races whose race session finished at least margin_hours ago."""
+    return [name for _, name in fastf1_completed_events(year, now, margin_hours)]
+
+
+def build_replay_job(cache_root, fastf1_cache_dir, year, race_name, session_type, resample_rate, keep_session=True, driver_workers=1,
+                     track_cache_root=None, analytics_cache_root=None):
+    """
+    Process-pool entry point: load the session and publish its processed replay
+    into the on-disk replay cache. Returns 'cached' or 'built'.
+    keep_session=False drops the raw session from the worker's registry afterwards
+    (prewarm workers serve no other endpoints, so holding it would only cost memory).
+    driver_workers > 1 fills the per-driver telemetry on that many processes.
+    The stage timings of a build are stored with the replay (build.json).
+    With track_cache_root set, the circuit track (track.py) is published from the same session,
+    and likewise the lap analytics (analytics.py) with analytics_cache_root.
+    """
+    import fastf1
+
+    from metrics import collect, timed
+    from replay_builder import (
+        PIPELINE_VERSION, build_processed_replay, load_processed_replay, save_processed_replay, write_build_timings,
+    )
+    from replay_cache import ReplayCache, make_cache_key
+    from sessions import load_session, session_registry
+
+    if fastf1_cache_dir:
+        fastf1.Cache.enable_cache(fastf1_cache_dir)
+    cache = ReplayCache(cache_root, max_memory_items=0, dump=save_processed_replay, load=load_processed_replay)
+    key, params = make_cache_key(year, race_name, session_type, resample_rate, PIPELINE_VERSION)
+    if cache.on_disk(key):
+        return 'cached'
+    with collect() as timings:
+        with timed('session_load'):
+            session = load_session(year, race_name, session_type)
+        replay = build_processed_replay(session, resample_rate, driver_workers)
+        with timed('cache_write'):
+            cache.put(key, replay, params=params)
+    try:
+        write_build_timings(cache.entry_dir(key), timings.to_dict())
+    except OSError as e:
+        print(f"Could not store build timings for {key}: {e}")
+    if track_cache_root:
+        from track import publish_track
+
+        try:
+            publish_track(track_cache_root, year, race_name, session_type, session)
+        except Exception as e:
+            # The replay is published either way; the track endpoint builds it on demand
+            print(f"Could not build track for {year} {race_name}: {e}")
+    if analytics_cache_root:
+        from analytics import publish_analytics
+
+        try:
+            publish_analytics(analytics_cache_root, year, race_name, session_type, session)
+        except Exception as e:
+            print(f"Could not build analytics for {year} {race_name}: {e}")
+    if not keep_session:
+        session_registry.discard(year, race_name, session_type)
+    return 'built'
+
+
+class PrewarmWorker:
+    """
+    Dispatcher thread feeding queued jobs to an executor, at most max_concurrency at a time.
+
+    schedule(year) -> iterable of race names to prewarm for that season
+    job(year, race_name, session_type) -> short result string; must be picklable for process pools
+    """
+
+    def __init__(self, queue, seasons, schedule, job, max_concurrency=1, executor=None,
+                 session_type='R', reseed_seconds=6 * 3600.0, poll_seconds=5.0):
+        self.queue = queue
+        self.seasons = list(seasons)
+        self.schedule = schedule
+        self.job = job
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.session_type = session_type
+        self.reseed_seconds = reseed_seconds
+        self.poll_seconds = poll_seconds
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._stop = threading.Event()
+        self._thread = None
+        self._running = {}
+        self._last_seed = None
+        self.seed_errors = {}
+
+    def seed(self):
+        """Enqueue every completed race of the configured seasons (newest season first)."""
+        added = 0
+        for year in sorted(self.seasons, reverse=True):
+            try:
+                for race_name in self.schedule(year):
+                    added += int(self.queue.enqueue(year, race_name, self.session_type))
+                self.seed_errors.pop(year, None)
+            except Exception as e:
+                self.seed_errors[year] = str(e)
+                print(f"Prewarm: failed to read {year} schedule: {e}")
+        self._last_seed = time.time()
+        if added:
+            print(f"Prewarm: queued {added} new races")
+        return added
+
+    def _new_executor(self):
+        # spawn: the API process is multi-threaded, forking it is not safe
+        return ProcessPoolExecutor(self.max_concurrency, mp_context=multiprocessing.get_context('spawn'))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self._executor is None:
+            self._executor = self._new_executor()
+        self.queue.recover()
+        self._thread = threading.Thread(target=self._run, name="prewarm-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait_for_jobs=False):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_seconds * 2)
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=wait_for_jobs, cancel_futures=True)
+
+    def run_once(self):
+        """One dispatcher step: reap finished jobs and fill free slots. Returns number submitted."""
+        self._reap([f for f in self._running if f.done()])
+        submitted = 0
+        while len(self._running) < self.max_concurrency:
+            job = self.queue.claim()
+            if job is None:
+                break
+            try:
+                future = self._executor.submit(self.job, job["year"], job["race_name"], job["session_type"])
+            except BrokenExecutor as e:
+                # A worker died (e.g. OOM) and took the pool with it: retry later on a fresh pool
+                self.queue.fail(job["id"], e)
+                if not self._owns_executor:
+                    raise
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+                break
+            self._running[future] = job
+            submitted += 1
+        return submitted
+
+    def _reap(self, futures):
+        for future in futures:
+            job = self._running.pop(future)
+            try:
+                result = future.result()
+                self.queue.complete(job["id"], result)
+                print(f"Prewarm: {job['year']} {job['race_name']} -> {result}")
+            except Exception as e:
+                self.queue.fail(job["id"], e)
+                print(f"Prewarm: {job['year']} {job['race_name']} failed (attempt {job['attempts']}): {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._last_seed is None or time.time() - self._last_seed >= self.reseed_seconds:
+                    self.seed()
+                self.run_once()
+                if self._running:
+                    done, _ = wait(list(self._running), timeout=self.poll_seconds, return_when=FIRST_COMPLETED)
+                    self._reap(done)
+                else:
+                    self._stop.wait(self.poll_seconds)
+            except Exception as e:
+                print(f"Prewarm dispatcher error: {e}")
+                self._stop.wait(self.poll_seconds)
+
+    def status(self):
+        return {
+            "enabled": True,
+            "seasons": self.seasons,
+            "max_concurrency": self.max_concurrency,
+            "running": [
+                {"year": job["year"], "race_name": job["race_name"], "attempt": job["attempts"]}
+                for job in self._running.values()
+            ],
+            "counts": self.queue.counts(),
+            "last_seed_at": self._last_seed,
+            "seed_errors": self.seed_errors,
+            "recent": self.queue.recent(),
+        }
@@ -0,0 +1,844 @@
+"""
+Columnar replay engine for telemetry_replay.
+
+All drivers are stacked into one float32 array laid out as
+(time grid x driver x channel). Continuous channels are interpolated with
+np.interp, discrete channels are forward-filled with np.searchsorted and the
+shift to a zero-based timeline is a single subtraction on the time vector.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+import delta_codec
+from metrics import record, timed
+from standings import StandingsTable, build_standings
+from timeline import Timeline, build_timeline
+
+# Bump whenever the processed replay changes shape or content (invalidates the replay cache)
+PIPELINE_VERSION = 6
+
+# Interpolated linearly between samples
+CONTINUOUS_CHANNELS = ('X', 'Y', 'Speed', 'Distance', 'Throttle', 'Brake', 'RPM')
+# Forward-filled (value of the last sample at or before the grid time)
+DISCRETE_CHANNELS = ('nGear', 'DRS')
+# Forward-filled from the lap table (LapStartTime), Compound is dictionary-encoded
+LAP_CHANNELS = ('LapNumber', 'Compound')
+
+CHANNELS = CONTINUOUS_CHANNELS + DISCRETE_CHANNELS + LAP_CHANNELS
+
+# Key order of the legacy per-sample records
+RECORD_COLUMNS = ('Time', 'X', 'Y', 'Speed', 'Compound', 'LapNumber', 'Distance', 'Throttle', 'Brake', 'nGear', 'RPM', 'DRS')
+
+# Decimals kept when channels are rendered to JSON (float32 storage otherwise leaks noise digits)
+RECORD_DECIMALS = 3
+
+# Fixed-point step of each channel when delta coded (the delta wire format and
+# REPLAY_CACHE_ENCODING=delta); matches the precision of the columnar JSON
+CHANNEL_SCALES = {
+    'X': 0.1, 'Y': 0.1, 'Speed': 0.1, 'Distance': 0.1, 'Throttle': 0.1, 'Brake': 0.01, 'RPM': 1.0,
+    'nGear': 1.0, 'DRS': 1.0, 'LapNumber': 1.0, 'Compound': 1.0,
+}
+TIME_SCALE = 0.001
+
+# How ReplayGrid.save stores the grid: 'raw' (float32 npz) or 'delta' (delta_codec, values
+# within CHANNEL_SCALES / 2). Read from the environment so build workers pick it up too.
+CACHE_ENCODING = os.environ.get('REPLAY_CACHE_ENCODING', 'raw')
+
+
+def _time_seconds(values):
+    """Session time column (Timedelta or anything pandas can parse) -> float64 seconds."""
+    import pandas as pd
+
+    if pd.api.types.is_timedelta64_dtype(values):
+        return values.dt.total_seconds().to_numpy(dtype=np.float64)
+    return pd.to_timedelta(values).dt.total_seconds().to_numpy(dtype=np.float64)
+
+
+def _sorted_by_time(times, frame):
+    if len(times) > 1 and np.any(np.diff(times) < 0):
+        order = np.argsort(times, kind='stable')
+        return times[order], frame.iloc[order]
+    return times, frame
+
+
+def _numeric(frame, column):
+    import pandas as pd
+
+    return pd.to_numeric(frame[column], errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _interp(grid, src_t, src_v):
+    ok = ~np.isnan(src_v)
+    if not ok.any():
+        return None
+    # np.interp clamps to the edge values, matching interpolate(limit_direction='both')
+    return np.interp(grid, src_t[ok], src_v[ok])
+
+
+def _ffill(grid, src_t, src_v):
+    idx = np.searchsorted(src_t, grid, side='right') - 1
+    out = np.full(grid.shape, np.nan)
+    has = idx >= 0
+    out[has] = src_v[idx[has]]
+    return out
+
+
+def _driver_laps(session, driver):
+    laps = getattr(session, 'laps', None)
+    if laps is None or laps.empty:
+        return None
+    if 'DriverNumber' in laps.columns:
+        return laps[laps['DriverNumber'].astype(str) == str(driver)]
+    return laps.pick_driver(driver)
+
+
+def _driver_sources(session, driver, driver_laps):
+    """Return (pos, car) frames for a driver, preferring full-session telemetry."""
+    pos_dict = getattr(session, 'pos_data', None)
+    car_dict = getattr(session, 'car_data', None)
+    if isinstance(pos_dict, dict) and isinstance(car_dict, dict) and driver in pos_dict and driver in car_dict:
+        pos, car = pos_dict[driver], car_dict[driver]
+        if pos is not None and car is not None and not pos.empty and 'Time' in pos.columns and 'Time' in car.columns:
+            return pos, car
+
+    # Fallback to lap-based telemetry if full-session data isn't available
+    tel = driver_laps.get_telemetry()
+    return tel, tel
+
+
+class ReplayGrid:
+    """
+    Processed telemetry for every driver on one shared time grid.
+
+    data[t, d, c] holds channel CHANNELS[c] of drivers[d] at time[t] (NaN = no value).
+    spans[d] is the [start, end) grid slice where drivers[d] has position data.
+    time is zero-based; t0 is the session time (seconds) of time[0].
+
+    samples, when set (see simplify.py), holds per-driver grid indices to emit
+    instead of the full span, so each driver gets its own irregular time vector.
+    """
+
+    def __init__(self, time, t0, drivers, data, spans, compounds, present, samples=None):
+        self.time = time
+        self.t0 = float(t0)
+        self.drivers = list(drivers)
+        self.data = data
+        self.spans = spans
+        self.compounds = list(compounds)
+        self.present = present
+        self.samples = samples
+
+    @property
+    def channels(self):
+        return CHANNELS
+
+    def channel_index(self, name):
+        return CHANNELS.index(name)
+
+    @property
+    def duration(self):
+        return float(self.time[-1]) if len(self.time) else 0.0
+
+    def window(self, start, end):
+        """Grid restricted to start <= time < end (zero-based seconds); time values are kept as-is."""
+        i0 = int(np.searchsorted(self.time, start, side='left'))
+        i1 = max(i0, int(np.searchsorted(self.time, end, side='left')))
+        spans = np.clip(self.spans - i0, 0, i1 - i0)
+        samples = None
+        if self.samples is not None:
+            samples = [idx[(idx >= i0) & (idx < i1)] - i0 for idx in self.samples]
+        return ReplayGrid(self.time[i0:i1], self.t0, self.drivers, self.data[i0:i1], spans, self.compounds, self.present, samples)
+
+    def with_samples(self, samples):
+        return ReplayGrid(self.time, self.t0, self.drivers, self.data, self.spans, self.compounds, self.present, samples)
+
+    def driver_indices(self, d):
+        """Grid indices emitted for driver d (slice over the span, or the simplified samples)."""
+        if self.samples is not None:
+            return self.samples[d]
+        return slice(int(self.spans[d, 0]), max(int(self.spans[d, 0]), int(self.spans[d, 1])))
+
+    def driver_records(self, d):
+        """Legacy per-sample dicts for one driver (NaN -> None, Compound decoded)."""
+        idx = self.driver_indices(d)
+        time = self.time[idx]
+        if len(time) == 0:
+            return []
+        block = np.round(self.data[idx, d, :].astype(np.float64), RECORD_DECIMALS)
+
+        columns = {'Time': np.round(time, RECORD_DECIMALS).tolist()}
+        for name in RECORD_COLUMNS[1:]:
+            c = CHANNELS.index(name)
+            if not self.present[c]:
+                continue
+            values = block[:, c]
+            if name == 'Compound':
+                lookup = self.compounds
+                columns[name] = [None if v != v else lookup[int(v)] for v in values.tolist()]
+            elif np.isnan(values).any():
+                columns[name] = [None if v != v else v for v in values.tolist()]
+            else:
+                columns[name] = values.tolist()
+
+        names = list(columns.keys()) + ['Driver']
+        driver = self.drivers[d]
+        rows = zip(*columns.values())
+        return [dict(zip(names, row + (driver,))) for row in rows]
+
+    def to_records(self):
+        records = []
+        for d in range(len(self.drivers)):
+            records.extend(self.driver_records(d))
+        return records
+
+    def save(self, entry_dir, encoding=None):
+        encoding = encoding or CACHE_ENCODING
+        if encoding == 'delta':
+            self._save_delta(entry_dir)
+        else:
+            encoding = 'raw'
+            np.savez(
+                os.path.join(entry_dir, 'grid.npz'),
+                time=self.time,
+                data=self.data,
+                spans=self.spans,
+                present=self.present,
+            )
+        with open(os.path.join(entry_dir, 'grid.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                't0': self.t0,
+                'drivers': self.drivers,
+                'compounds': self.compounds,
+                'channels': list(CHANNELS),
+                'encoding': encoding,
+            }, f)
+
+    def _save_delta(self, entry_dir):
+        # Only each driver's span is stored; the rest of the grid is NaN anyway
+        body = delta_codec.Body()
+        drivers = []
+        for d in range(len(self.drivers)):
+            start, end = int(self.spans[d, 0]), int(self.spans[d, 1])
+            drivers.append({
+                name: delta_codec.encode_channel(self.data[start:end, d, c], CHANNEL_SCALES[name], body)
+                for c, name in enumerate(CHANNELS)
+                if self.present[c]
+            })
+        header = {
+            'time': delta_codec.encode_channel(self.time, TIME_SCALE, body),
+            'spans': self.spans.tolist(),
+            'present': self.present.tolist(),
+            'drivers': drivers,
+        }
+        with open(os.path.join(entry_dir, 'grid.dlt'), 'wb') as f:
+            f.write(delta_codec.pack(header, body))
+
+    @classmethod
+    def _load_delta(cls, entry_dir, meta):
+        with open(os.path.join(entry_dir, 'grid.dlt'), 'rb') as f:
+            header, body = delta_codec.unpack(f.read())
+        time = delta_codec.decode_channel(header['time'], body)
+        spans = np.array(header['spans'], dtype=np.int64).reshape(-1, 2)
+        data = np.full((len(time), len(meta['drivers']), len(CHANNELS)), np.nan, dtype=np.float32)
+        for d, channels in enumerate(header['drivers']):
+            start, end = spans[d]
+            for name, entry in channels.items():
+                data[start:end, d, CHANNELS.index(name)] = delta_codec.decode_channel(entry, body)
+        present = np.array(header['present'], dtype=bool)
+        return cls(time, meta['t0'], meta['drivers'], data, spans, meta['compounds'], present)
+
+    @classmethod
+    def load(cls, entry_dir):
+        with open(os.path.join(entry_dir, 'grid.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if tuple(meta['channels']) != CHANNELS:
+            raise ValueError("channel layout mismatch")
+        if meta.get('encoding') == 'delta':
+            return cls._load_delta(entry_dir, meta)
+        with np.load(os.path.join(entry_dir, 'grid.npz')) as arrays:
+            return cls(
+                arrays['time'], meta['t0'], meta['drivers'], arrays['data'],
+                arrays['spans'], meta['compounds'], arrays['present'],
+            )
+
+
+def _driver_arrays(driver_laps, pos_t, pos, car_t, car, compound_codes, compounds):
+    """
+    Numeric source arrays for one driver (float64, keyed by channel name plus the
+    'pos_t'/'car_t'/'lap_t' time vectors). This is all the fill step needs, so it
+    can be handed to another process without the DataFrames.
+    """
+    arrays = {'pos_t': pos_t, 'car_t': car_t}
+    for name in CONTINUOUS_CHANNELS + DISCRETE_CHANNELS:
+        src = pos if name in ('X', 'Y') else car
+        if name in src.columns:
+            arrays[name] = _numeric(src, name)
+
+    # LapNumber/Compound: last LapStartTime <= t. Leading samples stay NaN until the
+    # real Lap 1 start so the formation/grid delay isn't counted as part of Lap 1.
+    if 'LapStartTime' in driver_laps.columns:
+        laps = driver_laps.dropna(subset=['LapStartTime'])
+        lap_t, laps = _sorted_by_time(_time_seconds(laps['LapStartTime']), laps)
+        if len(lap_t):
+            arrays['lap_t'] = lap_t
+            if 'LapNumber' in laps.columns:
+                arrays['LapNumber'] = _numeric(laps, 'LapNumber')
+            if 'Compound' in laps.columns:
+                # Codes are assigned here, in driver order, so the dictionary is deterministic
+                codes = np.full(len(laps), np.nan)
+                for i, value in enumerate(laps['Compound'].tolist()):
+                    if isinstance(value, str) and value:
+                        if value not in compound_codes:
+                            compound_codes[value] = len(compounds)
+                            compounds.append(value)
+                        codes[i] = compound_codes[value]
+                arrays['Compound'] = codes
+    return arrays
+
+
+def _channels_present(arrays):
+    present = np.zeros(len(CHANNELS), dtype=bool)
+    for c, name in enumerate(CHANNELS):
+        if name not in arrays:
+            continue
+        # Continuous channels need at least one value to interpolate from
+        present[c] = name not in CONTINUOUS_CHANNELS or not np.isnan(arrays[name]).all()
+    return present
+
+
+def _fill_driver(out, t, arrays):
+    """Fill out[len(t), len(CHANNELS)] for one driver from its source arrays."""
+    for c, name in enumerate(CHANNELS):
+        if name not in arrays:
+            continue
+        if name in CONTINUOUS_CHANNELS:
+            src_t = arrays['pos_t'] if name in ('X', 'Y') else arrays['car_t']
+            values = _interp(t, src_t, arrays[name])
+            if values is not None:
+                out[:, c] = values
+        elif name in DISCRETE_CHANNELS:
+            out[:, c] = _ffill(t, arrays['car_t'], arrays[name])
+        else:
+            out[:, c] = _ffill(t, arrays['lap_t'], arrays[name])
+
+
+def _fill_driver_shared(task):
+    """Pool entry point: attach to the shared input/output blocks and fill one driver's slice. Returns (d, seconds)."""
+    from multiprocessing import shared_memory
+
+    started = time.perf_counter()
+    data_name, data_shape, inputs_name, layout, d, start, end, g0, step = task
+    data_shm = shared_memory.SharedMemory(name=data_name)
+    inputs_shm = shared_memory.SharedMemory(name=inputs_name)
+    try:
+        data = np.ndarray(data_shape, dtype=np.float32, buffer=data_shm.buf)
+        inputs = np.ndarray((inputs_shm.size // 8,), dtype=np.float64, buffer=inputs_shm.buf)
+        arrays = {name: inputs[offset:offset + length] for name, (offset, length) in layout.items()}
+        # Same expression as the parent's grid, so the values are bit-identical
+        t = (g0 + np.arange(data_shape[0], dtype=np.float64) * step)[start:end]
+        _fill_driver(data[start:end, d, :], t, arrays)
+        del data, inputs, arrays
+    finally:
+        data_shm.close()
+        inputs_shm.close()
+    return d, time.perf_counter() - started
+
+
+_driver_pool = None
+
+
+def _get_driver_pool(workers):
+    global _driver_pool
+    if _driver_pool is None or _driver_pool._max_workers != workers:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        from multiprocessing import util
+
+        if _driver_pool is not None:
+            _driver_pool.shutdown(wait=False)
+        # spawn: callers may be multi-threaded (the API process, build workers)
+        _driver_pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        # Inside a pool worker, exit joins all child processes before threading's atexit hooks
+        # would stop this pool. A multiprocessing finalizer shuts it down first; its priority must
+        # beat the pool's own queue finalizers (10), which would otherwise close the queues under it.
+        util.Finalize(_driver_pool, _driver_pool.shutdown, exitpriority=100)
+    return _driver_pool
+
+
+def _fill_parallel(data, grid, g0, step, jobs, workers):
+    """
+    Run _fill_driver for every driver on a process pool. The source arrays are packed
+    into one shared float64 block and the workers write straight into a shared copy of
+    data, so nothing but offsets is pickled.
+    """
+    from multiprocessing import shared_memory
+
+    total = sum(len(a) for _, _, _, arrays in jobs for a in arrays.values())
+    data_shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    inputs_shm = shared_memory.SharedMemory(create=True, size=max(total * 8, 8))
+    try:
+        shared = np.ndarray(data.shape, dtype=np.float32, buffer=data_shm.buf)
+        shared[:] = data
+        inputs = np.ndarray((inputs_shm.size // 8,), dtype=np.float64, buffer=inputs_shm.buf)
+        tasks = []
+        offset = 0
+        for d, start, end, arrays in jobs:
+            layout = {}
+            for name, values in arrays.items():
+                inputs[offset:offset + len(values)] = values
+                layout[name] = (offset, len(values))
+                offset += len(values)
+            tasks.append((data_shm.name, data.shape, inputs_shm.name, layout, d, start, end, g0, step))
+        seconds = dict(_get_driver_pool(workers).map(_fill_driver_shared, tasks))
+        data[:] = shared
+        del shared, inputs
+    finally:
+        data_shm.close()
+        data_shm.unlink()
+        inputs_shm.close()
+        inputs_shm.unlink()
+    return seconds
+
+
+def build_replay_grid(session, resample_rate='1s', workers=1):
+    """
+    workers > 1 fills the drivers on that many processes (see _fill_parallel); the
+    result is identical to the serial build.
+    Stages (merge, resample, normalize) are timed in total and per driver, see metrics.timed.
+    """
+    import pandas as pd
+
+    step = pd.Timedelta(resample_rate).total_seconds()
+
+    # Pass 1: collect per-driver sources and the extent of the shared grid
+    sources = []
+    compounds = []
+    compound_codes = {}
+    merge_started = time.perf_counter()
+    for driver in session.drivers:
+        started = time.perf_counter()
+        try:
+            driver_laps = _driver_laps(session, driver)
+            if driver_laps is None or driver_laps.empty:
+                continue
+            pos, car = _driver_sources(session, driver, driver_laps)
+            pos_t, pos = _sorted_by_time(_time_seconds(pos['Time']), pos)
+            car_t, car = _sorted_by_time(_time_seconds(car['Time']), car)
+            ok = ~np.isnan(pos_t)
+            if not ok.any():
+                continue
+            lo = np.floor(np.nanmin(pos_t) / step) * step
+            hi = np.floor(np.nanmax(pos_t) / step) * step
+            arrays = _driver_arrays(driver_laps, pos_t, pos, car_t, car, compound_codes, compounds)
+            sources.append((driver, arrays, lo, hi))
+        except Exception as e:
+            print(f"Error processing driver {driver}: {e}")
+        record('merge', time.perf_counter() - started, driver)
+    record('merge', time.perf_counter() - merge_started)
+
+    if not sources:
+        empty = np.zeros((0, 0, len(CHANNELS)), dtype=np.float32)
+        return ReplayGrid(np.zeros(0), 0.0, [], empty, np.zeros((0, 2), dtype=np.int64), [], np.zeros(len(CHANNELS), dtype=bool))
+
+    g0 = min(s[2] for s in sources)
+    g1 = max(s[3] for s in sources)
+    n = int(round((g1 - g0) / step)) + 1
+    grid = g0 + np.arange(n, dtype=np.float64) * step
+
+    data = np.full((n, len(sources), len(CHANNELS)), np.nan, dtype=np.float32)
+    spans = np.zeros((len(sources), 2), dtype=np.int64)
+    present = np.zeros(len(CHANNELS), dtype=bool)
+
+    # Pass 2: fill each driver's slice of the grid channel by channel
+    jobs = []
+    for d, (driver, arrays, lo, hi) in enumerate(sources):
+        start = int(round((lo - g0) / step))
+        end = int(round((hi - g0) / step)) + 1
+        spans[d] = (start, end)
+        present |= _channels_present(arrays)
+        jobs.append((d, start, end, arrays))
+
+    with timed('resample'):
+        if workers > 1 and len(jobs) > 1:
+            seconds = _fill_parallel(data, grid, g0, step, jobs, min(workers, len(jobs)))
+        else:
+            seconds = {}
+            for d, start, end, arrays in jobs:
+                started = time.perf_counter()
+                _fill_driver(data[start:end, d, :], grid[start:end], arrays)
+                seconds[d] = time.perf_counter() - started
+    # Per-driver timings go to the build metrics (build.json, prah_build_last_driver_seconds)
+    for d, start, end, arrays in jobs:
+        record('resample', seconds[d], sources[d][0])
+
+    # Normalize to a common timeline starting at zero
+    with timed('normalize'):
+        t0 = float(grid[0])
+        time_axis = grid - t0
+    return ReplayGrid(time_axis, t0, [s[0] for s in sources], data, spans, compounds, present)
+
+
+def _records(frame):
+    # pandas to_json handles NaN -> null and numpy scalar types
+    return json.loads(frame.to_json(orient='records'))
+
+
+def _shift(frame, column, t0):
+    if column in frame.columns and t0:
+        frame[column] = frame[column] - t0
+
+
+def _text(value, default=''):
+    # Missing strings come through as NaN, which isn't valid JSON
+    if value is None or (isinstance(value, float) and value != value):
+        return default
+    return value
+
+
+def _extract_drivers_info(session):
+    import pandas as pd
+
+    drivers_info = {}
+    if not hasattr(session, 'results') or session.results is None:
+        return drivers_info
+    for i, row in session.results.iterrows():
+        driver_number = str(row['DriverNumber'])
+
+        total_time_s = None
+        try:
+            if 'Time' in row and pd.notna(row['Time']):
+                # FastF1 typically stores this as a Timedelta
+                total_time_s = pd.to_timedelta(row['Time']).total_seconds()
+        except Exception:
+            total_time_s = None
+
+        drivers_info[driver_number] = {
+            "DriverNumber": driver_number,
+            "Abbreviation": _text(row['Abbreviation']),
+            "TeamName": _text(row['TeamName']),
+            "TeamColor": f"#{_text(row['TeamColor'])}" if _text(row['TeamColor']) else "#FFFFFF",
+            "FirstName": _text(row['FirstName']),
+            "LastName": _text(row['LastName']),
+            "HeadshotUrl": _text(row.get('HeadshotUrl', '')),
+            "Status": _text(row.get('Status'), 'Finished'),
+            "GridPosition": int(row['GridPosition']) if pd.notna(row.get('GridPosition')) else 20,
+            "ClassifiedPosition": int(row['Position']) if pd.notna(row.get('Position')) else 20,
+            "TotalTime": total_time_s
+        }
+    return drivers_info
+
+
+def _extract_laps(session, t0):
+    """Strategy & pit stop lap table on the zero-based timeline."""
+    if not hasattr(session, 'laps') or session.laps is None:
+        return []
+    laps = session.laps.copy()
+
+    # Align identifiers with telemetry/drivers_info:
+    # telemetry uses driver numbers (session.drivers) and drivers_info is keyed by DriverNumber.
+    # FastF1 laps typically uses driver abbreviations in the 'Driver' column.
+    # Keep abbreviation in a separate field and use DriverNumber for 'Driver'.
+    if 'DriverNumber' in laps.columns and 'Driver' in laps.columns:
+        laps['DriverAbbreviation'] = laps['Driver']
+        laps['Driver'] = laps['DriverNumber'].astype(str)
+
+    # Convert Timedeltas
+    time_cols = ['LapStartTime', 'LapTime', 'Sector1Time', 'Sector2Time', 'Sector3Time', 'PitInTime', 'PitOutTime']
+    for col in time_cols:
+        if col in laps.columns:
+            laps[col] = laps[col].dt.total_seconds()
+
+    # Shift session times (not durations) to the same zero-based timeline
+    for col in ('LapStartTime', 'PitInTime', 'PitOutTime'):
+        _shift(laps, col, t0)
+
+    # Select columns - including sector times for analysis
+    laps_cols = ['Driver', 'DriverAbbreviation', 'LapNumber', 'Stint', 'Compound', 'TyreLife', 'LapTime', 'LapStartTime', 'PitInTime', 'PitOutTime', 'Sector1Time', 'Sector2Time', 'Sector3Time']
+    available_laps_cols = [c for c in laps_cols if c in laps.columns]
+    return _records(laps[available_laps_cols])
+
+
+def _extract_track_status(session, t0):
+    """Track status (Safety Car, etc.)."""
+    if not hasattr(session, 'track_status') or session.track_status is None:
+        return []
+    ts = session.track_status.copy()
+    ts['Time'] = ts['Time'].dt.total_seconds()
+    _shift(ts, 'Time', t0)
+    return _records(ts)
+
+
+def _extract_race_control(session, t0):
+    import pandas as pd
+
+    if not hasattr(session, 'race_control_messages') or session.race_control_messages is None:
+        return []
+    rc = session.race_control_messages
+    if rc.empty:
+        return []
+    rc = rc.copy()
+    if 'Time' in rc.columns:
+        t = rc['Time']
+        if pd.api.types.is_timedelta64_ns_dtype(t):
+            rc['Time'] = t.dt.total_seconds()
+        elif pd.api.types.is_datetime64_any_dtype(t) or (len(t) > 0 and isinstance(t.iloc[0], pd.Timestamp)):
+            # FastF1 often provides absolute timestamps for race control messages.
+            # Convert to seconds since session start so it aligns with telemetry/laps.
+            start_date = None
+            try:
+                # session.date is typically the session start timestamp and tends to align best
+                start_date = getattr(session, 'date', None)
+            except Exception:
+                start_date = None
+
+            if start_date is None:
+                try:
+                    info = getattr(session, 'session_info', None)
+                    if info is not None and hasattr(info, 'get'):
+                        start_date = info.get('StartDate')
+                except Exception:
+                    start_date = None
+
+            try:
+                rc_time = pd.to_datetime(rc['Time'])
+                if start_date is not None:
+                    rc['Time'] = (rc_time - pd.to_datetime(start_date)).dt.total_seconds()
+                else:
+                    # Fallback: epoch seconds
+                    rc['Time'] = rc_time.astype('int64') / 1e9
+            except Exception:
+                pass
+        else:
+            # Last resort: try parsing into timedelta-like values
+            try:
+                rc['Time'] = pd.to_timedelta(rc['Time']).dt.total_seconds()
+            except Exception:
+                pass
+        if pd.api.types.is_numeric_dtype(rc['Time']):
+            _shift(rc, 'Time', t0)
+    return _records(rc)
+
+
+def _extract_circuit_info(session):
+    if not hasattr(session, 'event'):
+        return {}
+
+    # Handle potential missing keys safely
+    def get_event_attr(attr):
+        try:
+            return getattr(session.event, attr, "")
+        except Exception:
+            return ""
+
+    return {
+        "Location": get_event_attr("Location"),
+        "OfficialEventName": get_event_attr("OfficialEventName"),
+        "EventDate": str(get_event_attr("EventDate")),
+        "Country": get_event_attr("Country"),
+        "RoundNumber": str(get_event_attr("RoundNumber"))
+    }
+
+
+def _extract_weather(session, t0):
+    import pandas as pd
+
+    if not hasattr(session, 'weather_data') or session.weather_data is None:
+        return []
+    wd = session.weather_data.copy()
+    if 'Time' in wd.columns:
+        if pd.api.types.is_timedelta64_ns_dtype(wd['Time']):
+            wd['Time'] = wd['Time'].dt.total_seconds()
+        else:
+            # Attempt to force conversion if it's not already timedelta
+            try:
+                wd['Time'] = pd.to_timedelta(wd['Time']).dt.total_seconds()
+            except Exception:
+                # If conversion fails, we might have datetimes or something else.
+                # For now, let's just not crash.
+                pass
+        if pd.api.types.is_numeric_dtype(wd['Time']):
+            _shift(wd, 'Time', t0)
+    return _records(wd)
+
+
+def _extract_team_radio(session, t0):
+    """Team radio messages (Time/Driver/Message) on the zero-based timeline, where the session has them."""
+    radio = getattr(session, 'team_radio', None)
+    if radio is None or radio.empty or 'Time' not in radio.columns:
+        return []
+    radio = radio.copy()
+    try:
+        radio['Time'] = _time_seconds(radio['Time'])
+    except (TypeError, ValueError):
+        return []
+    _shift(radio, 'Time', t0)
+    if 'Driver' in radio.columns:
+        radio['Driver'] = radio['Driver'].astype(str)
+    return _records(radio[[c for c in ('Time', 'Driver', 'Message') if c in radio.columns]])
+
+
+def _total_laps(session):
+    if hasattr(session, 'total_laps') and session.total_laps is not None:
+        return int(session.total_laps)
+    if hasattr(session, 'laps') and session.laps is not None and not session.laps.empty:
+        return int(session.laps['LapNumber'].max())
+    return 0
+
+
+def _stream_stats(session, name):
+    """Row counts per driver and the raw session time range of pos_data/car_data."""
+    frames = getattr(session, name, None)
+    if not isinstance(frames, dict):
+        return None
+    rows, t_min, t_max = {}, None, None
+    for driver in session.drivers:
+        frame = frames.get(driver)
+        if frame is None:
+            continue
+        rows[str(driver)] = int(len(frame))
+        if frame.empty or 'Time' not in frame.columns:
+            continue
+        try:
+            t = _time_seconds(frame['Time'])
+        except Exception:
+            continue
+        if np.isnan(t).all():
+            continue
+        lo, hi = float(np.nanmin(t)), float(np.nanmax(t))
+        t_min = lo if t_min is None else min(t_min, lo)
+        t_max = hi if t_max is None else max(t_max, hi)
+    return {"rows": rows, "time_min": t_min, "time_max": t_max}
+
+
+def build_manifest(session, replay, resample_rate):
+    """Small summary written next to the cached replay; telemetry_replay_meta answers from it."""
+    grid, sections = replay.grid, replay.sections
+    streams = {name: _stream_stats(session, name) for name in ('pos_data', 'car_data')}
+    bounds = [s for s in streams.values() if s is not None and s["time_min"] is not None]
+    return {
+        "pipeline_version": PIPELINE_VERSION,
+        "resample_rate": resample_rate,
+        "drivers": list(session.drivers),
+        "replay_drivers": list(grid.drivers),
+        "total_laps": sections["total_laps"],
+        # Raw session time (seconds), as reported by the original meta endpoint
+        "time_min_seconds": min(s["time_min"] for s in bounds) if bounds else None,
+        "time_max_seconds": max(s["time_max"] for s in bounds) if bounds else None,
+        "time_base": grid.t0,
+        "duration": grid.duration,
+        "ticks": int(len(grid.time)),
+        "pos_rows": streams["pos_data"]["rows"] if streams["pos_data"] else None,
+        "car_rows": streams["car_data"]["rows"] if streams["car_data"] else None,
+        "rows": {name: len(sections[name]) for name in ('laps', 'events', 'race_control', 'weather')},
+    }
+
+
+class ProcessedReplay:
+    """A built race replay: the telemetry grid, the per-race side tables and the running order."""
+
+    def __init__(self, grid, sections, standings=None, manifest=None, timeline=None):
+        self.grid = grid
+        self.sections = sections
+        self.standings = standings
+        self.manifest = manifest
+        self.timeline = timeline
+        # Memoized derived views (e.g. simplified grids); not persisted
+        self.derived = {}
+
+    def window(self, start, end):
+        standings = self.standings.window(start, end) if self.standings is not None else None
+        return ProcessedReplay(self.grid.window(start, end), self.sections, standings, self.manifest, self.timeline)
+
+    def to_payload(self, include_sections=True):
+        """The telemetry_replay response in its original (record-oriented) shape."""
+        if not include_sections:
+            return {"telemetry": self.grid.to_records(), "time_base": self.grid.t0}
+        return {
+            "telemetry": self.grid.to_records(),
+            "drivers": self.sections["drivers"],
+            "laps": self.sections["laps"],  # includes sector times and pit times
+            "events": self.sections["events"],
+            "race_control": self.sections["race_control"],
+            "circuit_info": self.sections["circuit_info"],
+            "weather": self.sections["weather"],
+            "total_laps": self.sections["total_laps"],
+            "time_base": self.grid.t0
+        }
+
+
+def extract_sections(session, t0):
+    """Per-race side tables of the replay, on the zero-based timeline starting at session time t0."""
+    return {
+        "drivers": _extract_drivers_info(session),
+        "laps": _extract_laps(session, t0),
+        "events": _extract_track_status(session, t0),
+        "race_control": _extract_race_control(session, t0),
+        "circuit_info": _extract_circuit_info(session),
+        "weather": _extract_weather(session, t0),
+        "total_laps": _total_laps(session),
+    }
+
+
+def build_processed_replay(session, resample_rate='1s', workers=1):
+    # Counts (drivers, ticks, events, race control messages) go to the manifest, not stdout
+    grid = build_replay_grid(session, resample_rate, workers)
+
+    with timed('sections'):
+        sections = extract_sections(session, grid.t0)
+    with timed('standings'):
+        replay = ProcessedReplay(grid, sections, build_standings(grid, sections))
+    with timed('timeline'):
+        replay.timeline = build_timeline(sections, grid.duration, _extract_team_radio(session, grid.t0))
+    with timed('manifest'):
+        replay.manifest = build_manifest(session, replay, resample_rate)
+    return replay
+
+
+def save_processed_replay(replay, entry_dir, encoding=None):
+    # Standings and timeline are part of every entry: load_processed_replay requires both
+    if replay.standings is None or replay.timeline is None:
+        raise ValueError("A processed replay needs its standings and timeline to be cached")
+    replay.grid.save(entry_dir, encoding)
+    replay.standings.save(entry_dir)
+    replay.timeline.save(entry_dir)
+    with open(os.path.join(entry_dir, 'sections.json'), 'w', encoding='utf-8') as f:
+        json.dump(replay.sections, f, separators=(',', ':'))
+    if replay.manifest is not None:
+        with open(os.path.join(entry_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(replay.manifest, f)
+
+
+def read_manifest(entry_dir):
+    """The manifest of a cached replay without loading its arrays, or None (older entries have none)."""
+    try:
+        with open(os.path.join(entry_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_build_timings(entry_dir, timings):
+    """Store how a replay was built (metrics.Timings.to_dict()) next to it, as build.json."""
+    tmp = os.path.join(entry_dir, '.build.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(timings, f)
+    os.replace(tmp, os.path.join(entry_dir, 'build.json'))
+
+
+def read_build_timings(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, 'build.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_processed_replay(entry_dir):
+    grid = ReplayGrid.load(entry_dir)
+    with open(os.path.join(entry_dir, 'sections.json'), 'r', encoding='utf-8') as f:
+        sections = json.load(f)
+    return ProcessedReplay(grid, sections, StandingsTable.load(entry_dir), read_manifest(entry_dir), Timeline.load(entry_dir))
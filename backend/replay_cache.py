@@ -0,0 +1,170 @@
+"""
+Processed replay cache.
+
+Sits in front of the FastF1 raw cache and keeps the fully processed
+telemetry_replay output so that a race is only built once:
+
+- memory tier: bounded LRU of recently served replays
+- disk tier: one directory per cache key, shared by every worker process
+- single-flight: concurrent requests for the same cold key wait for one build
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+
+def make_cache_key(year, race_name, session_type, resample_rate, pipeline_version):
+    """Content-address a processed replay by everything that changes its output."""
+    params = {
+        "year": int(year),
+        "race_name": str(race_name).strip().lower(),
+        "session_type": str(session_type).upper(),
+        "resample_rate": str(resample_rate),
+        "pipeline_version": pipeline_version,
+    }
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    return digest[:32], params
+
+
+def _dump_json(value, entry_dir):
+    with open(os.path.join(entry_dir, "payload.json"), "w", encoding="utf-8") as f:
+        json.dump(value, f, separators=(",", ":"))
+
+
+def _load_json(entry_dir):
+    with open(os.path.join(entry_dir, "payload.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ReplayCache:
+    def __init__(self, root, max_memory_items=4, dump=_dump_json, load=_load_json):
+        self.root = root
+        self.max_memory_items = max(0, int(max_memory_items))
+        self._dump = dump
+        self._load = load
+        self._memory = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "builds": 0, "waits": 0}
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def on_disk(self, key):
+        return os.path.isfile(os.path.join(self.entry_dir(key), "key.json"))
+
+    def keys(self):
+        """Keys of the complete entries on disk."""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return [name for name in names if not name.startswith(".") and self.on_disk(name)]
+
+    def _remember(self, key, value):
+        if self.max_memory_items == 0:
+            return
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Cached value for key (memory first, then disk), or None; every None counts as a miss."""
+        value = self._lookup(key)
+        if value is None:
+            with self._lock:
+                self.stats["misses"] += 1
+        return value
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+        if not self.on_disk(key):
+            return None
+        try:
+            value = self._load(self.entry_dir(key))
+        except Exception as e:
+            # A half-written or stale entry is treated as a miss and rebuilt
+            print(f"Replay cache: failed to load {key} from disk: {e}")
+            return None
+        with self._lock:
+            self.stats["disk_hits"] += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value, params=None):
+        # Write into a private temp dir, then rename into place so readers in other
+        # processes never observe a partially written entry.
+        tmp_dir = os.path.join(self.root, f".tmp-{key}-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            self._dump(value, tmp_dir)
+            # key.json is written last and marks the entry as complete
+            with open(os.path.join(tmp_dir, "key.json"), "w", encoding="utf-8") as f:
+                json.dump({"key": key, "params": params or {}}, f)
+            try:
+                os.replace(tmp_dir, self.entry_dir(key))
+            except OSError:
+                # Another process published the same key first; theirs is equivalent
+                if not self.on_disk(key):
+                    raise
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._remember(key, value)
+
+    def get_or_build(self, key, build, params=None):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.stats["waits"] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            # A previous leader may have finished between our miss and taking the flight
+            value = self._lookup(key)
+            if value is None:
+                with self._lock:
+                    self.stats["builds"] += 1
+                value = build()
+                self.put(key, value, params=params)
+            flight.value = value
+            return value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
@@ -0,0 +1,363 @@
+"""
+Wire formats for the telemetry_replay response.
+
+- records (default): the original shape, "telemetry" is a flat list of per-sample dicts
+- columnar: "telemetry" is struct-of-arrays, one shared time vector plus per-driver
+  channel arrays (Compound dictionary-encoded); every other key is unchanged
+- binary: the columnar layout as a single little-endian buffer
+- delta: the columnar layout with every channel quantized and delta / run-length
+  coded (delta_codec.py), for bandwidth-constrained clients
+
+Binary layout (all integers little-endian):
+
+    bytes 0..7     magic b"PRAHRPL1"
+    bytes 8..11    uint32 header length H
+    bytes 12..     UTF-8 JSON header, space-padded so the body starts 8-byte aligned
+    body           raw arrays, each starting on an 8-byte boundary
+
+The header holds every non-telemetry key of the records response, plus
+"telemetry" describing the arrays: {"time": ref, "compounds": [...],
+"channels": {name: dtype}, "drivers": {number: {"offset": i, "length": n,
+<channel>: ref}}} where ref = {"offset": byte offset into the body,
+"length": element count, "dtype": "<f8" | "<f4" | "<i2"}. Missing values
+are NaN for float channels and -1 for int16 channels. A driver's samples
+line up with time[offset:offset + length]. For simplified (tolerance) replays
+"time" is null and every driver entry has its own "time" ref instead.
+
+The delta format uses the same container with magic b"PRAHDLT1" (see
+delta_codec.py). Its "telemetry" header has the shape above, but "channels" maps
+each name to its fixed-point scale, and "time" and each driver channel are
+delta_codec channel descriptors instead of array refs. Decoded values are within
+scale / 2 of the replay's values (time: 0.5 ms); missing samples decode as NaN.
+"""
+import json
+import struct
+
+import numpy as np
+
+import delta_codec
+from replay_builder import CHANNEL_SCALES, CHANNELS, TIME_SCALE
+
+FORMATS = ('records', 'columnar', 'binary', 'delta')
+
+COLUMNAR_MEDIA_TYPE = 'application/vnd.prah.replay.columnar+json'
+BINARY_MEDIA_TYPE = 'application/vnd.prah.replay'
+DELTA_MEDIA_TYPE = 'application/vnd.prah.replay.delta'
+BINARY_MAGIC = b'PRAHRPL1'
+
+# Wire dtype per channel. int16 channels use -1 for "no value".
+CHANNEL_DTYPES = {
+    'X': '<f4',
+    'Y': '<f4',
+    'Speed': '<f4',
+    'Distance': '<f4',
+    'Throttle': '<f4',
+    'Brake': '<f4',
+    'RPM': '<f4',
+    'nGear': '<i2',
+    'DRS': '<i2',
+    'LapNumber': '<i2',
+    'Compound': '<i2',
+}
+
+# Decimals kept for float channels in columnar JSON (0 -> emitted as ints)
+JSON_DECIMALS = {
+    'X': 1,
+    'Y': 1,
+    'Speed': 1,
+    'Distance': 1,
+    'Throttle': 1,
+    'Brake': 2,
+    'RPM': 0,
+}
+
+
+def negotiate_format(format_param=None, accept=None):
+    """Pick a wire format from ?format= (wins) or the Accept header; records by default."""
+    if format_param:
+        fmt = format_param.strip().lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{format_param}', expected one of {', '.join(FORMATS)}")
+        return fmt
+    accept = (accept or '').lower()
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return 'columnar'
+    if DELTA_MEDIA_TYPE in accept:
+        return 'delta'
+    if BINARY_MEDIA_TYPE in accept or 'application/octet-stream' in accept:
+        return 'binary'
+    return 'records'
+
+
+def _present_channels(grid):
+    return [name for c, name in enumerate(CHANNELS) if grid.present[c]]
+
+
+def channel_array(grid, d, name):
+    """One driver's emitted samples of a channel, converted to the wire dtype."""
+    values = grid.data[grid.driver_indices(d), d, CHANNELS.index(name)]
+    dtype = CHANNEL_DTYPES[name]
+    if dtype == '<i2':
+        out = np.full(values.shape, -1, dtype=dtype)
+        ok = ~np.isnan(values)
+        out[ok] = values[ok]
+        return out
+    return values.astype(dtype)
+
+
+def _json_channel(grid, d, name):
+    values = channel_array(grid, d, name)
+    if values.dtype.kind == 'i':
+        return values.tolist()
+    decimals = JSON_DECIMALS.get(name, 3)
+    rounded = np.round(values.astype(np.float64), decimals)
+    missing = np.isnan(rounded)
+    if decimals == 0:
+        out = np.where(missing, 0, rounded).astype(np.int64).tolist()
+    else:
+        out = rounded.tolist()
+    if missing.any():
+        for i in np.flatnonzero(missing).tolist():
+            out[i] = None
+    return out
+
+
+def _sections(replay, include_sections):
+    payload = dict(replay.sections) if include_sections else {}
+    payload['time_base'] = replay.grid.t0
+    return payload
+
+
+def _driver_entry(grid, d):
+    # Regular grid: the driver's samples are time[offset:offset + length].
+    # Simplified grid: samples are irregular and carry their own time vector.
+    if grid.samples is None:
+        start, end = int(grid.spans[d, 0]), int(grid.spans[d, 1])
+        return {'offset': start, 'length': max(0, end - start)}, None
+    idx = grid.samples[d]
+    return {'length': int(len(idx))}, grid.time[idx]
+
+
+def _columnar_driver(grid, d, names):
+    entry, own_time = _driver_entry(grid, d)
+    if own_time is not None:
+        entry['time'] = np.round(own_time, 3).tolist()
+    for name in names:
+        entry[name] = _json_channel(grid, d, name)
+    return entry
+
+
+def _columnar_head(grid, names):
+    return {
+        'time': np.round(grid.time, 3).tolist() if grid.samples is None else None,
+        'compounds': grid.compounds,
+        'channels': {name: CHANNEL_DTYPES[name] for name in names},
+    }
+
+
+def columnar_telemetry(grid):
+    names = _present_channels(grid)
+    telemetry = _columnar_head(grid, names)
+    telemetry['drivers'] = {driver: _columnar_driver(grid, d, names) for d, driver in enumerate(grid.drivers)}
+    return telemetry
+
+
+def columnar_payload(replay, include_sections=True):
+    payload = _sections(replay, include_sections)
+    payload['telemetry'] = columnar_telemetry(replay.grid)
+    payload['telemetry_format'] = 'columnar'
+    return payload
+
+
+_RECORD_SECTIONS = ('drivers', 'laps', 'events', 'race_control', 'circuit_info', 'weather', 'total_laps')
+
+
+def _dumps(value):
+    # Same options as starlette's JSONResponse, so streamed and buffered bodies are byte-identical
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')).encode('utf-8')
+
+
+def _iter_records_telemetry(grid):
+    yield b'['
+    first = True
+    for d in range(len(grid.drivers)):
+        records = grid.driver_records(d)
+        if not records:
+            continue
+        # A driver's records as list items, without the surrounding brackets
+        yield (b'' if first else b',') + _dumps(records)[1:-1]
+        first = False
+    yield b']'
+
+
+def _iter_columnar_telemetry(grid):
+    names = _present_channels(grid)
+    yield _dumps(_columnar_head(grid, names))[:-1] + b',"drivers":{'
+    for d, driver in enumerate(grid.drivers):
+        yield (b',' if d else b'') + _dumps(driver) + b':' + _dumps(_columnar_driver(grid, d, names))
+    yield b'}}'
+
+
+def iter_json_payload(replay, wire_format='records', include_sections=True, extra=None):
+    """
+    The records/columnar response body as a stream of byte chunks, one driver at a
+    time, so neither the payload nor its Python objects are ever held in full.
+    Byte-identical to JSONResponse(to_payload()/columnar_payload() + extra).
+    """
+    if wire_format == 'columnar':
+        head = _sections(replay, include_sections)
+        head['telemetry'] = None
+        head['telemetry_format'] = 'columnar'
+        telemetry = _iter_columnar_telemetry(replay.grid)
+    elif wire_format == 'records':
+        if include_sections:
+            # Key order of ProcessedReplay.to_payload
+            head = {'telemetry': None}
+            head.update((key, replay.sections[key]) for key in _RECORD_SECTIONS)
+            head['time_base'] = replay.grid.t0
+        else:
+            head = {'telemetry': None, 'time_base': replay.grid.t0}
+        telemetry = _iter_records_telemetry(replay.grid)
+    else:
+        raise ValueError(f"No streamed JSON for format '{wire_format}'")
+    head.update(extra or {})
+
+    yield b'{'
+    for i, (key, value) in enumerate(head.items()):
+        yield (b',' if i else b'') + _dumps(key) + b':'
+        if key == 'telemetry':
+            yield from telemetry
+        else:
+            yield _dumps(value)
+    yield b'}'
+
+
+def binary_payload(replay, include_sections=True, extra=None):
+    grid = replay.grid
+    names = _present_channels(grid)
+    body = bytearray()
+
+    def append(array):
+        pad = (-len(body)) % 8
+        body.extend(b'\x00' * pad)
+        ref = {'offset': len(body), 'length': int(array.size), 'dtype': array.dtype.str}
+        body.extend(array.tobytes())
+        return ref
+
+    telemetry = {
+        'time': append(np.ascontiguousarray(grid.time, dtype='<f8')) if grid.samples is None else None,
+        'compounds': grid.compounds,
+        'channels': {name: CHANNEL_DTYPES[name] for name in names},
+        'drivers': {},
+    }
+    for d, driver in enumerate(grid.drivers):
+        entry, own_time = _driver_entry(grid, d)
+        if own_time is not None:
+            entry['time'] = append(np.ascontiguousarray(own_time, dtype='<f8'))
+        for name in names:
+            entry[name] = append(channel_array(grid, d, name))
+        telemetry['drivers'][driver] = entry
+
+    header = _sections(replay, include_sections)
+    header.update(extra or {})
+    header['telemetry'] = telemetry
+    header['telemetry_format'] = 'binary'
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Pad so the body starts 8-byte aligned (magic + length prefix = 12 bytes)
+    header_bytes += b' ' * ((-(12 + len(header_bytes))) % 8)
+    return BINARY_MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes + bytes(body)
+
+
+def decode_binary(buffer):
+    """
+    Reference decoder: returns (header, {driver: {channel: ndarray}}, time).
+    time is None for simplified replays; each driver then has its own 'time' array.
+    """
+    if buffer[:8] != BINARY_MAGIC:
+        raise ValueError("not a PRAH replay buffer")
+    (header_len,) = struct.unpack_from('<I', buffer, 8)
+    header = json.loads(bytes(buffer[12:12 + header_len]).decode('utf-8'))
+    body = memoryview(buffer)[12 + header_len:]
+
+    def view(ref):
+        return np.frombuffer(body, dtype=ref['dtype'], count=ref['length'], offset=ref['offset'])
+
+    telemetry = header['telemetry']
+    channels = {}
+    for driver, entry in telemetry['drivers'].items():
+        channels[driver] = {name: view(entry[name]) for name in telemetry['channels']}
+        if 'time' in entry:
+            channels[driver]['time'] = view(entry['time'])
+    time = view(telemetry['time']) if telemetry['time'] is not None else None
+    return header, channels, time
+
+
+def delta_payload(replay, include_sections=True, extra=None):
+    grid = replay.grid
+    names = _present_channels(grid)
+    body = delta_codec.Body()
+    telemetry = {
+        'time': delta_codec.encode_channel(grid.time, TIME_SCALE, body) if grid.samples is None else None,
+        'compounds': grid.compounds,
+        'channels': {name: CHANNEL_SCALES[name] for name in names},
+        'drivers': {},
+    }
+    for d, driver in enumerate(grid.drivers):
+        entry, own_time = _driver_entry(grid, d)
+        if own_time is not None:
+            entry['time'] = delta_codec.encode_channel(own_time, TIME_SCALE, body)
+        idx = grid.driver_indices(d)
+        for name in names:
+            entry[name] = delta_codec.encode_channel(grid.data[idx, d, CHANNELS.index(name)], CHANNEL_SCALES[name], body)
+        telemetry['drivers'][driver] = entry
+
+    header = _sections(replay, include_sections)
+    header.update(extra or {})
+    header['telemetry'] = telemetry
+    header['telemetry_format'] = 'delta'
+    return delta_codec.pack(header, body)
+
+
+def decode_delta(buffer):
+    """
+    Reference decoder: returns (header, {driver: {channel: float64 ndarray}}, time), like
+    decode_binary but with NaN for missing values in every channel.
+    """
+    header, body = delta_codec.unpack(buffer)
+    telemetry = header['telemetry']
+    channels = {}
+    for driver, entry in telemetry['drivers'].items():
+        channels[driver] = {name: delta_codec.decode_channel(entry[name], body) for name in telemetry['channels']}
+        if 'time' in entry:
+            channels[driver]['time'] = delta_codec.decode_channel(entry['time'], body)
+    time = delta_codec.decode_channel(telemetry['time'], body) if telemetry['time'] is not None else None
+    return header, channels, time
+
+
+def delta_roundtrip_errors(replay, buffer):
+    """
+    Largest |decoded - original| per channel (and 'time') of a delta payload, next to the
+    allowed scale / 2, as {name: (error, tolerance)}. Also checks that missing samples stay missing.
+    """
+    grid = replay.grid
+    header, channels, time = decode_delta(buffer)
+    errors = {}
+
+    def check(name, original, decoded, scale):
+        original = np.asarray(original, dtype=np.float64)
+        if original.shape != decoded.shape or not np.array_equal(np.isnan(original), np.isnan(decoded)):
+            raise ValueError(f"{name}: decoded shape or missing samples differ")
+        diff = np.abs(original - decoded)
+        error = float(np.nanmax(diff)) if diff.size and not np.isnan(diff).all() else 0.0
+        previous = errors.get(name, (0.0, scale / 2))[0]
+        errors[name] = (max(previous, error), scale / 2)
+
+    if time is not None:
+        check('time', grid.time, time, TIME_SCALE)
+    for d, driver in enumerate(grid.drivers):
+        idx = grid.driver_indices(d)
+        if 'time' in channels[driver]:
+            check('time', grid.time[idx], channels[driver]['time'], TIME_SCALE)
+        for name, scale in header['telemetry']['channels'].items():
+            check(name, grid.data[idx, d, CHANNELS.index(name)], channels[driver][name], scale)
+    return errors
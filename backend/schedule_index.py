@@ -0,0 +1,148 @@
+"""
+Season schedule index.
+
+Event schedules per season, fetched from the data source once and kept in memory
+and on disk (one JSON file per season under root), so a restart serves them
+without touching FastF1:
+
+- past seasons are final: fetched once after the season is over, then kept for good
+- the current season expires after ttl_seconds and is fetched again (by the
+  background refresher, or by the first request after it expired)
+- when a refetch fails, the stale copy is served rather than an error
+"""
+import json
+import os
+import threading
+import time
+
+# Bump whenever the stored entries change shape (ignores older files)
+SCHEDULE_VERSION = 1
+
+
+class ScheduleIndex:
+    def __init__(self, root, fetch, first_season=2018, ttl_seconds=6 * 3600, keep_past_seasons=True, clock=time.time):
+        """fetch(year) returns the season's event records; keep_past_seasons=False applies the TTL to every season."""
+        self.root = root
+        self.fetch = fetch
+        self.first_season = int(first_season)
+        self.ttl_seconds = float(ttl_seconds)
+        self.keep_past_seasons = keep_past_seasons
+        self._clock = clock
+        self._memory = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def current_season(self):
+        return time.gmtime(self._clock()).tm_year
+
+    def seasons(self):
+        return list(range(self.first_season, self.current_season() + 1))
+
+    def _path(self, year):
+        return os.path.join(self.root, f"{int(year)}.json")
+
+    def _read(self, year):
+        try:
+            with open(self._path(year), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('version') == SCHEDULE_VERSION else None
+
+    def _write(self, entry):
+        path = self._path(entry['year'])
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def _fresh(self, entry):
+        return entry['final'] or self._clock() - entry['fetched_at'] < self.ttl_seconds
+
+    def _entry(self, year):
+        entry = self._memory.get(year)
+        if entry is None:
+            entry = self._read(year)
+            if entry is not None:
+                self._memory[year] = entry
+        return entry
+
+    def races(self, year, refresh=False):
+        """Event records of the season, fetching them when missing, expired or refresh is set."""
+        year = int(year)
+        entry = self._entry(year)
+        if entry is not None and not refresh and self._fresh(entry):
+            return entry['events']
+        with self._lock:
+            lock = self._locks.setdefault(year, threading.Lock())
+        with lock:
+            # Another caller may have fetched it meanwhile
+            latest = self._entry(year)
+            if latest is not None and latest is not entry and self._fresh(latest):
+                return latest['events']
+            try:
+                events = self.fetch(year)
+            except Exception as e:
+                if entry is None:
+                    raise
+                print(f"Schedule refresh for {year} failed ({e}); serving the copy from {time.ctime(entry['fetched_at'])}")
+                return entry['events']
+            entry = {
+                "version": SCHEDULE_VERSION,
+                "year": year,
+                "fetched_at": self._clock(),
+                "final": self.keep_past_seasons and year < self.current_season(),
+                "events": events,
+            }
+            self._memory[year] = entry
+            try:
+                self._write(entry)
+            except OSError as e:
+                print(f"Could not persist the {year} schedule: {e}")
+            return events
+
+    def warm(self):
+        """Load every season, fetching only what is missing or expired."""
+        for year in self.seasons():
+            if self._stop.is_set():
+                return
+            try:
+                self.races(year)
+            except Exception as e:
+                print(f"Schedule for {year} unavailable: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.warm()
+            # Wake up when the current season expires (or sooner, so a new season is picked up)
+            self._stop.wait(min(self.ttl_seconds, 3600.0))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="schedule-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self):
+        now = self._clock()
+        seasons = []
+        for year in self.seasons():
+            entry = self._entry(year)
+            seasons.append({
+                "year": year,
+                "cached": entry is not None,
+                "final": entry["final"] if entry else False,
+                "events": len(entry["events"]) if entry else 0,
+                "age_seconds": round(now - entry["fetched_at"], 1) if entry else None,
+                "fresh": self._fresh(entry) if entry else False,
+            })
+        return {"ttl_seconds": self.ttl_seconds, "refreshing": self._thread is not None, "seasons": seasons}
@@ -0,0 +1,310 @@
+"""
+FastF1 session loading, plus the session-level reads behind the lighter endpoints.
+
+Everything here is a plain top-level function so it can run in a worker process.
+Loaded sessions are shared through a per-process registry: a race's raw data is
+parsed once and reused by every endpoint (and upgraded in place when a later
+caller needs more of it, e.g. team radio first and the full replay afterwards).
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from data_sources import data_source
+
+_LOAD_FLAGS = ('telemetry', 'laps', 'weather', 'messages')
+
+
+def _load(session, telemetry=True, laps=True, weather=True, messages=True):
+    try:
+        session.load(telemetry=telemetry, laps=laps, weather=weather, messages=messages)
+    except TypeError:
+        # Older FastF1 version doesn't have messages parameter
+        session.load(telemetry=telemetry, laps=laps, weather=weather)
+
+
+def _frame_nbytes(frame):
+    try:
+        return int(frame.memory_usage(index=True, deep=False).sum())
+    except Exception:
+        return 0
+
+
+def session_nbytes(session):
+    """Approximate memory held by a loaded session's data frames."""
+    import pandas as pd
+
+    total = 0
+    for name in ('laps', 'results', 'weather_data', 'track_status', 'race_control_messages', 'pos_data', 'car_data'):
+        try:
+            value = getattr(session, name, None)
+        except Exception:
+            # FastF1 raises DataNotLoadedError for parts that were not loaded
+            continue
+        if isinstance(value, dict):
+            total += sum(_frame_nbytes(frame) for frame in value.values())
+        elif isinstance(value, pd.DataFrame):
+            total += _frame_nbytes(value)
+    return total
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.loaded = set()
+        self.nbytes = 0
+
+
+class SessionRegistry:
+    """
+    LRU of loaded FastF1 sessions keyed by (year, race, session type), bounded by
+    an approximate memory budget. The most recently used session is always kept,
+    even if it alone exceeds the budget.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, max_items=8, source=None):
+        self.max_bytes = max_bytes
+        # Anything with get_session(year, race, session_type) -> FastF1-like session (see data_sources.py)
+        self.source = source or data_source
+        self.max_items = max(1, int(max_items))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "loads": 0, "upgrades": 0, "evictions": 0}
+
+    @staticmethod
+    def key(year, race_name, session_type='R'):
+        return (int(year), race_name.strip().lower(), session_type.upper())
+
+    def get(self, year, race_name, session_type='R', telemetry=True, laps=True, weather=True, messages=True):
+        wanted = {name for name, flag in zip(_LOAD_FLAGS, (telemetry, laps, weather, messages)) if flag}
+        key = self.key(year, race_name, session_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            self._entries.move_to_end(key)
+
+        # Per-race lock: concurrent callers for the same race wait for one load
+        with entry.lock:
+            if entry.session is not None and wanted <= entry.loaded:
+                with self._lock:
+                    self.stats["hits"] += 1
+                return entry.session
+            if entry.session is None:
+                entry.session = self.source.get_session(year, race_name, session_type)
+                with self._lock:
+                    self.stats["loads"] += 1
+            else:
+                # Upgrade in place: reload the same Session object with everything asked for so far
+                with self._lock:
+                    self.stats["upgrades"] += 1
+            flags = entry.loaded | wanted
+            try:
+                _load(entry.session, **{name: name in flags for name in _LOAD_FLAGS})
+            except Exception:
+                with self._lock:
+                    if not entry.loaded and self._entries.get(key) is entry:
+                        del self._entries[key]
+                raise
+            entry.loaded = flags
+            entry.nbytes = session_nbytes(entry.session)
+            session = entry.session
+
+        self._evict(keep=key)
+        return session
+
+    def _evict(self, keep):
+        with self._lock:
+            while len(self._entries) > 1:
+                total = sum(entry.nbytes for entry in self._entries.values())
+                if total <= self.max_bytes and len(self._entries) <= self.max_items:
+                    break
+                victim = next((k for k in self._entries if k != keep), None)
+                if victim is None:
+                    break
+                del self._entries[victim]
+                self.stats["evictions"] += 1
+
+    def discard(self, year, race_name, session_type='R'):
+        with self._lock:
+            self._entries.pop(self.key(year, race_name, session_type), None)
+
+    def status(self):
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "sessions": [
+                    {"key": list(key), "loaded": sorted(entry.loaded), "bytes": entry.nbytes}
+                    for key, entry in self._entries.items()
+                ],
+                **self.stats,
+            }
+
+
+# Read from the environment (not main.py) so worker processes pick it up too. Every build pool
+# worker has its own registry (a session is only shared by requests that land on the same worker),
+# so SESSION_REGISTRY_MB is the budget of all REPLAY_BUILD_WORKERS together, split evenly.
+SESSION_REGISTRY_WORKERS = max(1, int(os.environ.get('REPLAY_BUILD_WORKERS', '2')))
+session_registry = SessionRegistry(
+    max_bytes=int(float(os.environ.get('SESSION_REGISTRY_MB', '1024')) * 1024 * 1024) // SESSION_REGISTRY_WORKERS,
+    max_items=int(os.environ.get('SESSION_REGISTRY_ITEMS', '8')),
+)
+
+
+def load_session(year, race_name, session_type='R', telemetry=True, laps=True, weather=True, messages=True):
+    """Loaded session from this process's registry (loading or upgrading it as needed)."""
+    return session_registry.get(year, race_name, session_type, telemetry=telemetry, laps=laps, weather=weather, messages=messages)
+
+
+# Top-level keys of the telemetry_replay response, reported by the meta endpoint
+REPLAY_KEYS = [
+    "telemetry",
+    "drivers",
+    "laps",
+    "events",
+    "race_control",
+    "circuit_info",
+    "weather",
+    "total_laps",
+    "time_base",
+]
+
+
+def replay_meta_from_manifest(year, race_name, manifest):
+    """telemetry_replay_meta answered from the manifest written with a cached replay."""
+    pos_rows, car_rows = manifest.get("pos_rows"), manifest.get("car_rows")
+    pos_total = sum(pos_rows.values()) if pos_rows is not None else None
+    car_total = sum(car_rows.values()) if car_rows is not None else None
+    rows = manifest.get("rows") or {}
+    return {
+        "year": year,
+        "race_name": race_name,
+        "source": "manifest",
+        "drivers": manifest["drivers"],
+        "drivers_count": len(manifest["drivers"]),
+        "total_laps": manifest["total_laps"],
+        "time_min_seconds": manifest["time_min_seconds"],
+        "time_max_seconds": manifest["time_max_seconds"],
+        "duration_seconds": manifest.get("duration"),
+        # Unknown (None) when the manifest has no counts, as in fetch_replay_meta
+        "has_pos_data": pos_total > 0 if pos_total is not None else None,
+        "has_car_data": car_total > 0 if car_total is not None else None,
+        "pos_rows_total": pos_total,
+        "car_rows_total": car_total,
+        "laps_rows": rows.get("laps", 0),
+        "events_rows": rows.get("events", 0),
+        "race_control_rows": rows.get("race_control", 0),
+        "weather_rows": rows.get("weather", 0),
+        "pipeline_version": manifest.get("pipeline_version"),
+        "expected_top_level_keys": REPLAY_KEYS,
+    }
+
+
+def fetch_replay_meta(year, race_name):
+    """
+    telemetry_replay_meta for a race that has no cached replay yet: loads laps,
+    weather and messages but not telemetry, so whether there is pos/car data and
+    their row counts are unknown (None), and the time range comes from the lap
+    start times.
+    """
+    import pandas as pd
+
+    print(f"Loading session (meta, no telemetry) for {year} {race_name}...")
+    session = load_session(year, race_name, 'R', telemetry=False)
+
+    drivers = list(getattr(session, 'drivers', []) or [])
+    laps = getattr(session, 'laps', None)
+    has_laps = laps is not None and not laps.empty
+
+    # Total laps
+    total_laps = 0
+    if getattr(session, 'total_laps', None) is not None:
+        total_laps = int(session.total_laps)
+    elif has_laps and 'LapNumber' in laps.columns:
+        total_laps = int(laps['LapNumber'].max())
+
+    # Lap-based time range
+    t_min = None
+    t_max = None
+    if has_laps and 'LapStartTime' in laps.columns:
+        try:
+            lst = laps['LapStartTime'].dropna()
+            if not lst.empty:
+                t_min = pd.to_timedelta(lst.min()).total_seconds()
+                t_max = pd.to_timedelta(lst.max()).total_seconds()
+            if 'LapTime' in laps.columns:
+                ends = (laps['LapStartTime'] + laps['LapTime']).dropna()
+                if not ends.empty:
+                    t_max = max(t_max, pd.to_timedelta(ends.max()).total_seconds())
+        except Exception:
+            pass
+
+    def _rows(name):
+        try:
+            frame = getattr(session, name, None)
+        except Exception:
+            return 0
+        return int(len(frame)) if frame is not None else 0
+
+    return {
+        "year": year,
+        "race_name": race_name,
+        "source": "laps",
+        "drivers": drivers,
+        "drivers_count": len(drivers),
+        "total_laps": total_laps,
+        "time_min_seconds": t_min,
+        "time_max_seconds": t_max,
+        "duration_seconds": None,
+        # Unknown without loading telemetry
+        "has_pos_data": None,
+        "has_car_data": None,
+        "pos_rows_total": None,
+        "car_rows_total": None,
+        "laps_rows": _rows('laps'),
+        "events_rows": _rows('track_status'),
+        "race_control_rows": _rows('race_control_messages'),
+        "weather_rows": _rows('weather_data'),
+        "pipeline_version": None,
+        "expected_top_level_keys": REPLAY_KEYS,
+    }
+
+
+def fetch_team_radio(year, race_name):
+    try:
+        # Need to load messages (FastF1 >= 3.0 requires explicit messages=True)
+        session = load_session(year, race_name, 'R', telemetry=False, laps=False, weather=False, messages=True)
+
+        radio_data = []
+
+        # Try team_radio attribute (FastF1 >= 3.0)
+        if hasattr(session, 'team_radio') and session.team_radio is not None and not session.team_radio.empty:
+            radios = session.team_radio.copy()
+            if 'Time' in radios.columns:
+                radios['Time'] = radios['Time'].dt.total_seconds()
+            cols = [c for c in ['Time', 'Driver', 'Message'] if c in radios.columns]
+            radio_data = json.loads(radios[cols].to_json(orient='records'))
+        # Fallback: Try get_driver_radio (older FastF1)
+        elif hasattr(session, 'get_driver_radio'):
+            for driver in session.drivers[:10]:  # Limit to first 10 drivers
+                try:
+                    radio = session.get_driver_radio(driver)
+                    if radio is not None and not radio.empty:
+                        radio['Driver'] = driver
+                        if 'Time' in radio.columns:
+                            radio['Time'] = radio['Time'].dt.total_seconds()
+                        cols = [c for c in ['Time', 'Driver', 'Message'] if c in radio.columns]
+                        radio_data.extend(json.loads(radio[cols].to_json(orient='records')))
+                except:
+                    pass
+
+        print(f"Team radio: {len(radio_data)} messages loaded")
+        return radio_data
+    except Exception as e:
+        print(f"Error fetching radio: {e}")
+        import traceback
+        traceback.print_exc()
+        return []
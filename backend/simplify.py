@@ -0,0 +1,121 @@
+"""
+Error-bounded downsampling of replay telemetry.
+
+Instead of a fixed sample rate, each driver's path is simplified with
+Ramer-Douglas-Peucker on the synchronized Euclidean distance: a sample is dropped
+only if the position interpolated linearly in time between the kept samples is
+within `tolerance` (FastF1 position units) of it. Steady straights collapse to a
+handful of points, while corners, braking and stops keep what they need. A maximum
+time gap bounds the error of the non-positional channels, and samples where
+LapNumber/Compound change are always kept (both before simplifying, so they don't
+loosen the bound).
+"""
+import numpy as np
+
+from replay_builder import CHANNELS
+
+# Keep at least one sample every max_gap seconds so Speed/RPM/etc. stay usable
+DEFAULT_MAX_GAP_SECONDS = 5.0
+
+# Default smallest tolerance the server accepts (position units): tighter ones keep more samples
+# than the fixed 1 Hz grid
+MIN_TOLERANCE = 20.0
+
+# Samples where these change are always kept
+_KEEP_ON_CHANGE = ('LapNumber', 'Compound')
+
+
+def _segment_error(x, y, t, p, i, j):
+    """Error of reconstructing points p from their segment's endpoints i and j (index arrays)."""
+    if t is not None:
+        # Synchronized Euclidean distance: to the point interpolated at the sample's own time
+        frac = (t[p] - t[i]) / (t[j] - t[i])
+        return np.hypot(x[p] - (x[i] + frac * (x[j] - x[i])), y[p] - (y[i] + frac * (y[j] - y[i])))
+    dx, dy = x[j] - x[i], y[j] - y[i]
+    px, py = x[p] - x[i], y[p] - y[i]
+    norm = np.hypot(dx, dy)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dist = np.abs(px * dy - py * dx) / norm
+    return np.where(norm > 0, dist, np.hypot(px, py))
+
+
+def rdp_mask(x, y, tolerance, t=None, keep=None):
+    """
+    Boolean mask of the points kept by Ramer-Douglas-Peucker (endpoints, and any point set
+    in keep, always kept). Without t the error is the perpendicular distance to the segment
+    (path shape only); with t (strictly increasing) it is the synchronized Euclidean distance,
+    to the position interpolated at the point's own time, so every dropped point is within
+    tolerance of its linear-in-time reconstruction from the kept ones.
+    All open segments are split in one vectorised pass per level of the recursion.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    t = None if t is None else np.asarray(t, dtype=np.float64)
+    n = len(x)
+    keep = np.zeros(n, dtype=bool) if keep is None else np.array(keep, dtype=bool)
+    if n < 3:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+    kept = np.flatnonzero(keep)
+    lo, hi = kept[:-1], kept[1:]
+    while True:
+        inner = hi - lo - 1
+        lo, hi, inner = lo[inner > 0], hi[inner > 0], inner[inner > 0]
+        if not len(lo):
+            return keep
+        # Interior points of every open segment, back to back
+        first = np.cumsum(inner) - inner
+        seg = np.repeat(np.arange(len(lo)), inner)
+        p = np.arange(len(seg)) - first[seg] + lo[seg] + 1
+        error = _segment_error(x, y, t, p, lo[seg], hi[seg])
+        worst = np.maximum.reduceat(error, first)
+        split = worst > tolerance
+        # Split at the first point at its segment's maximum
+        at = np.flatnonzero(split[seg] & (error == worst[seg]))
+        at = at[np.r_[True, seg[at[1:]] != seg[at[:-1]]]] if len(at) else at
+        k = p[at]
+        keep[k] = True
+        lo, hi = np.concatenate((lo[split], k)), np.concatenate((k, hi[split]))
+
+
+def _max_gap_mask(time, max_gap):
+    # Bucket samples by max_gap window and keep the first sample of every bucket
+    bucket = np.floor((time - time[0]) / max_gap).astype(np.int64)
+    keep = np.zeros(len(time), dtype=bool)
+    keep[0] = True
+    keep[1:] = bucket[1:] != bucket[:-1]
+    return keep
+
+
+def simplify_indices(grid, d, tolerance, max_gap=DEFAULT_MAX_GAP_SECONDS):
+    """Grid indices kept for driver d."""
+    start, end = int(grid.spans[d, 0]), int(grid.spans[d, 1])
+    if end <= start:
+        return np.zeros(0, dtype=np.int64)
+    block = grid.data[start:end, d, :]
+    x = block[:, CHANNELS.index('X')].astype(np.float64)
+    y = block[:, CHANNELS.index('Y')].astype(np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+
+    # Forced samples first: they are breakpoints of the simplification, so adding them
+    # afterwards can't push a dropped sample out of tolerance
+    keep = np.zeros(end - start, dtype=bool)
+    if max_gap and max_gap > 0:
+        keep |= _max_gap_mask(grid.time[start:end], max_gap)
+    for name in _KEEP_ON_CHANGE:
+        values = block[:, CHANNELS.index(name)]
+        changed = np.zeros(len(values), dtype=bool)
+        changed[1:] = ~((values[1:] == values[:-1]) | (np.isnan(values[1:]) & np.isnan(values[:-1])))
+        keep |= changed
+    if valid.any():
+        idx = np.flatnonzero(valid)
+        keep[idx] = rdp_mask(x[idx], y[idx], tolerance, grid.time[start:end][idx], keep=keep[idx])
+    keep[0] = keep[-1] = True
+    return start + np.flatnonzero(keep)
+
+
+def simplify_grid(grid, tolerance, max_gap=DEFAULT_MAX_GAP_SECONDS):
+    """Copy of grid restricted to the simplified samples of every driver."""
+    samples = [simplify_indices(grid, d, tolerance, max_gap) for d in range(len(grid.drivers))]
+    return grid.with_samples(samples)
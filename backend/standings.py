@@ -0,0 +1,224 @@
+"""
+Per-tick running order for a processed replay.
+
+Computed once per race on the replay grid so playback is a row lookup instead of
+a per-frame sort. Ordering follows the replay UI: grid order until 10 s after the
+Lap 1 start, then completed laps (more is better) and the time each car crossed
+the line to complete its last lap (earlier is better), retired cars last, and the
+official classification once the race is over.
+
+Gaps are timing-line gaps: the time between the leader and a car crossing the line
+at the end of the lap that car last completed (laps_down says how many laps behind).
+"""
+import os
+
+import numpy as np
+
+STATUS_LABELS = ('RUNNING', 'FINISHED', 'RET')
+RUNNING, FINISHED, RETIRED = 0, 1, 2
+
+# Seconds after a car's last telemetry sample before it is shown as finished/retired
+STATUS_GRACE_SECONDS = 5.0
+# Grid order is kept for this long after the Lap 1 start
+START_PHASE_SECONDS = 10.0
+
+_ARRAYS = ('order', 'position', 'lap', 'completed', 'cumulative', 'gap', 'interval', 'laps_down', 'status')
+
+
+def _finished_status(status):
+    status = status or 'Finished'
+    return status == 'Finished' or 'Lap' in status
+
+
+class StandingsTable:
+    """
+    Arrays are (tick x driver), aligned with the replay grid's time vector and
+    driver list. order[t] lists driver indices from P1 down; every other array is
+    indexed by driver.
+    """
+
+    def __init__(self, time, race_start, race_end, **arrays):
+        self.time = time
+        self.race_start = race_start
+        self.race_end = race_end
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def window(self, start, end):
+        i0 = int(np.searchsorted(self.time, start, side='left'))
+        i1 = max(i0, int(np.searchsorted(self.time, end, side='left')))
+        return StandingsTable(
+            self.time[i0:i1], self.race_start, self.race_end,
+            **{name: getattr(self, name)[i0:i1] for name in _ARRAYS}
+        )
+
+    def to_payload(self, drivers):
+        def rows(values, decimals=None):
+            if decimals is None:
+                return values.tolist()
+            rounded = np.round(values.astype(np.float64), decimals)
+            return [[None if v != v else v for v in row] for row in rounded.tolist()]
+
+        return {
+            "time": np.round(self.time, 3).tolist(),
+            "drivers": list(drivers),
+            "status_labels": list(STATUS_LABELS),
+            "race_start": self.race_start,
+            "race_end": self.race_end,
+            "order": rows(self.order),
+            "position": rows(self.position),
+            "lap": rows(self.lap),
+            "completed": rows(self.completed),
+            "cumulative": rows(self.cumulative, 3),
+            "gap": rows(self.gap, 3),
+            "interval": rows(self.interval, 3),
+            "laps_down": rows(self.laps_down),
+            "status": rows(self.status),
+        }
+
+    def save(self, entry_dir):
+        np.savez(
+            os.path.join(entry_dir, 'standings.npz'),
+            time=self.time,
+            bounds=np.array([self.race_start, np.nan if self.race_end is None else self.race_end], dtype=np.float64),
+            **{name: getattr(self, name) for name in _ARRAYS}
+        )
+
+    @classmethod
+    def load(cls, entry_dir):
+        with np.load(os.path.join(entry_dir, 'standings.npz')) as arrays:
+            race_start, race_end = (float(v) for v in arrays['bounds'])
+            race_end = None if np.isnan(race_end) else race_end
+            return cls(arrays['time'], race_start, race_end, **{name: arrays[name] for name in _ARRAYS})
+
+
+def _lap_end_times(laps, drivers, total_laps):
+    """
+    crossing[d, k] = zero-based time at which driver d completed lap k (crossing[d, 0]
+    is the race start), inf when not completed. Made non-decreasing so searchsorted works.
+    """
+    index = {driver: d for d, driver in enumerate(drivers)}
+    max_lap = int(total_laps or 0)
+    for lap in laps:
+        if lap.get('LapNumber') is not None:
+            max_lap = max(max_lap, int(lap['LapNumber']))
+
+    starts = np.full((len(drivers), max_lap + 2), np.nan)
+    durations = np.full((len(drivers), max_lap + 2), np.nan)
+    for lap in laps:
+        d = index.get(str(lap.get('Driver')))
+        n = lap.get('LapNumber')
+        if d is None or n is None:
+            continue
+        n = int(n)
+        if lap.get('LapStartTime') is not None:
+            starts[d, n] = lap['LapStartTime']
+        if lap.get('LapTime') is not None and lap['LapTime'] > 0:
+            durations[d, n] = lap['LapTime']
+
+    lap1 = starts[:, 1]
+    race_start = float(np.nanmin(lap1)) if np.isfinite(lap1).any() else 0.0
+
+    # End of lap k: its start + lap time, else the start of lap k + 1
+    ends = starts[:, 1:max_lap + 1] + durations[:, 1:max_lap + 1]
+    ends = np.where(np.isnan(ends), starts[:, 2:max_lap + 2], ends)
+    ends = np.where(np.isnan(ends), np.inf, ends)
+    # A later known crossing implies the earlier laps were completed by then
+    ends = np.minimum.accumulate(ends[:, ::-1], axis=1)[:, ::-1]
+
+    crossing = np.empty((len(drivers), max_lap + 1))
+    crossing[:, 0] = race_start
+    crossing[:, 1:] = ends
+    return crossing, race_start
+
+
+def _race_end(drivers, drivers_info, crossing, race_start, total_laps):
+    """Winner finish time: official total time, else the winner's (or first) final-lap crossing."""
+    total_laps = int(total_laps or 0)
+    if total_laps <= 0 or total_laps >= crossing.shape[1]:
+        return np.inf
+    for d, driver in enumerate(drivers):
+        info = drivers_info.get(driver) or {}
+        if info.get('ClassifiedPosition') == 1:
+            if info.get('TotalTime'):
+                return race_start + float(info['TotalTime'])
+            if np.isfinite(crossing[d, total_laps]):
+                return float(crossing[d, total_laps])
+    return float(np.min(crossing[:, total_laps]))
+
+
+def build_standings(grid, sections):
+    drivers = grid.drivers
+    n_ticks, n_drivers = len(grid.time), len(drivers)
+    drivers_info = sections.get('drivers') or {}
+    total_laps = int(sections.get('total_laps') or 0)
+    time = grid.time
+
+    crossing, race_start = _lap_end_times(sections.get('laps') or [], drivers, total_laps)
+    race_end = _race_end(drivers, drivers_info, crossing, race_start, total_laps)
+
+    # Completed laps per tick: number of line crossings at or before t
+    completed = np.zeros((n_ticks, n_drivers), dtype=np.int16)
+    for d in range(n_drivers):
+        completed[:, d] = np.searchsorted(crossing[d, 1:], time, side='right')
+    cols = np.arange(n_drivers)[None, :]
+    crossed_at = crossing[cols, completed]
+
+    lap = np.clip(completed + 1, 1, max(total_laps, 1)).astype(np.int16)
+
+    grid_pos = np.array([(drivers_info.get(x) or {}).get('GridPosition') or 20 for x in drivers], dtype=np.float64)
+    classified = np.array([(drivers_info.get(x) or {}).get('ClassifiedPosition') or 99 for x in drivers], dtype=np.float64)
+    finishes = np.array([_finished_status((drivers_info.get(x) or {}).get('Status')) for x in drivers])
+
+    # Status from the end of each car's telemetry
+    last_seen = np.array([time[max(int(e) - 1, 0)] if e > s else -np.inf for s, e in grid.spans], dtype=np.float64)
+    gone = time[:, None] > last_seen[None, :] + STATUS_GRACE_SECONDS
+    status = np.where(gone, np.where(finishes[None, :], FINISHED, RETIRED), RUNNING).astype(np.int8)
+
+    # Sort keys: more completed laps first, then earlier crossing; no laps yet -> grid order
+    key = np.where(completed > 0, -completed.astype(np.float64) * 1e7 + crossed_at, grid_pos[None, :])
+    key = np.where(status == RETIRED, key + 1e12, key)
+
+    leader_laps = completed.max(axis=1) if n_drivers else np.zeros(n_ticks, dtype=np.int16)
+    start_phase = time < race_start + START_PHASE_SECONDS
+    over = (time >= race_end) | (time >= (time[-1] if n_ticks else 0.0))
+    if total_laps > 0:
+        over |= leader_laps >= total_laps
+    key = np.where(start_phase[:, None], grid_pos[None, :], key)
+    key = np.where(over[:, None], classified[None, :], key)
+    status = np.where(over[:, None] & (classified[None, :] < 99), FINISHED, status).astype(np.int8)
+
+    order = np.argsort(key, axis=1, kind='stable').astype(np.int16)
+    position = np.empty_like(order)
+    np.put_along_axis(position, order.astype(np.int64), np.arange(1, n_drivers + 1, dtype=np.int16)[None, :], axis=1)
+
+    # Timing-line gaps at the lap each car last completed
+    leader = order[:, :1].astype(np.int64)
+    leader_completed = np.take_along_axis(completed, leader, axis=1)
+    laps_down = (leader_completed - completed).astype(np.int16)
+    gap = crossed_at - crossing[leader, completed]
+
+    ahead_idx = np.take_along_axis(order, np.clip(position.astype(np.int64) - 2, 0, None), axis=1).astype(np.int64)
+    interval = crossed_at - crossing[ahead_idx, completed]
+
+    no_lap = completed == 0
+    is_leader = position == 1
+    gap = np.where(no_lap | ~np.isfinite(gap), np.nan, gap)
+    gap = np.where(is_leader, 0.0, gap)
+    interval = np.where(no_lap | is_leader | ~np.isfinite(interval), np.nan, interval)
+    cumulative = np.where(no_lap, np.nan, crossed_at - race_start)
+
+    return StandingsTable(
+        time,
+        race_start,
+        float(race_end) if np.isfinite(race_end) else None,
+        order=order,
+        position=position,
+        lap=lap,
+        completed=completed,
+        cumulative=cumulative.astype(np.float32),
+        gap=gap.astype(np.float32),
+        interval=interval.astype(np.float32),
+        laps_down=laps_down,
+        status=status,
+    )
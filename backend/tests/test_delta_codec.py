@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+import delta_codec
+from replay_builder import CHANNEL_SCALES, CHANNELS, TIME_SCALE, ProcessedReplay, ReplayGrid
+from replay_formats import decode_delta, delta_payload, delta_roundtrip_errors
+
+
+def roundtrip(values, scale):
+    body = delta_codec.Body()
+    entry = delta_codec.encode_channel(values, scale, body)
+    header, view = delta_codec.unpack(delta_codec.pack({'entry': entry}, body))
+    return header['entry'], delta_codec.decode_channel(header['entry'], view)
+
+
+def assert_within_half_step(values, decoded, scale):
+    values = np.asarray(values, dtype=np.float64)
+    assert decoded.shape == values.shape
+    np.testing.assert_array_equal(np.isnan(decoded), np.isnan(values))
+    present = ~np.isnan(values)
+    if present.any():
+        assert np.abs(decoded[present] - values[present]).max() <= scale / 2 * (1 + 1e-9)
+
+
+@pytest.mark.parametrize('scale', [0.001, 0.01, 0.1, 1.0])
+def test_random_walk_within_half_step(scale):
+    rng = np.random.default_rng(1)
+    values = np.cumsum(rng.normal(0, 50 * scale, 5000))
+    entry, decoded = roundtrip(values, scale)
+    assert entry['codec'] == 'delta'
+    assert 'mask' not in entry
+    assert_within_half_step(values, decoded, scale)
+
+
+def test_missing_samples_keep_their_positions():
+    rng = np.random.default_rng(2)
+    values = np.cumsum(rng.normal(0, 5, 1000))
+    values[:7] = np.nan  # leading gap
+    values[300:340] = np.nan
+    values[rng.choice(1000, 50, replace=False)] = np.nan
+    values[-3:] = np.nan  # trailing gap
+    entry, decoded = roundtrip(values, 0.1)
+    assert 'mask' in entry
+    assert_within_half_step(values, decoded, 0.1)
+
+
+def test_rarely_changing_channel_is_run_length_coded():
+    laps = np.repeat(np.arange(1, 59, dtype=np.float64), 90)
+    laps[:5] = np.nan
+    entry, decoded = roundtrip(laps, 1.0)
+    assert entry['codec'] == 'rle'
+    np.testing.assert_array_equal(decoded, laps)
+
+
+def test_regular_time_vector_is_run_length_coded():
+    time = np.arange(0, 5400, 0.25)
+    entry, decoded = roundtrip(time, TIME_SCALE)
+    assert entry['codec'] == 'rle'
+    assert_within_half_step(time, decoded, TIME_SCALE)
+
+
+def test_large_jumps_use_escapes():
+    values = np.array([0.0, 1.0, 500.0, -20000.0, -20001.0, 3.0e6])
+    entry, decoded = roundtrip(values, 1.0)
+    assert 'escapes' in entry['deltas']
+    np.testing.assert_array_equal(decoded, values)
+
+
+@pytest.mark.parametrize('values', [np.array([]), np.full(10, np.nan), np.array([np.nan]), np.array([42.0])])
+def test_empty_and_all_missing_channels(values):
+    entry, decoded = roundtrip(values, 0.1)
+    assert_within_half_step(values, decoded, 0.1)
+
+
+def test_out_of_range_scale_is_rejected():
+    with pytest.raises(ValueError):
+        delta_codec.encode_channel(np.array([0.0, 1e12]), 0.001, delta_codec.Body())
+
+
+def test_unpack_rejects_other_buffers():
+    with pytest.raises(ValueError):
+        delta_codec.unpack(b'not a delta buffer')
+
+
+def make_grid(ticks=400, drivers=('1', '44', '16')):
+    rng = np.random.default_rng(3)
+    data = np.full((ticks, len(drivers), len(CHANNELS)), np.nan, dtype=np.float32)
+    spans = np.zeros((len(drivers), 2), dtype=np.int64)
+    for d in range(len(drivers)):
+        start, end = 10 * d, ticks - 5 * d
+        spans[d] = (start, end)
+        n = end - start
+        for name in CHANNELS:
+            c = CHANNELS.index(name)
+            if name in ('X', 'Y'):
+                values = np.cumsum(rng.normal(0, 300, n))
+            elif name in ('LapNumber', 'Compound', 'nGear', 'DRS'):
+                values = np.sort(rng.integers(0, 8, n)).astype(np.float64)
+            else:
+                values = rng.uniform(0, 300, n)
+            data[start:end, d, c] = values
+        # A driver without car data for a while
+        data[start + 50:start + 80, d, CHANNELS.index('Speed')] = np.nan
+    present = np.ones(len(CHANNELS), dtype=bool)
+    return ReplayGrid(np.arange(ticks, dtype=np.float64), 3600.0, list(drivers), data, spans, ['SOFT', 'MEDIUM'], present)
+
+
+@pytest.mark.parametrize('simplified', [False, True])
+def test_replay_payload_roundtrip(simplified):
+    grid = make_grid()
+    if simplified:
+        grid = grid.with_samples([np.arange(int(s), int(e), 3) for s, e in grid.spans])
+    replay = ProcessedReplay(grid, {'drivers': {}})
+    buffer = delta_payload(replay)
+
+    for name, (error, tolerance) in delta_roundtrip_errors(replay, buffer).items():
+        assert error <= tolerance * (1 + 1e-6), name
+    header, channels, time = decode_delta(buffer)
+    assert header['telemetry_format'] == 'delta'
+    assert (time is None) == simplified
+    assert sorted(channels) == sorted(grid.drivers)
+
+
+def test_grid_saved_delta_coded_loads_within_half_step(tmp_path):
+    grid = make_grid()
+    grid.save(str(tmp_path), encoding='delta')
+    loaded = ReplayGrid.load(str(tmp_path))
+
+    np.testing.assert_array_equal(loaded.spans, grid.spans)
+    assert loaded.drivers == grid.drivers
+    for d in range(len(grid.drivers)):
+        start, end = grid.spans[d]
+        for name, scale in CHANNEL_SCALES.items():
+            c = CHANNELS.index(name)
+            # float32 storage adds its own rounding on top of the quantization
+            original = grid.data[start:end, d, c].astype(np.float64)
+            decoded = loaded.data[start:end, d, c].astype(np.float64)
+            np.testing.assert_array_equal(np.isnan(decoded), np.isnan(original))
+            ok = ~np.isnan(original)
+            assert np.abs(decoded[ok] - original[ok]).max() <= scale / 2 + np.abs(original[ok]).max() * 1e-6
@@ -0,0 +1,59 @@
+import gzip
+import json
+import time
+
+from http_cache import ArtifactStore, brotli, stream_through
+
+
+def body():
+    rows = [{"t": i, "x": (i * 37) % 1000, "y": (i * 91) % 700} for i in range(20000)]
+    return json.dumps(rows).encode('utf-8')
+
+
+def wait_idle(store, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while store._pending:
+        assert time.monotonic() < deadline, "recompression did not finish"
+        time.sleep(0.01)
+
+
+def test_streamed_artifacts_are_recompressed_after_commit(tmp_path):
+    store = ArtifactStore(gzip_level=1, brotli_quality=1)
+    data = body()
+    chunks = [data[i:i + 4096] for i in range(0, len(data), 4096)]
+    assert b''.join(stream_through(iter(chunks), store.writer(str(tmp_path), 'full'))) == data
+    cheap = {e: open(store.path(str(tmp_path), 'full', e), 'rb').read() for e in store.encodings}
+    wait_idle(store)
+
+    assert store.available(str(tmp_path), 'full') == store.encodings
+    final = {e: open(store.path(str(tmp_path), 'full', e), 'rb').read() for e in store.encodings}
+    assert final['identity'] == data
+    assert gzip.decompress(final['gzip']) == data
+    assert len(final['gzip']) < len(cheap['gzip'])
+    if brotli is not None:
+        assert brotli.decompress(final['br']) == data
+        assert len(final['br']) < len(cheap['br'])
+
+
+def test_no_recompression_when_final_levels_are_no_better(tmp_path):
+    store = ArtifactStore(gzip_level=9, brotli_quality=11, final_gzip_level=9, final_brotli_quality=11)
+    store.write(str(tmp_path), 'full', body())
+    assert not store._pending
+    assert store._recompressor is None
+
+
+def test_aborted_stream_leaves_no_artifacts(tmp_path):
+    store = ArtifactStore()
+
+    def failing():
+        yield b'[1,'
+        raise RuntimeError("render failed")
+
+    stream = stream_through(failing(), store.writer(str(tmp_path), 'full'))
+    assert next(stream) == b'[1,'
+    try:
+        next(stream)
+    except RuntimeError:
+        pass
+    assert store.available(str(tmp_path), 'full') == ()
+    assert list((tmp_path / 'http').iterdir()) == []
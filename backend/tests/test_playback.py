@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from playback import FrameEncoder, PlaybackRoom, log_task_error
+from replay_builder import CHANNELS, ProcessedReplay, ReplayGrid
+
+
+def make_room(ticks=100):
+    data = np.zeros((ticks, 2, len(CHANNELS)), dtype=np.float32)
+    grid = ReplayGrid(np.arange(ticks, dtype=np.float64), 0.0, ['1', '44'], data,
+                      np.array([[0, ticks], [0, ticks]]), [], np.ones(len(CHANNELS), dtype=bool))
+    return PlaybackRoom('party', FrameEncoder(ProcessedReplay(grid, {'drivers': {}})))
+
+
+def sent(subscriber):
+    return [json.loads(subscriber.queue.get_nowait()) for _ in range(subscriber.queue.qsize())]
+
+
+@pytest.mark.parametrize('message', [
+    '{"action": "seek", "value": NaN}',
+    '{"action": "seek", "value": Infinity}',
+    '{"action": "seek", "value": true}',
+    '{"action": "seek", "value": "10"}',
+    '{"action": "speed", "value": -Infinity}',
+    '{"action": "speed", "value": NaN}',
+    '{"action": "speed", "value": true}',
+    '{"action": "speed", "value": 1e400}',
+    '{"action": "speed", "value": 1000}',
+])
+def test_rejects_non_finite_and_bool_values(message):
+    room = make_room()
+    with pytest.raises(ValueError):
+        room.control(json.loads(message))
+    assert room.now() == 0.0
+    assert room.speed == 1.0
+
+
+def test_seek_and_speed_are_clamped_and_broadcast():
+    room = make_room()
+    viewer = room.subscribe(lambda text: None)
+    sent(viewer)
+    room.control({"action": "seek", "value": 1e9})
+    room.control({"action": "speed", "value": 4})
+    states = sent(viewer)
+    assert [s['time'] for s in states] == [99.0, 99.0]
+    assert states[-1]['speed'] == 4.0
+
+
+def test_new_viewer_is_counted_in_its_first_state():
+    room = make_room()
+    room.subscribe(lambda text: None)
+    second = room.subscribe(lambda text: None)
+    hello, state, frame = sent(second)
+    assert (hello['type'], state['type'], frame['type']) == ('hello', 'state', 'frame')
+    assert state['viewers'] == 2
+
+
+def test_failed_task_is_reported(capsys):
+    async def fail():
+        raise RuntimeError("socket closed")
+
+    async def run():
+        task = asyncio.get_running_loop().create_task(fail(), name="sender party")
+        task.add_done_callback(log_task_error)
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert "sender party failed: RuntimeError('socket closed')" in capsys.readouterr().out
@@ -0,0 +1,128 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pytest
+
+from prewarm import DONE, FAILED, QUEUED, RUNNING, JobQueue, PrewarmWorker
+
+SCHEDULE = {2024: ['Bahrain Grand Prix', 'Monaco Grand Prix'], 2025: ['Abu Dhabi Grand Prix']}
+
+
+def fixed_schedule(year):
+    return SCHEDULE.get(year, [])
+
+
+class Calls:
+    """Job stand-in recording when each race was attempted; fails for the races in failing."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.at = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, year, race_name, session_type):
+        with self._lock:
+            self.at.setdefault(race_name, []).append(time.monotonic())
+        if race_name in self.failing:
+            raise RuntimeError(f"no data for {race_name}")
+        return 'built'
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(2) as pool:
+        yield pool
+
+
+def test_seed_enqueues_completed_races_once(tmp_path, executor):
+    queue = JobQueue(str(tmp_path / 'prewarm.sqlite3'))
+    worker = PrewarmWorker(queue, [2024, 2025], fixed_schedule, Calls(), executor=executor)
+
+    assert worker.seed() == 3
+    assert worker.seed() == 0
+    assert queue.counts()[QUEUED] == 3
+    # Newest season first
+    assert queue.claim()['year'] == 2025
+
+
+def test_seed_records_schedule_errors(tmp_path, executor):
+    def schedule(year):
+        if year == 2025:
+            raise RuntimeError("schedule unavailable")
+        return fixed_schedule(year)
+
+    worker = PrewarmWorker(JobQueue(str(tmp_path / 'prewarm.sqlite3')), [2024, 2025], schedule, Calls(), executor=executor)
+    assert worker.seed() == 2
+    assert worker.seed_errors == {2025: "schedule unavailable"}
+
+
+def test_failing_job_is_retried_with_backoff(tmp_path, executor):
+    queue = JobQueue(str(tmp_path / 'prewarm.sqlite3'), max_attempts=3, backoff_seconds=0.1)
+    job = Calls(failing=['Monaco Grand Prix'])
+    worker = PrewarmWorker(queue, [2024], fixed_schedule, job, max_concurrency=2, executor=executor, poll_seconds=0.01)
+    worker.start()
+    try:
+        wait_for(lambda: queue.counts()[FAILED] == 1 and queue.counts()[DONE] == 1)
+    finally:
+        worker.stop()
+
+    jobs = {job['race_name']: job for job in queue.recent()}
+    assert jobs['Bahrain Grand Prix']['state'] == DONE
+    assert jobs['Bahrain Grand Prix']['attempts'] == 1
+    assert jobs['Monaco Grand Prix']['state'] == FAILED
+    assert jobs['Monaco Grand Prix']['attempts'] == 3
+    assert jobs['Monaco Grand Prix']['last_error'] == "no data for Monaco Grand Prix"
+    # Exponential backoff between attempts: 0.1s, then 0.2s
+    attempts = job.at['Monaco Grand Prix']
+    assert len(attempts) == 3
+    assert attempts[1] - attempts[0] >= 0.1
+    assert attempts[2] - attempts[1] >= 0.2
+
+
+def test_failed_job_waits_for_its_backoff(tmp_path, executor):
+    queue = JobQueue(str(tmp_path / 'prewarm.sqlite3'), max_attempts=5, backoff_seconds=60)
+    worker = PrewarmWorker(queue, [2025], fixed_schedule, Calls(failing=['Abu Dhabi Grand Prix']), executor=executor)
+    worker.seed()
+
+    assert worker.run_once() == 1
+    wait(list(worker._running))
+    assert worker.run_once() == 0  # reaps the failure; the retry is not due yet
+
+    [job] = queue.recent()
+    assert job['state'] == QUEUED
+    assert job['attempts'] == 1
+    assert job['next_attempt_at'] - job['updated_at'] == pytest.approx(60, abs=1)
+    assert queue.claim() is None
+    assert queue.claim(now=job['next_attempt_at'])['race_name'] == 'Abu Dhabi Grand Prix'
+
+
+def test_running_jobs_are_recovered_after_restart(tmp_path, executor):
+    db_path = str(tmp_path / 'prewarm.sqlite3')
+    crashed = JobQueue(db_path)
+    crashed.enqueue(2025, 'Abu Dhabi Grand Prix')
+    assert crashed.claim()['race_name'] == 'Abu Dhabi Grand Prix'
+    assert crashed.counts()[RUNNING] == 1
+
+    # A new process on the same database
+    queue = JobQueue(db_path)
+    job = Calls()
+    worker = PrewarmWorker(queue, [], fixed_schedule, job, executor=executor, poll_seconds=0.01)
+    worker.start()
+    try:
+        wait_for(lambda: queue.counts()[DONE] == 1)
+    finally:
+        worker.stop()
+
+    assert list(job.at) == ['Abu Dhabi Grand Prix']
+    [recovered] = queue.recent()
+    assert recovered['attempts'] == 2
+    assert recovered['result'] == 'built'
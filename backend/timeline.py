@@ -0,0 +1,153 @@
+"""
+Merged race timeline.
+
+One time-sorted list of typed entries per race, built with the replay from its
+side tables (all on the replay's zero-based timeline):
+
+- track_status / race_control / team_radio: point entries (end is None)
+- safety_car / virtual_safety_car / red_flag: periods derived from the track status
+- pit_stop: pit entry to pit exit, from the in-lap's PitInTime and the out-lap's PitOutTime
+
+Windowed queries are two binary searches: entries are sorted by start time, and
+reach[i] (the latest end among entries 0..i) is non-decreasing, so the first
+entry that can still overlap a window is a searchsorted away as well.
+"""
+import json
+import os
+
+import numpy as np
+
+# Track status codes that open a period, by entry type (7 = VSC ending, still part of the VSC)
+PERIOD_STATUSES = {'4': 'safety_car', '5': 'red_flag', '6': 'virtual_safety_car', '7': 'virtual_safety_car'}
+
+# Entry types; also the order of entries that share a timestamp
+TYPES = ('track_status', 'safety_car', 'virtual_safety_car', 'red_flag', 'race_control', 'pit_stop', 'team_radio')
+_RANK = {name: i for i, name in enumerate(TYPES)}
+
+
+def _time(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return float(value)
+
+
+def _status_code(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return str(int(value)) if isinstance(value, (int, float)) else str(value).strip()
+
+
+def _points(records, entry_type):
+    entries = []
+    for record in records or []:
+        t = _time(record.get('Time'))
+        if t is not None:
+            entries.append(dict({k: v for k, v in record.items() if k != 'Time'}, type=entry_type, time=t, end=None))
+    return entries
+
+
+def _periods(track_status, duration):
+    """SC / VSC / red flag periods: from the status that opens one to the next status that doesn't continue it."""
+    periods = []
+    current = None
+    for record in sorted(track_status or [], key=lambda r: _time(r.get('Time')) or 0.0):
+        t = _time(record.get('Time'))
+        if t is None:
+            continue
+        kind = PERIOD_STATUSES.get(_status_code(record.get('Status')))
+        if current is not None and kind != current['type']:
+            current['end'] = t
+            current['duration'] = round(t - current['time'], 3)
+            current = None
+        if kind is not None and current is None:
+            current = {'type': kind, 'time': t, 'end': None, 'duration': None}
+            periods.append(current)
+    if current is not None and duration is not None:
+        # Still running when the timeline ends
+        current['end'] = max(current['time'], float(duration))
+        current['duration'] = round(current['end'] - current['time'], 3)
+    return periods
+
+
+def _pit_stops(laps):
+    import pandas as pd
+
+    frame = pd.DataFrame(laps or [])
+    if frame.empty or 'PitInTime' not in frame.columns or 'LapNumber' not in frame.columns:
+        return []
+    frame = frame.sort_values(['Driver', 'LapNumber'], kind='stable')
+    nxt = frame.groupby('Driver', sort=False).shift(-1)
+    is_out_lap = nxt['LapNumber'] == frame['LapNumber'] + 1
+    pit_out = nxt['PitOutTime'].where(is_out_lap) if 'PitOutTime' in frame.columns else pd.Series(np.nan, index=frame.index)
+    compound_out = nxt['Compound'].where(is_out_lap) if 'Compound' in frame.columns else pd.Series(None, index=frame.index)
+    stops = []
+    for i in np.flatnonzero(frame['PitInTime'].notna().to_numpy()):
+        row = frame.iloc[i]
+        t = float(row['PitInTime'])
+        end = _time(pit_out.iloc[i])
+        if end is not None and end < t:
+            end = None
+        compound_in = row.get('Compound')
+        stops.append({
+            'type': 'pit_stop',
+            'time': t,
+            'end': end,
+            'duration': round(end - t, 3) if end is not None else None,
+            'Driver': str(row['Driver']),
+            'LapNumber': int(row['LapNumber']),
+            'CompoundIn': compound_in if isinstance(compound_in, str) else None,
+            'CompoundOut': compound_out.iloc[i] if isinstance(compound_out.iloc[i], str) else None,
+        })
+    return stops
+
+
+class Timeline:
+    """Entries sorted by time; entry['id'] is its index, so overlapping windows can be merged client-side."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.time = np.array([e['time'] for e in entries], dtype=np.float64)
+        self.last = np.array([e['time'] if e['end'] is None else e['end'] for e in entries], dtype=np.float64)
+        self.reach = np.maximum.accumulate(self.last) if len(entries) else self.last
+
+    def window(self, start=None, end=None, types=None):
+        """Entries overlapping [start, end): starting before end and not over before start."""
+        i1 = len(self.entries) if end is None else int(np.searchsorted(self.time, end, side='left'))
+        i0 = 0 if start is None else int(np.searchsorted(self.reach, start, side='left'))
+        picked = np.arange(i0, max(i0, i1))
+        if start is not None:
+            picked = picked[self.last[picked] >= start]
+        entries = [self.entries[i] for i in picked]
+        if types:
+            entries = [e for e in entries if e['type'] in types]
+        return entries
+
+    def counts(self):
+        out = {}
+        for entry in self.entries:
+            out[entry['type']] = out.get(entry['type'], 0) + 1
+        return out
+
+    def save(self, entry_dir):
+        with open(os.path.join(entry_dir, 'timeline.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, entry_dir):
+        with open(os.path.join(entry_dir, 'timeline.json'), 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+
+def build_timeline(sections, duration=None, team_radio=None):
+    """Timeline of a replay's sections (plus team radio records, on the same timeline, when available)."""
+    entries = (
+        _points(sections.get('events'), 'track_status')
+        + _periods(sections.get('events'), duration)
+        + _points(sections.get('race_control'), 'race_control')
+        + _pit_stops(sections.get('laps'))
+        + _points(team_radio, 'team_radio')
+    )
+    entries.sort(key=lambda e: (e['time'], _RANK[e['type']]))
+    for i, entry in enumerate(entries):
+        entry['id'] = i
+    return Timeline(entries)
@@ -0,0 +1,294 @@
+"""
+Circuit outline and spatial index.
+
+Built once per race from the position data of the fastest clean lap, and cached
+next to the processed replays (see build_track_job):
+
+- outline: the lap's X/Y path simplified with Ramer-Douglas-Peucker, plus the
+  cumulative arc length at each kept vertex
+- sector boundaries (from the lap's sector session times), corners, marshal
+  lights and marshal sectors (from FastF1's circuit info), placed on that arc length
+- TrackIndex: a KD-tree over the densified lap path that maps any X/Y to its
+  distance along the lap in O(log n)
+
+Distances are in FastF1 position units (1/10 m), measured from the start of the lap.
+"""
+import json
+import os
+
+import numpy as np
+
+from simplify import rdp_mask
+
+# Bump whenever the track payload or index changes (invalidates cached tracks)
+TRACK_VERSION = 1
+
+# RDP tolerance of the served outline (position units, i.e. 0.5 m)
+OUTLINE_TOLERANCE = 5.0
+# Maximum spacing of the KD-tree points along the lap path (position units)
+INDEX_SPACING = 20.0
+
+
+class TrackIndex:
+    """Closed lap path with its arc length, and nearest-point lookup of X/Y -> distance."""
+
+    def __init__(self, x, y):
+        from scipy.spatial import cKDTree
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x[0] != x[-1] or y[0] != y[-1]:
+            x, y = np.append(x, x[0]), np.append(y, y[0])
+        self.x, self.y = x, y
+        seg_len = np.hypot(np.diff(x), np.diff(y))
+        self.distance = np.concatenate(([0.0], np.cumsum(seg_len)))
+        self.length = float(self.distance[-1])
+        self._seg_len = seg_len
+
+        # Densify so the nearest tree point is always on (or next to) the nearest segment
+        steps = np.maximum(1, np.ceil(seg_len / INDEX_SPACING).astype(np.int64))
+        seg = np.repeat(np.arange(len(seg_len)), steps)
+        frac = (np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+        px = x[seg] + frac * (x[seg + 1] - x[seg])
+        py = y[seg] + frac * (y[seg + 1] - y[seg])
+        self._seg = seg
+        self._tree = cKDTree(np.column_stack((px, py)))
+
+    def locate(self, x, y):
+        """
+        (distance along the lap, distance from the path) for each point; NaN where
+        the input is NaN. Near crossings (figure-eight layouts) the closer branch wins.
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        distance = np.full(x.shape, np.nan)
+        offset = np.full(x.shape, np.nan)
+        ok = ~(np.isnan(x) | np.isnan(y))
+        if not ok.any():
+            return distance, offset
+        qx, qy = x[ok], y[ok]
+        _, nearest = self._tree.query(np.column_stack((qx, qy)))
+
+        # Project onto the nearest point's segment and its neighbours, keep the closest
+        n_seg = len(self._seg_len)
+        best_off = np.full(len(qx), np.inf)
+        best_dist = np.zeros(len(qx))
+        for shift in (-1, 0, 1):
+            k = (self._seg[nearest] + shift) % n_seg
+            ax, ay = self.x[k], self.y[k]
+            dx, dy = self.x[k + 1] - ax, self.y[k + 1] - ay
+            norm = dx * dx + dy * dy
+            t = np.divide((qx - ax) * dx + (qy - ay) * dy, norm, out=np.zeros(len(qx)), where=norm > 0)
+            t = np.clip(t, 0.0, 1.0)
+            off = np.hypot(qx - (ax + t * dx), qy - (ay + t * dy))
+            better = off < best_off
+            best_off[better] = off[better]
+            best_dist[better] = self.distance[k][better] + t[better] * self._seg_len[k][better]
+        distance[ok] = np.mod(best_dist, self.length) if self.length > 0 else best_dist
+        offset[ok] = best_off
+        return distance, offset
+
+
+class Track:
+    """The served track payload plus the index built from the full-resolution lap path."""
+
+    def __init__(self, payload, x, y):
+        self.payload = payload
+        self.index = TrackIndex(x, y)
+
+    def locate(self, x, y):
+        return self.index.locate(x, y)
+
+
+def _fastest_lap(laps):
+    """Row of the fastest lap that is not an in/out lap (accurate and not deleted, where known)."""
+    import pandas as pd
+
+    if laps is None or laps.empty or 'LapTime' not in laps.columns or 'LapStartTime' not in laps.columns:
+        return None
+    laps = laps[laps['LapTime'].notna() & laps['LapStartTime'].notna()]
+    for column in ('PitInTime', 'PitOutTime'):
+        if column in laps.columns:
+            laps = laps[laps[column].isna()]
+    if 'Deleted' in laps.columns:
+        laps = laps[laps['Deleted'] != True]
+    if 'IsAccurate' in laps.columns and (laps['IsAccurate'] == True).any():
+        laps = laps[laps['IsAccurate'] == True]
+    if laps.empty:
+        return None
+    return laps.loc[pd.to_timedelta(laps['LapTime']).idxmin()]
+
+
+def _lap_path(session, lap):
+    """(time, x, y) position samples of one lap, in session seconds."""
+    import pandas as pd
+
+    pos_data = getattr(session, 'pos_data', None)
+    driver = str(lap['DriverNumber'])
+    if isinstance(pos_data, dict) and driver in pos_data:
+        pos = pos_data[driver]
+    else:
+        # Lap rows of a FastF1 Laps table can slice the position data themselves
+        pos = lap.get_pos_data()
+    t = pd.to_timedelta(pos['Time']).dt.total_seconds().to_numpy(dtype=np.float64)
+    x = pd.to_numeric(pos['X'], errors='coerce').to_numpy(dtype=np.float64)
+    y = pd.to_numeric(pos['Y'], errors='coerce').to_numpy(dtype=np.float64)
+    start = pd.to_timedelta(lap['LapStartTime']).total_seconds()
+    end = start + pd.to_timedelta(lap['LapTime']).total_seconds()
+    inside = (t >= start) & (t <= end) & ~(np.isnan(x) | np.isnan(y))
+    t, x, y = t[inside], x[inside], y[inside]
+    order = np.argsort(t, kind='stable')
+    t, x, y = t[order], x[order], y[order]
+    # Stationary repeats add nothing to the outline and give zero-length segments
+    moved = np.ones(len(x), dtype=bool)
+    moved[1:] = (np.diff(x) != 0) | (np.diff(y) != 0)
+    return t[moved], x[moved], y[moved]
+
+
+def _rounded(values, decimals=1):
+    return [round(float(v), decimals) for v in values]
+
+
+def _sectors(lap, t, x, y, index):
+    """Timing sectors as [start, end) distances, split where the lap crossed Sector1/2SessionTime."""
+    import pandas as pd
+
+    cuts = []
+    for column in ('Sector1SessionTime', 'Sector2SessionTime'):
+        value = lap.get(column)
+        if value is None or pd.isna(value):
+            return []
+        at = pd.to_timedelta(value).total_seconds()
+        distance, _ = index.locate(np.interp(at, t, x), np.interp(at, t, y))
+        cuts.append(float(distance[0]))
+    bounds = [0.0] + cuts + [index.length]
+    return [
+        {"number": i + 1, "start": round(bounds[i], 1), "end": round(bounds[i + 1], 1)}
+        for i in range(3)
+    ]
+
+
+def _circuit_points(session, index):
+    """Corners / marshal lights / marshal sectors from FastF1 circuit info, with their distance on the lap."""
+    import pandas as pd
+
+    points = {"corners": [], "marshal_lights": [], "marshal_sectors": []}
+    try:
+        info = session.get_circuit_info()
+    except Exception as e:
+        print(f"Circuit info unavailable: {e}")
+        return points, None
+    if info is None:
+        return points, None
+    for name in points:
+        frame = getattr(info, name, None)
+        if frame is None or frame.empty:
+            continue
+        distance, _ = index.locate(frame['X'].to_numpy(), frame['Y'].to_numpy())
+        for (_, row), d in zip(frame.iterrows(), distance):
+            letter = row.get('Letter')
+            points[name].append({
+                "number": int(row['Number']) if pd.notna(row.get('Number')) else None,
+                "letter": letter if isinstance(letter, str) else "",
+                "x": round(float(row['X']), 1),
+                "y": round(float(row['Y']), 1),
+                "angle": round(float(row['Angle']), 1) if pd.notna(row.get('Angle')) else None,
+                "distance": round(float(d), 1) if d == d else None,
+            })
+    rotation = getattr(info, 'rotation', None)
+    return points, float(rotation) if rotation is not None and pd.notna(rotation) else None
+
+
+def build_track(session, tolerance=OUTLINE_TOLERANCE):
+    """Track for a loaded session (laps and position data), or None if no lap has usable positions."""
+    import pandas as pd
+
+    lap = _fastest_lap(getattr(session, 'laps', None))
+    if lap is None:
+        return None
+    t, x, y = _lap_path(session, lap)
+    if len(x) < 10:
+        return None
+    index = TrackIndex(x, y)
+    keep = rdp_mask(index.x, index.y, tolerance)
+    points, rotation = _circuit_points(session, index)
+    payload = {
+        "version": TRACK_VERSION,
+        "length": round(index.length, 1),
+        "lap": {
+            "driver": str(lap['DriverNumber']),
+            "lap_number": int(lap['LapNumber']) if pd.notna(lap.get('LapNumber')) else None,
+            "lap_time": pd.to_timedelta(lap['LapTime']).total_seconds(),
+            "samples": int(len(x)),
+        },
+        "bounds": {
+            "x_min": round(float(x.min()), 1), "x_max": round(float(x.max()), 1),
+            "y_min": round(float(y.min()), 1), "y_max": round(float(y.max()), 1),
+        },
+        "rotation": rotation,
+        # Closed polyline: the last vertex repeats the first, at distance == length
+        "outline": {
+            "x": _rounded(index.x[keep]),
+            "y": _rounded(index.y[keep]),
+            "distance": _rounded(index.distance[keep]),
+        },
+        "sectors": _sectors(lap, t, x, y, index),
+        **points,
+    }
+    return Track(payload, x, y)
+
+
+def save_track(track, entry_dir):
+    np.savez(os.path.join(entry_dir, 'track.npz'), x=track.index.x, y=track.index.y)
+    with open(os.path.join(entry_dir, 'track.json'), 'w', encoding='utf-8') as f:
+        json.dump(track.payload, f, separators=(',', ':'))
+
+
+def load_track(entry_dir):
+    with open(os.path.join(entry_dir, 'track.json'), 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    with np.load(os.path.join(entry_dir, 'track.npz')) as arrays:
+        return Track(payload, arrays['x'], arrays['y'])
+
+
+def track_cache_key(year, race_name, session_type='R'):
+    from replay_cache import make_cache_key
+
+    # No resampling involved: the rate slot of the key names the artifact instead
+    return make_cache_key(year, race_name, session_type, 'track', TRACK_VERSION)
+
+
+def publish_track(cache_root, year, race_name, session_type, session):
+    """
+    Build the track from an already loaded session and store it unless it is cached.
+    Returns 'cached', 'built' or None (no usable lap).
+    """
+    from replay_cache import ReplayCache
+
+    cache = ReplayCache(cache_root, max_memory_items=0, dump=save_track, load=load_track)
+    key, params = track_cache_key(year, race_name, session_type)
+    if cache.on_disk(key):
+        return 'cached'
+    track = build_track(session)
+    if track is None:
+        return None
+    cache.put(key, track, params=params)
+    return 'built'
+
+
+def build_track_job(cache_root, fastf1_cache_dir, year, race_name, session_type='R'):
+    """Process-pool entry point: load the session and publish its track. Returns 'cached' or 'built'."""
+    import fastf1
+
+    from sessions import load_session
+
+    if fastf1_cache_dir:
+        fastf1.Cache.enable_cache(fastf1_cache_dir)
+    key, params = track_cache_key(year, race_name, session_type)
+    if os.path.isfile(os.path.join(cache_root, key, 'key.json')):
+        return 'cached'
+    session = load_session(year, race_name, session_type, weather=False, messages=False)
+    result = publish_track(cache_root, year, race_name, session_type, session)
+    if result is None:
+        raise LookupError(f"No lap with position data for {year} {race_name}")
+    return result